@@ -0,0 +1,209 @@
+"""Core module for the local cache of SlurmJob objects shared across the app."""
+import threading
+from collections import defaultdict
+from collections.abc import Iterator
+from typing import Any, Generic, TypeVar
+
+from prometheus_client import REGISTRY
+from pydantic import BaseModel
+
+from pykubeslurm.metrics import GaugeCollector
+from pykubeslurm.schemas import Job, KubernetesEventType
+
+M = TypeVar("M", bound=BaseModel)
+
+
+def join_key(namespace: None | str, name: str) -> str:
+    """Build the `<namespace>/<name>` key of an object, or just its name if it has no namespace."""
+    return f"{namespace}/{name}" if namespace else name
+
+
+def split_key(key: str) -> tuple[None | str, str]:
+    """Split an object key into its namespace (None if it has none) and its name."""
+    namespace, _, name = key.rpartition("/")
+    return namespace or None, name
+
+
+def object_key(obj: dict[str, Any]) -> str:
+    """Return the key identifying an object across namespaces."""
+    return join_key(obj["metadata"].get("namespace"), obj["metadata"]["name"])
+
+
+class JobStore:
+    """
+    Thread-safe local store of SlurmJob objects.
+
+    The store is fed by the event listener (one list, then a watch) and indexes the objects by
+    key (see `object_key`), by namespace, by `status.state` and by `status.slurmJobId`, so
+    every other component can read the SlurmJobs without calling the Kubernetes API.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.RLock()
+        self._objects: dict[str, dict[str, Any]] = {}
+        self._by_namespace: defaultdict[None | str, set[str]] = defaultdict(set)
+        self._by_state: defaultdict[None | str, set[str]] = defaultdict(set)
+        self._by_slurm_job_id: dict[int, str] = {}
+        self.resource_version: None | str = None
+
+    @staticmethod
+    def _status(obj: dict[str, Any]) -> dict[str, Any]:
+        return obj.get("status") or {}
+
+    def _index(self, obj: dict[str, Any]) -> None:
+        key = object_key(obj)
+        status = self._status(obj)
+        self._by_namespace[obj["metadata"].get("namespace")].add(key)
+        self._by_state[status.get("state")].add(key)
+        if status.get("slurmJobId") is not None:
+            self._by_slurm_job_id[status["slurmJobId"]] = key
+
+    def _unindex(self, obj: dict[str, Any]) -> None:
+        key = object_key(obj)
+        status = self._status(obj)
+        self._by_namespace[obj["metadata"].get("namespace")].discard(key)
+        self._by_state[status.get("state")].discard(key)
+        if self._by_slurm_job_id.get(status.get("slurmJobId")) == key:  # type: ignore
+            del self._by_slurm_job_id[status["slurmJobId"]]
+
+    def upsert(self, obj: dict[str, Any]) -> None:
+        """Insert or replace an object in the store."""
+        with self._lock:
+            previous = self._objects.get(object_key(obj))
+            if previous is not None:
+                self._unindex(previous)
+            self._objects[object_key(obj)] = obj
+            self._index(obj)
+
+    def delete(self, obj: dict[str, Any]) -> None:
+        """Remove an object from the store."""
+        with self._lock:
+            previous = self._objects.pop(object_key(obj), None)
+            if previous is not None:
+                self._unindex(previous)
+
+    def replace(
+        self, objects: list[dict[str, Any]], resource_version: None | str
+    ) -> list[dict[str, Any]]:
+        """
+        Replace the whole content of the store, usually with the result of a list call.
+
+        Args:
+            objects: The objects now present in the cluster.
+            resource_version: The resource version the objects were listed at.
+
+        Returns:
+            list: The watch-like events (`type` and `object`) turning the previous content of
+                the store into the new one.
+        """
+        events: list[dict[str, Any]] = []
+        with self._lock:
+            listed_keys = {object_key(obj) for obj in objects}
+            for key, previous in list(self._objects.items()):
+                if key not in listed_keys:
+                    self.delete(previous)
+                    events.append({"type": KubernetesEventType.DELETED, "object": previous})
+            for obj in objects:
+                cached = self._objects.get(object_key(obj))
+                if cached is None:
+                    events.append({"type": KubernetesEventType.ADDED, "object": obj})
+                elif (
+                    cached["metadata"].get("resourceVersion")
+                    != obj["metadata"].get("resourceVersion")
+                ):
+                    events.append({"type": KubernetesEventType.MODIFIED, "object": obj})
+                self.upsert(obj)
+            self.resource_version = resource_version
+        return events
+
+    def get(self, key: str) -> None | dict[str, Any]:
+        """Return the object with the given key, if any."""
+        return self._objects.get(key)
+
+    def by_namespace(self, namespace: None | str) -> list[dict[str, Any]]:
+        """Return the objects of the given namespace."""
+        with self._lock:
+            return [self._objects[key] for key in self._by_namespace.get(namespace, ())]
+
+    def by_state(self, *states: None | str) -> list[dict[str, Any]]:
+        """Return the objects whose `status.state` is one of the given states."""
+        with self._lock:
+            return [
+                self._objects[key] for state in states for key in self._by_state.get(state, ())
+            ]
+
+    def count_by_state(self) -> dict[None | str, int]:
+        """Return the number of objects in each `status.state`."""
+        with self._lock:
+            return {state: len(keys) for state, keys in self._by_state.items()}
+
+    def by_slurm_job_id(self, slurm_job_id: int) -> None | dict[str, Any]:
+        """Return the object backed by the given Slurm job ID, if any."""
+        with self._lock:
+            key = self._by_slurm_job_id.get(slurm_job_id)
+            return self._objects.get(key) if key is not None else None
+
+    def list(self) -> list[dict[str, Any]]:
+        """Return every object in the store."""
+        with self._lock:
+            return list(self._objects.values())
+
+    def __len__(self) -> int:
+        return len(self._objects)
+
+
+job_store = JobStore()
+
+
+class ModelCache(Generic[M]):
+    """
+    Thread-safe cache of the validated models of the objects, one per object key.
+
+    A model is kept along with the resource version it was validated at, and validated again
+    only once the object changes, so the same version of an object is never validated twice.
+    """
+
+    def __init__(self, model: type[M]) -> None:
+        """
+        Args:
+            model: The pydantic model validating the objects.
+        """
+        self._model = model
+        self._lock = threading.Lock()
+        self._models: dict[str, tuple[str, M]] = {}
+
+    def get(self, obj: dict[str, Any]) -> M:
+        """Return the validated model of an object, validating it if it changed."""
+        key = object_key(obj)
+        resource_version = obj["metadata"].get("resourceVersion")
+        with self._lock:
+            cached = self._models.get(key)
+        if cached is not None and resource_version is not None and cached[0] == resource_version:
+            return cached[1]
+
+        model = self._model(**obj)
+        if resource_version is not None:
+            with self._lock:
+                self._models[key] = (resource_version, model)
+        return model
+
+    def forget(self, obj: dict[str, Any]) -> None:
+        """Drop the model of an object, e.g. once it is deleted."""
+        with self._lock:
+            self._models.pop(object_key(obj), None)
+
+    def __len__(self) -> int:
+        return len(self._models)
+
+
+job_models = ModelCache(Job)
+
+
+def _job_counts() -> Iterator[tuple[list[str], float]]:
+    for state, count in job_store.count_by_state().items():
+        yield [state or "NONE"], count
+
+
+REGISTRY.register(
+    GaugeCollector("pykubeslurm_jobs", "Number of SlurmJobs per state.", ["state"], _job_counts)
+)
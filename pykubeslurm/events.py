@@ -1,37 +1,337 @@
 """Core module for event based logic operations."""
-import threading
+import asyncio
+import concurrent.futures
 import time
+from collections.abc import Iterator
+from http import HTTPStatus
+from typing import Any
 
-from kubernetes import client, watch
+from kubernetes.client.exceptions import ApiException
 from loguru import logger
+from prometheus_client import REGISTRY
 
-from pykubeslurm.helpers import handle_k8s_event
-from pykubeslurm.schemas import KubernetesEvent
+from pykubeslurm.cache import job_models, job_store, object_key
+from pykubeslurm.helpers import (
+    ACTIVE_LABEL,
+    ACTIVE_SELECTOR,
+    FINISHED_JOB_STATES,
+    handle_k8s_event,
+    job_submitter,
+)
+from pykubeslurm.kube_client import async_kubernetes_client
+from pykubeslurm.leader import coordinator, shard_of
+from pykubeslurm.ledger import ledger
+from pykubeslurm.metrics import WATCH_RESTARTS, GaugeCollector, time_kubernetes_call
+from pykubeslurm.resilience import retry_policy
+from pykubeslurm.schemas import KubernetesEvent, KubernetesEventType
 from pykubeslurm.settings import SETTINGS
+from pykubeslurm.workqueue import WorkerPool, WorkQueue
 
+# Workers of the running event listener, exposing the queue depth and the workers latency
+event_workers: None | WorkerPool[KubernetesEvent] = None
+
+
+def _queue_depths() -> Iterator[tuple[list[str], float]]:
+    if event_workers is not None:
+        yield ["events"], len(event_workers.queue)
+    yield ["submissions"], job_submitter.pending
+
+
+REGISTRY.register(
+    GaugeCollector(
+        "pykubeslurm_queue_depth", "Number of items waiting in a queue.", ["queue"], _queue_depths
+    )
+)
+
+
+def merge_events(pending: KubernetesEvent, event: KubernetesEvent) -> KubernetesEvent:
+    """
+    Merge two events of the same object into one.
+
+    The latest object always wins, but an object that was added and then modified before
+    being handled still has to be submitted, so the event keeps the ADDED type.
+    """
+    if (
+        pending.type == KubernetesEventType.ADDED
+        and event.type == KubernetesEventType.MODIFIED
+    ):
+        return event.model_copy(update={"type": KubernetesEventType.ADDED})
+    return event
+
+
+def _dispatch(queue: WorkQueue[KubernetesEvent], event: KubernetesEvent) -> None:
+    """Put an event on the work queue, keyed by its object, if this replica owns the object."""
+    if coordinator.owns(event.object):
+        queue.add(object_key(event.object), event)
+
+
+def _spec_of(obj: dict[str, Any]) -> dict[str, Any]:
+    return {key: value for key, value in obj.items() if key not in ("metadata", "status")}
+
+
+def is_noop_event(previous: None | dict[str, Any], event: KubernetesEvent) -> bool:
+    """
+    Tell whether an event can be dropped without being handled.
+
+    Replays of a version of an object already seen are dropped, and so are the MODIFIED events
+    leaving its spec untouched, such as the ones caused by the status patches of the operator:
+    the spec only changes along with `metadata.generation`. Only the metadata is looked at (the
+    raw spec, for objects without a generation), so the events are dropped before the SlurmJob
+    is validated. The events of a SlurmJob whose `status.observedGeneration` lags behind its
+    generation are kept all the same, so a spec change that couldn't be applied yet, e.g. made
+    while the job was waiting to be submitted, is applied with the next status patch.
+
+    Args:
+        previous: The version of the object in the store before the event, if any.
+        event: The event to handle.
+    """
+    if previous is None or event.type == KubernetesEventType.DELETED:
+        return False
+    metadata = event.object["metadata"]
+    previous_metadata = previous["metadata"]
+    if (
+        metadata.get("resourceVersion") is not None
+        and metadata.get("resourceVersion") == previous_metadata.get("resourceVersion")
+    ):
+        return True
+    if event.type != KubernetesEventType.MODIFIED:
+        return False
+    if metadata.get("generation") is not None and previous_metadata.get("generation") is not None:
+        observed_generation = (event.object.get("status") or {}).get("observedGeneration")
+        if observed_generation is not None and observed_generation != metadata["generation"]:
+            return False
+        return metadata["generation"] == previous_metadata["generation"]
+    return _spec_of(previous) == _spec_of(event.object)
+
+
+def _is_watched(obj: dict[str, Any]) -> bool:
+    """Tell whether an object lives in one of the namespaces handled by the operator."""
+    if not SETTINGS.WATCH_NAMESPACES or "*" in SETTINGS.WATCH_NAMESPACES:
+        return True
+    return obj["metadata"].get("namespace") in SETTINGS.WATCH_NAMESPACES
+
+
+def _objects_path() -> str:
+    """
+    Return the API path of the SlurmJobs of the handled namespaces.
+
+    A single namespace is listed directly. Many namespaces, or the whole cluster, are listed
+    (and watched) at once across the cluster, and the other namespaces are filtered out locally.
+    """
+    path = f"/apis/{SETTINGS.CRD_GROUP}/{SETTINGS.CRD_VERSION}"
+    if not SETTINGS.WATCH_NAMESPACES:
+        path += f"/namespaces/{SETTINGS.NAMESPACE}"
+    return f"{path}/{SETTINGS.JOB_CRD_PLURAL}"
+
+
+def _take_over(queue: WorkQueue[KubernetesEvent], shards: set[int]) -> None:
+    """Handle every SlurmJob of the shards this replica just took over as if it was added."""
+    for resource in job_store.list():
+        if shard_of(resource, coordinator.shard_count) in shards:
+            _dispatch(
+                queue,
+                KubernetesEvent(
+                    type=KubernetesEventType.ADDED, object=resource, raw_object=resource
+                ),
+            )
+
+
+async def _drain(shards: set[int]) -> None:
+    """Wait for the events and the submissions in progress on the given shards to be done."""
+
+    shard_count = coordinator.shard_count
+
+    def _in_shards(resource: dict[str, Any]) -> bool:
+        return shard_of(resource, shard_count) in shards
+
+    if event_workers is not None:
+        await event_workers.drain(lambda event: _in_shards(event.object))
+    # after the events, which may queue submissions
+    await job_submitter.drain(
+        lambda job_schema: _in_shards(job_schema.model_dump(include={"metadata"}))
+    )
+
+
+async def _relist(queue: WorkQueue[KubernetesEvent]) -> None | str:
+    """
+    List every active SlurmJob, sync the local store and handle what changed since the last sync.
+
+    The SlurmJobs are listed `LIST_PAGE_SIZE` at a time, and the finished ones, labeled as such
+    (see `pykubeslurm.helpers.mark_finished`), are left out by the API server.
+
+    Returns:
+        str: The resource version to start watching from.
+    """
+    resource_version = None
+    items: list[dict[str, Any]] = []
+    with time_kubernetes_call("list"):
+        async for page in async_kubernetes_client().list_pages(
+            _objects_path(), limit=SETTINGS.LIST_PAGE_SIZE, labelSelector=ACTIVE_SELECTOR
+        ):
+            resource_version = page.get("metadata", {}).get("resourceVersion")
+            items.extend(resource for resource in page.get("items") or [] if _is_watched(resource))
+    await asyncio.to_thread(ledger.prune, [resource["metadata"].get("uid") for resource in items])
+    # SlurmJobs with a status were submitted, maybe before the ledger knew about them
+    await asyncio.to_thread(
+        ledger.backfill,
+        [
+            (
+                resource["metadata"]["uid"],
+                resource["metadata"]["name"],
+                resource["status"].get("slurmJobId"),
+            )
+            for resource in items
+            if (resource.get("status") or {}).get("state") is not None
+            and resource["metadata"].get("uid") is not None
+        ],
+    )
+    previous = {object_key(resource): resource for resource in job_store.list()}
+    for event in job_store.replace(items, resource_version):
+        k8s_event = KubernetesEvent(raw_object=event["object"], **event)
+        if _left_selection(k8s_event):
+            await _forget(k8s_event.object)
+        elif not is_noop_event(previous.get(object_key(k8s_event.object)), k8s_event):
+            _dispatch(queue, k8s_event)
+    return resource_version
+
+
+def _left_selection(event: KubernetesEvent) -> bool:
+    """
+    Tell whether a DELETED event is sent because the SlurmJob finished, not because it was deleted.
+
+    Finished SlurmJobs are labeled as such and then left out of the list and the watch, which
+    report them as deleted. When the label change itself was missed, e.g. across a relist, the
+    last version seen of the SlurmJob is reported instead, so its state tells it apart.
+    """
+    if event.type != KubernetesEventType.DELETED:
+        return False
+    labels = event.object["metadata"].get("labels") or {}
+    state = (event.object.get("status") or {}).get("state")
+    return labels.get(ACTIVE_LABEL) == "false" or state in FINISHED_JOB_STATES
+
+
+async def _forget(obj: dict[str, Any]) -> None:
+    """Drop what is kept about a SlurmJob that left the selection: it needs nothing else."""
+    job_models.forget(obj)
+    await asyncio.to_thread(ledger.forget, [obj["metadata"].get("uid")])
+
+
+def _watch_backoff(failures: int) -> float:
+    """Return the time in seconds to wait before watching again after consecutive failures."""
+    return min(retry_policy.backoff(failures), SETTINGS.EVENT_LISTENER_TIMEOUT)
+
+
+async def _watch(queue: WorkQueue[KubernetesEvent]) -> None:
+    """Keep the local store in sync with the API server and dispatch the events, forever."""
+    resource_version = None
+    failures = 0
+    while True:
+        try:
+            if resource_version is None:
+                resource_version = await _relist(queue)
+            async for event in async_kubernetes_client().watch(
+                _objects_path(),
+                resourceVersion=resource_version,
+                allowWatchBookmarks=True,
+                labelSelector=ACTIVE_SELECTOR,
+            ):
+                failures = 0
+                k8s_event = KubernetesEvent(raw_object=event["object"], **event)
+                if k8s_event.type != KubernetesEventType.BOOKMARK and _is_watched(
+                    k8s_event.object
+                ):
+                    previous = job_store.get(object_key(k8s_event.object))
+                    if k8s_event.type == KubernetesEventType.DELETED:
+                        job_store.delete(k8s_event.object)
+                    else:
+                        job_store.upsert(k8s_event.object)
+                    if _left_selection(k8s_event):
+                        # labeled as finished, not deleted: nothing to do but forget it
+                        await _forget(k8s_event.object)
+                    elif not is_noop_event(previous, k8s_event):
+                        _dispatch(queue, k8s_event)
+                resource_version = k8s_event.object["metadata"].get(
+                    "resourceVersion", resource_version
+                )
+            WATCH_RESTARTS.labels(reason="closed").inc()
+        except ApiException as err:
+            if err.status == HTTPStatus.GONE:
+                logger.warning(f"Resource version {resource_version} expired. Relisting.")
+                WATCH_RESTARTS.labels(reason="gone").inc()
+                resource_version = None
+                continue
+            logger.exception(err)
+            WATCH_RESTARTS.labels(reason="error").inc()
+            failures += 1
+            await asyncio.sleep(_watch_backoff(failures))
+        except Exception as err:
+            # keep the watch alive
+            logger.exception(err)
+            WATCH_RESTARTS.labels(reason="error").inc()
+            failures += 1
+            await asyncio.sleep(_watch_backoff(failures))
+
+
+async def event_listener(shutdown: asyncio.Event) -> None:
+    """
+    Listen for kubernetes events until `shutdown` is set.
+
+    The SlurmJobs of every handled namespace (see `WATCH_NAMESPACES`) go through a single
+    stream: they are listed once and then watched from the last resource version seen, which
+    is kept across restarts of the watch (bookmarks included). A new list is only made when the
+    API server no longer has that resource version (410 Gone).
+
+    The events are handled by a pool of `EVENT_WORKERS` workers: events of different objects
+    run concurrently while the events of the same object run in order. New jobs are submitted
+    by the job submitter as they come.
+
+    Every replica keeps the whole store up to date, but only handles the events of the
+    SlurmJobs it owns (see `pykubeslurm.leader`).
+
+    On shutdown, the watch is cancelled right away, then the events already received and the
+    queued submissions are drained for up to `SHUTDOWN_TIMEOUT` seconds.
+    """
+    global event_workers
 
-def event_listener(
-    thread_event: threading.Event,
-) -> None:
-    """Listen for kubernetes events."""
     assert hasattr(logger, "focus")  # make mypy happy
     with logger.focus("PyKubeSlurm - Event listener logic"):
-        logger.debug(f"Started thread. ID: {threading.get_ident()}")
-        w = watch.Watch()
-        while not thread_event.is_set():
+        logger.debug("Started the event listener")
+        loop = asyncio.get_running_loop()
+        queue: WorkQueue[KubernetesEvent] = WorkQueue(merge=merge_events)
+        event_workers = WorkerPool(
+            queue,
+            handle_k8s_event,
+            workers=SETTINGS.EVENT_WORKERS,
+            name="EventWorker",
+            retry=retry_policy,
+        )
+        event_workers.start()
+
+        def _on_shards_gained(shards: set[int]) -> None:
+            # called from the leader election thread
+            loop.call_soon_threadsafe(_take_over, queue, shards)
+
+        def _on_shards_released(shards: set[int], timeout: float) -> None:
+            # called from the leader election thread, which waits for the drain
+            drained = asyncio.run_coroutine_threadsafe(_drain(shards), loop)
             try:
-                for event in w.stream(
-                    client.CustomObjectsApi().list_namespaced_custom_object,
-                    group=SETTINGS.CRD_GROUP,
-                    version=SETTINGS.CRD_VERSION,
-                    namespace=SETTINGS.NAMESPACE,
-                    plural=SETTINGS.JOB_CRD_PLURAL,
-                ):
-                    handle_k8s_event(KubernetesEvent(**event))
-            except Exception as err:
-                # keep thread alive
-                logger.exception(err)
-                time.sleep(SETTINGS.EVENT_LISTENER_TIMEOUT)
-        else:
-            w.stop()
-            logger.debug(f"Thread {threading.get_ident()} stopped")
+                drained.result(timeout)
+            except concurrent.futures.TimeoutError:
+                drained.cancel()
+                logger.warning(f"Releasing shards {sorted(shards)} with work still in progress")
+
+        coordinator.add_listener(_on_shards_gained)
+        coordinator.add_drainer(_on_shards_released)
+        job_submitter.start()
+        watch_task = asyncio.create_task(_watch(queue), name="Watch")
+        try:
+            await shutdown.wait()
+        finally:
+            watch_task.cancel()
+            await asyncio.gather(watch_task, return_exceptions=True)
+            draining_started_at = time.monotonic()
+            await event_workers.stop(timeout=SETTINGS.SHUTDOWN_TIMEOUT)
+            await job_submitter.stop(
+                timeout=max(SETTINGS.SHUTDOWN_TIMEOUT - (time.monotonic() - draining_started_at), 0)
+            )
+            logger.debug("Stopped the event listener")
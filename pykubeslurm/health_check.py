@@ -1,7 +1,6 @@
 """Core module for defining the health check server logic."""
-import asyncio
-
 from aiohttp import web
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
 
 from pykubeslurm.settings import SETTINGS
 
@@ -19,27 +18,41 @@ async def health_check(request: web.Request) -> web.Response:
     return web.Response(text="OK")
 
 
-async def main() -> None:
+async def metrics(request: web.Request) -> web.Response:
+    """
+    HTTP request handler exposing the metrics of the operator to Prometheus.
+
+    Args:
+        request: The HTTP request object.
+
+    Returns:
+        web.Response: The metrics in the Prometheus text exposition format.
+    """
+    return web.Response(
+        body=generate_latest(REGISTRY), headers={"Content-Type": CONTENT_TYPE_LATEST}
+    )
+
+
+async def main() -> web.AppRunner:
     """
     Start an aiohttp-based HTTP server to handle health checks.
 
     This function creates a simple HTTP server that responds to GET requests
-    at the '/health' endpoint to indicate the server's health.
+    at the '/health' endpoint to indicate the server's health, and at the
+    '/metrics' endpoint with the metrics of the operator.
+
+    Returns:
+        web.AppRunner: The runner of the server, to clean up when the operator stops.
     """
     host = SETTINGS.HEALTH_CHECK_ADDRESS
     port = SETTINGS.HEALTH_CHECK_PORT
 
     app = web.Application()
     app.router.add_get("/health", health_check)
+    app.router.add_get("/metrics", metrics)
 
     runner = web.AppRunner(app)
     await runner.setup()
     site = web.TCPSite(runner, host, port)
     await site.start()
-
-
-def init_health_check() -> None:
-    """Initialize the health check server."""
-    loop = asyncio.new_event_loop()
-    loop.create_task(main())
-    loop.run_forever()
+    return runner
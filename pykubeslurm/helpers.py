@@ -1,5 +1,6 @@
 """Core module for general helper functions."""
 import asyncio
+import hashlib
 import json
 from collections.abc import Coroutine
 from datetime import datetime
@@ -9,6 +10,11 @@ from typing import Any
 from kubernetes import client
 from loguru import logger
 
+from pykubeslurm.cache import job_models, object_key
+from pykubeslurm.kube_client import api_client
+from pykubeslurm.leader import coordinator
+from pykubeslurm.ledger import ledger
+from pykubeslurm.metrics import EVENT_HANDLING_DURATION, time_kubernetes_call
 from pykubeslurm.schemas import (
     Job,
     JobState,
@@ -18,46 +24,149 @@ from pykubeslurm.schemas import (
     SlurmrestdResponse,
 )
 from pykubeslurm.settings import SETTINGS
-from pykubeslurm.slurmrestd_interface import backend_client, inject_token
-from pykubeslurm.vars import APP_STARTED_AT
-
-
-def handle_k8s_event(event: KubernetesEvent) -> None:
-    """Handle kubernetes events."""
-    if event.type == KubernetesEventType.ADDED:
-        _add_slurm_job(Job(**event.object))
-    if event.type == KubernetesEventType.MODIFIED:
-        _update_slurm_job(Job(**event.object))
-    if event.type == KubernetesEventType.DELETED:
-        _delete_slurm_job(Job(**event.object))
-
-
-def _patch_object_status(name: str, body: dict[Any, Any]) -> None:
-    """Update an object status."""
-    client.CustomObjectsApi().patch_namespaced_custom_object_status(
-        group=SETTINGS.CRD_GROUP,
-        version=SETTINGS.CRD_VERSION,
-        namespace=SETTINGS.NAMESPACE,
-        plural=SETTINGS.JOB_CRD_PLURAL,
-        name=name,
-        body=body,
-    )
+from pykubeslurm.slurmrestd_interface import (
+    SLURM_OVERLOAD_ERRORS,
+    AsyncBackendClient,
+    SlurmrestdAuth,
+    async_backend_client,
+    overload_reason,
+    slurm_errors,
+)
+from pykubeslurm.submitter import JobSubmitter
+from pykubeslurm.throttle import RequestPriority
+
+# Number of hexadecimal characters of the spec hash kept in the SlurmJob status
+SPEC_HASH_LENGTH = 16
+
+# Label set to "false" on the SlurmJobs whose Slurm job is done. New SlurmJobs have no label, so
+# the active ones are selected on the server side with `ACTIVE_SELECTOR`.
+ACTIVE_LABEL = "pykubeslurm/active"
+ACTIVE_SELECTOR = f"{ACTIVE_LABEL}!=false"
+
+FINISHED_JOB_STATES = [JobState.REJECTED, JobState.FAILED, JobState.CANCELLED, JobState.COMPLETED]
+
+
+async def handle_k8s_event(event: KubernetesEvent) -> None:
+    """
+    Handle kubernetes events.
+
+    The SlurmJob is only validated when it has to be acted on, and each version of it only
+    once (see `pykubeslurm.cache.job_models`). Finished SlurmJobs that aren't labeled as such
+    yet, e.g. finished before the label existed, are labeled.
+    """
+    with EVENT_HANDLING_DURATION.labels(type=event.type.value).time():
+        if not coordinator.owns(event.object):
+            # e.g. the shard was lost while the event was waiting in the queue
+            logger.debug(f"SlurmJob {object_key(event.object)} isn't handled here anymore")
+            return
+        if event.type != KubernetesEventType.DELETED and _is_unlabeled_finished_job(event.object):
+            metadata = event.object["metadata"]
+            await mark_finished(metadata["name"], metadata.get("namespace"))
+            return
+        if event.type == KubernetesEventType.ADDED:
+            if event.object["metadata"].get("uid") in ledger:
+                # e.g. listed again on restart: nothing to submit, so nothing to validate
+                if (event.object.get("status") or {}).get("state") is None:
+                    await _restore_status(event.object)
+                return
+            await _add_slurm_job(job_models.get(event.object))
+        if event.type == KubernetesEventType.MODIFIED:
+            await _update_slurm_job(job_models.get(event.object))
+        if event.type == KubernetesEventType.DELETED:
+            await _delete_slurm_job(job_models.get(event.object))
+            job_models.forget(event.object)
+
+
+def custom_objects_api() -> client.CustomObjectsApi:
+    """Return a CustomObjectsApi over the shared Kubernetes API client."""
+    return client.CustomObjectsApi(api_client())
+
+
+def _patch_object_status(name: str, body: dict[Any, Any], namespace: None | str = None) -> None:
+    """Update an object status. The namespace defaults to `NAMESPACE`."""
+    with time_kubernetes_call("patch_status"):
+        custom_objects_api().patch_namespaced_custom_object_status(
+            group=SETTINGS.CRD_GROUP,
+            version=SETTINGS.CRD_VERSION,
+            namespace=namespace or SETTINGS.NAMESPACE,
+            plural=SETTINGS.JOB_CRD_PLURAL,
+            name=name,
+            body=body,
+        )
+
+
+async def patch_object_status(
+    name: str, body: dict[Any, Any], namespace: None | str = None
+) -> None:
+    """Update an object status without blocking the running event loop."""
+    await asyncio.to_thread(_patch_object_status, name, body, namespace)
+
+
+def _patch_object_labels(name: str, labels: dict[str, str], namespace: None | str = None) -> None:
+    """Update an object labels. The namespace defaults to `NAMESPACE`."""
+    with time_kubernetes_call("patch"):
+        custom_objects_api().patch_namespaced_custom_object(
+            group=SETTINGS.CRD_GROUP,
+            version=SETTINGS.CRD_VERSION,
+            namespace=namespace or SETTINGS.NAMESPACE,
+            plural=SETTINGS.JOB_CRD_PLURAL,
+            name=name,
+            body={"metadata": {"labels": labels}},
+        )
+
+
+def _is_unlabeled_finished_job(obj: dict[str, Any]) -> bool:
+    """Tell whether a SlurmJob is finished but not labeled as such yet."""
+    state = (obj.get("status") or {}).get("state")
+    labels = obj["metadata"].get("labels") or {}
+    return state in FINISHED_JOB_STATES and labels.get(ACTIVE_LABEL) != "false"
+
+
+async def mark_finished(name: str, namespace: None | str = None) -> None:
+    """
+    Label a SlurmJob whose Slurm job is done as inactive.
+
+    It then leaves the lists and the watch of the SlurmJobs (see `ACTIVE_SELECTOR`), so the
+    finished SlurmJobs piling up are neither listed nor kept in memory.
+    """
+    await asyncio.to_thread(_patch_object_labels, name, {ACTIVE_LABEL: "false"}, namespace)
+
+
+def spec_hash(spec: dict[str, Any]) -> str:
+    """
+    Return a compact hash of a job spec.
+
+    The spec is serialized canonically, so two equal specs always have the same hash
+    regardless of the order of their keys.
+    """
+    canonical_spec = json.dumps(spec, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical_spec.encode()).hexdigest()[:SPEC_HASH_LENGTH]
 
 
 def _build_job_status_body(
     slurm_job_id: None | int,
-    state: JobState | str,
+    state: None | JobState | str,
     errors: None | list[str],
-    job_spec: dict[str, str | int | list[str | int] | bool | dict[str, Any]],
+    applied_spec: None | dict[str, Any],
+    generation: None | int,
 ) -> dict[str, int | str | list[str] | None]:
-    """Build the job status body."""
-    return {
-        "slurmJobId": slurm_job_id,
+    """
+    Build the job status body, to be sent as a merge patch.
+
+    The fields left as None, but the errors, are omitted, so their current value is kept.
+    """
+    status_body: dict[str, int | str | list[str] | None] = {
         "errors": errors,
-        "state": str(state),
         "updatedAt": datetime_in_string(),
-        "lastAppliedSpec": json.dumps(job_spec),
     }
+    if slurm_job_id is not None:
+        status_body["slurmJobId"] = slurm_job_id
+    if state is not None:
+        status_body["state"] = str(state)
+    if applied_spec is not None:
+        status_body["specHash"] = spec_hash(applied_spec)
+        status_body["observedGeneration"] = generation
+    return status_body
 
 
 def _update_job_crd(
@@ -65,86 +174,287 @@ def _update_job_crd(
     state: None | JobState = None,
     errors: None | list[str],
     name: str,
+    namespace: None | str = None,
     slurm_job_id: None | int = None,
+    applied_spec: None | dict[str, Any] = None,
+    generation: None | int = None,
 ) -> None:
     """
-    Update the status of the Job CRD and insert its spec as an annotation for internal control.
+    Update the status of the Job CRD and record the hash of the spec applied to the Slurm job.
+
+    The status is sent as a single merge patch of the status subresource, without reading the
+    object first. No resource version is sent as a precondition: every field written comes
+    from what was just done in Slurm, not from the current object, and the fields left out
+    are kept as they are.
 
     Args:
-        state: The Slurm job state indicating its submission status.
+        state: The Slurm job state indicating its submission status. Kept if None.
         errors: Errors occurred when submitting the job by Slurmrestd.
         name: Name of the Kubernetes resource.
+        namespace: Namespace of the Kubernetes resource. Defaults to `NAMESPACE`.
+        slurm_job_id: The Slurm job ID. Kept if None.
+        applied_spec: The spec applied to the Slurm job. Kept if None.
+        generation: The `metadata.generation` of the applied spec.
     """
-    object_body = client.CustomObjectsApi().get_namespaced_custom_object(
-        group=SETTINGS.CRD_GROUP,
-        version=SETTINGS.CRD_VERSION,
-        namespace=SETTINGS.NAMESPACE,
-        plural=SETTINGS.JOB_CRD_PLURAL,
-        name=name,
-    )
-    object_body["status"] = _build_job_status_body(
-        slurm_job_id=slurm_job_id
-        if slurm_job_id is not None
-        else object_body.get("status").get("slurmJobId"),
-        state=state if state is not None else object_body.get("status").get("state"),
+    status_body = _build_job_status_body(
+        slurm_job_id=slurm_job_id,
+        state=state,
         errors=errors,
-        job_spec=object_body["spec"],
+        applied_spec=applied_spec,
+        generation=generation,
     )
-    _patch_object_status(name, object_body)
+    _patch_object_status(name, {"status": status_body}, namespace)
 
 
-def _add_slurm_job(job_schema: Job) -> None:
+def _slurm_user(job_schema: Job) -> str:
     """
-    Create a Slurm job by calling the Slurmrestd API.
+    Return the user a Slurm job is submitted and updated as.
+
+    Raises:
+        ValueError: If the user annotated on the SlurmJob isn't allowed in its namespace (see
+            `SLURM_ALLOWED_USERS`). Root never is.
+    """
+    if SETTINGS.SLURM_USER_ANNOTATION is None:
+        return SETTINGS.SLURMRESTD_USER_TOKEN
+    user = job_schema.metadata.annotations.get(SETTINGS.SLURM_USER_ANNOTATION)
+    if user is None:
+        return SETTINGS.SLURMRESTD_USER_TOKEN
+    namespace = job_schema.metadata.namespace or SETTINGS.NAMESPACE
+    allowed_users = SETTINGS.SLURM_ALLOWED_USERS.get(namespace, []) + (
+        SETTINGS.SLURM_ALLOWED_USERS.get("*", [])
+    )
+    if user == "root" or user not in allowed_users:
+        raise ValueError(f"Slurm user {user} isn't allowed in namespace {namespace}")
+    return user
+
+
+async def _record_unconfirmed_submission(job_schema: Job, reason: str) -> None:
+    """
+    Record a submission that may have reached Slurm without its outcome being known.
+
+    Slurm may have created the job anyway, so it is recorded in the ledger to never be
+    submitted again, and its status tells it is unknown. A submission already recorded keeps
+    its ledger entry, e.g. when writing the status of an accepted job failed.
+
+    Args:
+        job_schema: The job schema containing information from the applied manifest.
+        reason: Why the outcome of the submission is unknown.
+    """
+    assert job_schema.metadata.uid is not None  # make mypy happy
+    logger.error(f"Slurmrestd couldn't confirm the submission of the job ({reason})")
+    if await asyncio.to_thread(ledger.__contains__, job_schema.metadata.uid):
+        return
+    await asyncio.to_thread(ledger.record, job_schema.metadata.uid, job_schema.metadata.name, None)
+    await asyncio.to_thread(
+        _update_job_crd,
+        state=JobState.UNKNOWN,
+        errors=[f"Slurmrestd couldn't confirm the submission of the job ({reason})"],
+        name=job_schema.metadata.name,
+        namespace=job_schema.metadata.namespace,
+    )
+
+
+async def _submit_slurm_job(slurmrestd_client: AsyncBackendClient, job_schema: Job) -> None:
+    """
+    Submit a Slurm job and record the outcome in the ledger and in the SlurmJob status.
 
     Args:
+        slurmrestd_client: The client used to reach slurmrestd.
         job_schema: The job schema containing information from the applied manifest.
     """
-    event_creation_timestamp = job_schema.metadata.creation_timestamp
-    assert event_creation_timestamp is not None  # make mypy happy
+    assert job_schema.metadata.uid is not None  # make mypy happy
     assert hasattr(logger, "focus")  # make mypy happy
     with logger.focus("PyKubeSlurm - Event Added"):
-        if event_creation_timestamp > APP_STARTED_AT:
-            job_properties = job_schema.job_properties()
-            job_script = job_properties.pop("script")
-            job_payload = {"script": job_script, "job": job_properties}
-            response = backend_client.post(
-                "/slurm/v0.0.36/job/submit",
-                json=job_payload,
-                auth=lambda r: inject_token(r, "ubuntu"),
+        if not coordinator.owns(job_schema.model_dump(include={"metadata"})):
+            # the shard was lost while the job was waiting to be submitted
+            logger.warning(f"SlurmJob {job_schema.metadata.name} isn't handled here anymore")
+            return
+        try:
+            slurm_user = _slurm_user(job_schema)
+        except ValueError as err:
+            logger.error(f"Rejecting SlurmJob {job_schema.metadata.name}: {err}")
+            await asyncio.to_thread(
+                _update_job_crd,
+                state=JobState.REJECTED,
+                errors=[str(err)],
+                name=job_schema.metadata.name,
+                namespace=job_schema.metadata.namespace,
+            )
+            await mark_finished(job_schema.metadata.name, job_schema.metadata.namespace)
+            return
+        job_properties = job_schema.job_properties()
+        job_script = job_properties.pop("script")
+        job_payload = {"script": job_script, "job": job_properties}
+        response = await slurmrestd_client.post(
+            "/slurm/v0.0.36/job/submit",
+            json=job_payload,
+            auth=SlurmrestdAuth(slurm_user),
+            extensions={"priority": RequestPriority.SUBMISSION},
+        )
+        reported_errors = slurm_errors(response)
+        if reported_errors and not any(
+            err.get("error_number") in SLURM_OVERLOAD_ERRORS for err in reported_errors
+        ):
+            # Slurm rejected the job, whatever the status of the response
+            reason = None
+        else:
+            reason = overload_reason(response)
+        if reason is not None:
+            await _record_unconfirmed_submission(job_schema, reason)
+            return
+        response_json = SlurmrestdJobSubmissionResponse(**response.json())  # type: ignore
+        applied_spec = job_schema.job_properties(exclude={"get_user_environment"})
+        # recorded first, so the job is never submitted twice; a status that couldn't be
+        # written is restored from the ledger (see `_restore_status`)
+        await asyncio.to_thread(
+            ledger.record,
+            job_schema.metadata.uid,
+            job_schema.metadata.name,
+            response_json.get("job_id"),
+            spec=applied_spec,
+        )
+        errors = response_json.get("errors")
+        if errors:
+            logger.error(f"Error submitting job: {errors}")
+            await asyncio.to_thread(
+                _update_job_crd,
+                state=JobState.REJECTED,
+                errors=[err.get("error") for err in errors],
+                name=job_schema.metadata.name,
+                namespace=job_schema.metadata.namespace,
+                slurm_job_id=response_json.get("job_id"),
+                applied_spec=applied_spec,
+                generation=job_schema.metadata.generation,
             )
-            response_json = SlurmrestdJobSubmissionResponse(**response.json())  # type: ignore
-            errors = response_json.get("errors")
-            if errors:
-                logger.error(f"Error submitting job: {errors}")
-                _update_job_crd(
-                    state=JobState.REJECTED,
-                    errors=[err.get("error") for err in errors],
-                    name=job_schema.metadata.name,
-                    slurm_job_id=response_json.get("job_id"),
-                )
-            else:
-                _update_job_crd(
-                    state=JobState.SUBMITTED,
-                    errors=None,
-                    name=job_schema.metadata.name,
-                    slurm_job_id=response_json.get("job_id"),
-                )
-            logger.success(f"SlurmJob {job_schema.metadata.name} submitted successfully.")
+            await mark_finished(job_schema.metadata.name, job_schema.metadata.namespace)
         else:
-            logger.warning("Event was created before PyKubeSlurm was started. Skipping.")
+            await asyncio.to_thread(
+                _update_job_crd,
+                state=JobState.SUBMITTED,
+                errors=None,
+                name=job_schema.metadata.name,
+                namespace=job_schema.metadata.namespace,
+                slurm_job_id=response_json.get("job_id"),
+                applied_spec=applied_spec,
+                generation=job_schema.metadata.generation,
+            )
+        logger.success(f"SlurmJob {job_schema.metadata.name} submitted successfully.")
+
+
+job_submitter = JobSubmitter(_submit_slurm_job, unconfirmed=_record_unconfirmed_submission)
 
 
-def _update_slurm_job(job_schema: Job) -> None:
+async def _restore_status(obj: dict[str, Any]) -> None:
     """
-    Update a Slurm job by calling the Slurmrestd API.
+    Write the status of a submitted SlurmJob from the ledger.
+
+    Submissions are recorded in the ledger before the status of their SlurmJob is written, so
+    a job is never submitted twice; if writing the status then failed, it is written again
+    here. Without a Slurm job ID, the outcome of the submission is unknown.
+    """
+    metadata = obj["metadata"]
+    slurm_job_id = ledger.slurm_job_id(metadata["uid"])
+    logger.warning(f"SlurmJob {metadata['name']} was submitted but has no status. Restoring it.")
+    if slurm_job_id is None:
+        await asyncio.to_thread(
+            _update_job_crd,
+            state=JobState.UNKNOWN,
+            errors=["The submission of the job couldn't be confirmed"],
+            name=metadata["name"],
+            namespace=metadata.get("namespace"),
+        )
+        return
+    await asyncio.to_thread(
+        _update_job_crd,
+        state=JobState.SUBMITTED,
+        errors=None,
+        name=metadata["name"],
+        namespace=metadata.get("namespace"),
+        slurm_job_id=slurm_job_id,
+        applied_spec=ledger.applied_spec(metadata["uid"]),
+    )
+
+
+async def _add_slurm_job(job_schema: Job) -> None:
+    """
+    Create a Slurm job by calling the Slurmrestd API.
+
+    Jobs are submitted at most once: the submission ledger, backfilled from the status of the
+    objects submitted before it knew about them (see `pykubeslurm.events._relist`), tells which
+    ones were already submitted. The others are handed to the job submitter.
 
     Args:
         job_schema: The job schema containing information from the applied manifest.
     """
+    uid = job_schema.metadata.uid
+    assert uid is not None  # make mypy happy
+    assert hasattr(logger, "focus")  # make mypy happy
+    with logger.focus("PyKubeSlurm - Event Added"):
+        if uid in ledger:
+            logger.debug(f"SlurmJob {job_schema.metadata.name} was already submitted. Skipping.")
+            return
+        if job_schema.status is not None and job_schema.status.state is not None:
+            # e.g. added with a status since the last listing
+            logger.debug(f"SlurmJob {job_schema.metadata.name} has a status. Recording it.")
+            await asyncio.to_thread(
+                ledger.record, uid, job_schema.metadata.name, job_schema.status.slurm_job_id
+            )
+            return
+
+        logger.debug(f"Queueing SlurmJob {job_schema.metadata.name} for submission")
+        job_submitter.add(job_schema)
+
+
+def _legacy_applied_spec(job_schema: Job) -> None | dict[str, Any]:
+    """
+    Return the spec applied to the Slurm job of a SlurmJob whose status has no spec hash.
+
+    Such SlurmJobs were submitted by versions that kept the whole applied spec in the
+    `lastAppliedSpec` status field instead; the ledger is looked up if it is missing too.
+    """
     assert job_schema.status is not None  # make mypy happy
-    if job_schema.status.last_applied_spec is None:
-        # simply skip since the resource was actually created
+    if job_schema.status.last_applied_spec is not None:
+        legacy_spec = json.loads(job_schema.status.last_applied_spec)
+        legacy_spec.pop("get_user_environment", None)
+        return legacy_spec
+    if job_schema.metadata.uid is None:
+        return None
+    return ledger.applied_spec(job_schema.metadata.uid)
+
+
+async def _update_slurm_job(job_schema: Job) -> None:
+    """
+    Update a Slurm job by calling the Slurmrestd API.
+
+    The status only keeps the hash and the generation of the spec last applied to the Slurm
+    job, so most events are dismissed without diffing anything. The applied spec itself is
+    kept in the ledger and only read when the hash of the desired spec differs.
+
+    Args:
+        job_schema: The job schema containing information from the applied manifest.
+    """
+    if job_schema.status is None or job_schema.status.slurm_job_id is None:
+        # e.g. not submitted yet: the spec change is applied once it is (see `is_noop_event`)
+        logger.debug(f"SlurmJob {job_schema.metadata.name} has no Slurm job to update yet")
+        return
+    applied_spec_hash = job_schema.status.spec_hash
+    legacy_spec = None
+    if applied_spec_hash is None:
+        legacy_spec = _legacy_applied_spec(job_schema)
+        if legacy_spec is None:
+            # simply skip since the resource was actually created
+            return
+        applied_spec_hash = spec_hash(legacy_spec)
+    if (
+        job_schema.metadata.generation is not None
+        and job_schema.metadata.generation == job_schema.status.observed_generation
+    ):
+        # only the status or the metadata changed
+        return
+
+    desired_spec = job_schema.job_properties(exclude={"get_user_environment"})
+    if spec_hash(desired_spec) == applied_spec_hash:
+        # Reconcile updated the CRD status. Nothing to update
         return
 
     base_warning_message = Template("Unable to update SlurmJob $name because job state is $state")
@@ -160,50 +470,53 @@ def _update_slurm_job(job_schema: Job) -> None:
         )
         return
 
+    uid = job_schema.metadata.uid
+    assert uid is not None  # make mypy happy
     assert hasattr(logger, "focus")  # make mypy happy
     with logger.focus("PyKubeSlurm - Event Updated"):
-        managed_spec: dict[str, Any] = json.loads(job_schema.status.last_applied_spec)
-        # managed_spec_set = set(managed_spec.items())
-
-        desired_spec = job_schema.job_properties(exclude={"get_user_environment"})
-        # desired_spec_set = set(desired_spec.items())
-
-        # spec_diff_set = desired_spec_set - managed_spec_set
-        # spec_diff_dict = dict(spec_diff_set)
-        spec_diff_dict = {}
-        # logger.debug(spec_diff_dict)
-
-        for desired_key, desired_value in desired_spec.items():
-            if desired_key not in managed_spec:
-                spec_diff_dict[desired_key] = desired_value
-            else:
-                if desired_value != managed_spec[desired_key]:
-                    spec_diff_dict[desired_key] = desired_value
-
+        # without the applied spec, e.g. if the ledger was lost, the whole spec is sent
+        managed_spec = legacy_spec if legacy_spec is not None else ledger.applied_spec(uid) or {}
+        spec_diff_dict = {
+            desired_key: desired_value
+            for desired_key, desired_value in desired_spec.items()
+            if desired_key not in managed_spec or desired_value != managed_spec[desired_key]
+        }
         if spec_diff_dict == {}:
-            # Reconcile updated the CRD status. Nothing to update
+            return
+
+        try:
+            slurm_user = _slurm_user(job_schema)
+        except ValueError as err:
+            logger.error(f"Not updating SlurmJob {job_schema.metadata.name}: {err}")
             return
 
         logger.debug(f"Updating SlurmJob {job_schema.metadata.name} with {spec_diff_dict}")
 
-        response = backend_client.post(
+        response = await async_backend_client().post(
             f"/slurm/v0.0.36/job/{job_schema.status.slurm_job_id}",
             json=spec_diff_dict,
-            auth=lambda r: inject_token(r, "ubuntu"),
+            auth=SlurmrestdAuth(slurm_user),
+            # setting the same values again has no side effect
+            extensions={"priority": RequestPriority.UPDATE, "idempotent": True},
         )
         response_json = SlurmrestdResponse(**response.json())  # type: ignore
         if response_json.get("errors"):
             logger.error(f"Error when updating job: {response_json.get('errors')}")
         else:
-            _update_job_crd(
+            await asyncio.to_thread(ledger.record_spec, uid, desired_spec)
+            await asyncio.to_thread(
+                _update_job_crd,
                 name=job_schema.metadata.name,
+                namespace=job_schema.metadata.namespace,
                 slurm_job_id=job_schema.status.slurm_job_id,
                 errors=None,
+                applied_spec=desired_spec,
+                generation=job_schema.metadata.generation,
             )
             logger.success(f"SlurmJob {job_schema.metadata.name} updated successfully.")
 
 
-def _delete_slurm_job(job_schema: Job) -> None:
+async def _delete_slurm_job(job_schema: Job) -> None:
     """
     Delete a Slurm job by calling the Slurmrestd API.
 
@@ -214,12 +527,34 @@ def _delete_slurm_job(job_schema: Job) -> None:
     # [Reference](https://bugs.schedmd.com/show_bug.cgi?id=18006)
     assert hasattr(logger, "focus")  # make mypy happy
     with logger.focus("PyKubeSlurm - Event Deleted"):
+        if job_schema.metadata.uid is not None:
+            await asyncio.to_thread(ledger.forget, [job_schema.metadata.uid])
         logger.warning(f"Skipping SlurmJob {job_schema.metadata.name} deletion by Slurmrestd")
 
 
-async def run_coroutines(*coros: Coroutine[Any, Any, Any]) -> None:
-    """Run coroutines concurrently."""
-    await asyncio.gather(*coros)
+async def run_coroutines(
+    *coros: Coroutine[Any, Any, Any], concurrency: None | int = None
+) -> list[Any]:
+    """
+    Run coroutines concurrently.
+
+    Args:
+        coros: The coroutines to run.
+        concurrency: Maximum number of coroutines running at the same time. Unbounded if None.
+
+    Returns:
+        list: The coroutines results, in the same order they were given.
+    """
+    if concurrency is None:
+        return await asyncio.gather(*coros)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _run_bounded(coro: Coroutine[Any, Any, Any]) -> Any:
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*(_run_bounded(coro) for coro in coros))
 
 
 def datetime_in_string() -> str:
@@ -0,0 +1,173 @@
+"""Core module for the Kubernetes API clients."""
+import asyncio
+import functools
+import json
+import socket
+import ssl
+import time
+from collections.abc import AsyncIterator
+from typing import Any
+
+import httpx
+from kubernetes import client
+from kubernetes.client.exceptions import ApiException
+from urllib3.connection import HTTPConnection
+
+from pykubeslurm.runtime import runtime, thread_pool_size
+from pykubeslurm.settings import SETTINGS
+from pykubeslurm.throttle import TokenBucket
+
+# Client-side limit of the requests sent to the Kubernetes API by both clients, like client-go's
+kubernetes_rate_limiter = TokenBucket(SETTINGS.KUBERNETES_QPS, SETTINGS.KUBERNETES_BURST)
+
+
+class ThrottledApiClient(client.ApiClient):
+    """Kubernetes API client waiting for the `kubernetes_rate_limiter` before every request."""
+
+    def request(self, *args: Any, **kwargs: Any) -> Any:
+        time.sleep(kubernetes_rate_limiter.reserve())
+        return super().request(*args, **kwargs)
+
+
+@functools.lru_cache(maxsize=None)
+def api_client() -> client.ApiClient:
+    """
+    Return the Kubernetes API client shared across the app, and its pool of connections.
+
+    It is created on first use, so the Kubernetes configuration must be loaded by then. The
+    pool holds a persistent connection per thread running blocking calls (see
+    `pykubeslurm.runtime.thread_pool_size`), kept alive by TCP keep-alive while idle, and
+    responses are gzip-compressed by the API server. Protobuf isn't available for custom
+    resources, so JSON is kept.
+    """
+    configuration = client.Configuration.get_default_copy()
+    configuration.connection_pool_maxsize = thread_pool_size()
+    api = ThrottledApiClient(configuration)
+    api.rest_client.pool_manager.connection_pool_kw["socket_options"] = [
+        *HTTPConnection.default_socket_options,
+        (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+    ]
+    api.set_default_header("Accept-Encoding", "gzip")
+    return api
+
+
+class AsyncKubernetesClient(httpx.AsyncClient):
+    """
+    Asynchronous client of the Kubernetes API, built from the loaded Kubernetes configuration.
+
+    It covers the calls made on the event loop, i.e. listing and watching the SlurmJobs, so
+    they can be cancelled at any time. Errors are raised as `ApiException`, like the official
+    client does. Requests wait for the `kubernetes_rate_limiter` too, and responses are
+    compressed (httpx asks for gzip by default).
+    """
+
+    def __init__(self, configuration: None | client.Configuration = None) -> None:
+        """
+        Args:
+            configuration: The configuration of the cluster. Defaults to the one loaded by
+                `kubernetes.config`.
+        """
+        self.configuration = configuration or client.Configuration.get_default_copy()
+        super().__init__(
+            base_url=self.configuration.host,
+            verify=self._ssl_context(self.configuration),
+            # watches stay open until the API server closes them
+            timeout=httpx.Timeout(SETTINGS.EVENT_LISTENER_TIMEOUT, read=None),
+        )
+
+    @staticmethod
+    def _ssl_context(configuration: client.Configuration) -> bool | ssl.SSLContext:
+        if not configuration.verify_ssl:
+            return False
+        context = ssl.create_default_context(cafile=configuration.ssl_ca_cert)
+        if configuration.cert_file:
+            context.load_cert_chain(configuration.cert_file, configuration.key_file)
+        return context
+
+    def _auth_headers(self) -> dict[str, str]:
+        # refreshes the token of the service account when it is about to expire
+        token = self.configuration.get_api_key_with_prefix("authorization")
+        return {"Authorization": token} if token else {}
+
+    @staticmethod
+    async def _raise_for_status(response: httpx.Response) -> None:
+        if response.is_error:
+            await response.aread()
+            err = ApiException(status=response.status_code, reason=response.reason_phrase)
+            err.body = response.text
+            raise err
+
+    async def get_object(self, path: str, **params: Any) -> dict[str, Any]:
+        """Get the object, or the list of objects, under the given path."""
+        await asyncio.sleep(kubernetes_rate_limiter.reserve())
+        response = await self.get(path, params=params, headers=self._auth_headers())
+        await self._raise_for_status(response)
+        return response.json()
+
+    async def list_pages(
+        self, path: str, limit: int, **params: Any
+    ) -> AsyncIterator[dict[str, Any]]:
+        """
+        List the objects under the given path page by page, yielding the pages as they arrive.
+
+        Every page holds up to `limit` objects, all from the same snapshot, whose resource
+        version is in the metadata of every page. An expired continue token is raised as an
+        `ApiException` with the 410 status.
+        """
+        continue_token = None
+        while True:
+            page_params = {**params, "limit": limit}
+            if continue_token:
+                page_params["continue"] = continue_token
+            page = await self.get_object(path, **page_params)
+            yield page
+            continue_token = page.get("metadata", {}).get("continue")
+            if not continue_token:
+                return
+
+    async def watch(self, path: str, **params: Any) -> AsyncIterator[dict[str, Any]]:
+        """
+        Watch the objects under the given path, yielding the events as they arrive.
+
+        The iteration ends when the API server closes the stream. An expired resource version
+        is raised as an `ApiException` with the 410 status, as the official client does.
+        """
+        await asyncio.sleep(kubernetes_rate_limiter.reserve())
+        async with self.stream(
+            "GET", path, params={**params, "watch": True}, headers=self._auth_headers()
+        ) as response:
+            await self._raise_for_status(response)
+            async for line in response.aiter_lines():
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                if event["type"] == "ERROR":
+                    status = event["object"]
+                    raise ApiException(status=status.get("code"), reason=status.get("message"))
+                yield event
+
+
+_async_kubernetes_client: None | AsyncKubernetesClient = None
+
+
+async def _close_async_kubernetes_client() -> None:
+    global _async_kubernetes_client
+
+    if _async_kubernetes_client is not None:
+        await _async_kubernetes_client.aclose()
+        _async_kubernetes_client = None
+
+
+def async_kubernetes_client() -> AsyncKubernetesClient:
+    """
+    Return the asynchronous Kubernetes client shared by every coroutine of the runtime.
+
+    It is created on first use, so the Kubernetes configuration must be loaded by then, and
+    closed when the runtime stops.
+    """
+    global _async_kubernetes_client
+
+    if _async_kubernetes_client is None:
+        _async_kubernetes_client = AsyncKubernetesClient()
+        runtime.add_cleanup(_close_async_kubernetes_client)
+    return _async_kubernetes_client
@@ -0,0 +1,312 @@
+"""Core module for the lease-based leader election and the sharding of SlurmJobs across replicas."""
+import hashlib
+import math
+import threading
+import time
+from collections.abc import Callable
+from datetime import datetime, timedelta, timezone
+from http import HTTPStatus
+from typing import Any
+
+from kubernetes import client
+from kubernetes.client.exceptions import ApiException
+from loguru import logger
+
+from pykubeslurm.kube_client import api_client
+from pykubeslurm.settings import SETTINGS
+
+LEASE_KIND_LABEL = "pykubeslurm/lease"
+
+# Timeout in seconds of the requests made to the Leases, so a stalled renewal can't outlive them
+REQUEST_TIMEOUT = SETTINGS.LEASE_RENEW_PERIOD
+
+ShardsListener = Callable[[set[int]], None]
+ShardsDrainer = Callable[[set[int], float], None]
+
+
+def shard_of(resource: dict[str, Any], shard_count: int) -> int:
+    """
+    Return the shard a SlurmJob belongs to.
+
+    SlurmJobs are hashed by UID (by name if it has none) into a fixed number of shards, so a
+    SlurmJob never moves to another shard when replicas come and go: only shards do.
+    """
+    key = resource["metadata"].get("uid") or resource["metadata"]["name"]
+    return int.from_bytes(hashlib.sha1(key.encode()).digest()[:8], "big") % shard_count
+
+
+def _expired(lease: client.V1Lease, now: datetime) -> bool:
+    """Tell whether a lease is free to be taken."""
+    spec = lease.spec
+    if spec is None or not spec.holder_identity or spec.renew_time is None:
+        return True
+    return spec.renew_time + timedelta(seconds=spec.lease_duration_seconds or 0) < now
+
+
+class ShardCoordinator:
+    """
+    Split the SlurmJobs between the replicas of the operator with `coordination.k8s.io` Leases.
+
+    Every shard is guarded by a Lease: the replica holding it handles the events, the
+    submissions and the reconciliation of the SlurmJobs of that shard, while the other replicas
+    only keep their cache warm. With a single shard, this is plain leader election.
+
+    With many shards, every replica also renews a member Lease, so each one knows how many
+    replicas are alive and only holds its fair share of the shards, releasing the extra ones
+    for newcomers once the work in progress on them is drained (see `add_drainer`). A replica
+    that can't renew its Leases stops handling any shard right away, and the others take its
+    shards over once the Leases expire. A renewal that hangs is cut short by a request timeout,
+    and this replica gives its shards up on its own once its last successful renewal is
+    `LEASE_DURATION` seconds old, before any other replica can take them.
+    """
+
+    def __init__(self, identity: str, shard_count: int = 1, enabled: bool = True) -> None:
+        """
+        Args:
+            identity: Name of this replica, written as holder of its Leases.
+            shard_count: Number of shards the SlurmJobs are split into.
+            enabled: If False, this replica handles every shard without taking any Lease.
+        """
+        self.identity = identity
+        self.shard_count = shard_count
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._owned: set[int] = set() if enabled else set(range(shard_count))
+        self._renewed_at: None | float = None
+        self._listeners: list[ShardsListener] = []
+        self._drainers: list[ShardsDrainer] = []
+
+    @property
+    def owned_shards(self) -> set[int]:
+        """The shards handled by this replica."""
+        with self._lock:
+            return set(self._owned)
+
+    @property
+    def renewed(self) -> bool:
+        """Whether the Leases of this replica were renewed less than `LEASE_DURATION` ago."""
+        renewed_at = self._renewed_at
+        return renewed_at is not None and time.monotonic() - renewed_at < SETTINGS.LEASE_DURATION
+
+    def owns(self, resource: dict[str, Any]) -> bool:
+        """Tell whether this replica handles the given SlurmJob."""
+        if not self.enabled:
+            return True
+        return self.renewed and shard_of(resource, self.shard_count) in self._owned
+
+    def add_listener(self, listener: ShardsListener) -> None:
+        """Call the given function with the shards this replica takes over."""
+        self._listeners.append(listener)
+
+    def add_drainer(self, drainer: ShardsDrainer) -> None:
+        """
+        Call the given function with the shards this replica is about to release.
+
+        The function is given a timeout in seconds, and must return once the work in progress
+        on the SlurmJobs of those shards is done or the timeout is over.
+        """
+        self._drainers.append(drainer)
+
+    def _drain(self, shards: set[int]) -> None:
+        for drainer in self._drainers:
+            try:
+                drainer(shards, REQUEST_TIMEOUT)
+            except Exception as err:
+                logger.warning(f"Couldn't drain shards {sorted(shards)}: {err}")
+
+    def _lease_name(self, shard: int) -> str:
+        if self.shard_count == 1:
+            return SETTINGS.LEASE_NAME
+        return f"{SETTINGS.LEASE_NAME}-{shard}"
+
+    def _try_hold(
+        self,
+        api: client.CoordinationV1Api,
+        name: str,
+        now: datetime,
+        acquire: bool = True,
+        kind: str = "shard",
+    ) -> bool:
+        """
+        Renew a Lease held by this replica, or take it if it is free and `acquire` is set.
+
+        Leases are replaced with their resource version, so only one replica wins a race.
+        """
+        try:
+            lease = api.read_namespaced_lease(
+                name, SETTINGS.NAMESPACE, _request_timeout=REQUEST_TIMEOUT
+            )
+        except ApiException as err:
+            if err.status != HTTPStatus.NOT_FOUND:
+                raise
+            if not acquire:
+                return False
+            lease = None
+
+        if lease is not None:
+            held = lease.spec is not None and lease.spec.holder_identity == self.identity
+            if not held and not (acquire and _expired(lease, now)):
+                return False
+            transitions = (lease.spec.lease_transitions or 0) if lease.spec is not None else 0
+            lease.spec = client.V1LeaseSpec(
+                holder_identity=self.identity,
+                lease_duration_seconds=SETTINGS.LEASE_DURATION,
+                acquire_time=lease.spec.acquire_time if held else now,
+                renew_time=now,
+                lease_transitions=transitions if held else transitions + 1,
+            )
+        else:
+            lease = client.V1Lease(
+                metadata=client.V1ObjectMeta(name=name, labels={LEASE_KIND_LABEL: kind}),
+                spec=client.V1LeaseSpec(
+                    holder_identity=self.identity,
+                    lease_duration_seconds=SETTINGS.LEASE_DURATION,
+                    acquire_time=now,
+                    renew_time=now,
+                    lease_transitions=0,
+                ),
+            )
+
+        try:
+            if lease.metadata.resource_version is None:
+                api.create_namespaced_lease(
+                    SETTINGS.NAMESPACE, lease, _request_timeout=REQUEST_TIMEOUT
+                )
+            else:
+                api.replace_namespaced_lease(
+                    name, SETTINGS.NAMESPACE, lease, _request_timeout=REQUEST_TIMEOUT
+                )
+        except ApiException as err:
+            if err.status == HTTPStatus.CONFLICT:
+                # another replica got it first
+                return False
+            raise
+        return True
+
+    def _release(self, api: client.CoordinationV1Api, name: str) -> None:
+        """Give a Lease held by this replica up, so another one can take it right away."""
+        try:
+            lease = api.read_namespaced_lease(
+                name, SETTINGS.NAMESPACE, _request_timeout=REQUEST_TIMEOUT
+            )
+            if lease.spec is None or lease.spec.holder_identity != self.identity:
+                return
+            lease.spec.holder_identity = None
+            lease.spec.renew_time = None
+            api.replace_namespaced_lease(
+                name, SETTINGS.NAMESPACE, lease, _request_timeout=REQUEST_TIMEOUT
+            )
+        except ApiException as err:
+            logger.warning(f"Couldn't release lease {name}: {err.reason}")
+
+    def _live_members(self, api: client.CoordinationV1Api, now: datetime) -> int:
+        """Renew the member Lease of this replica and count the replicas alive."""
+        self._try_hold(api, f"{SETTINGS.LEASE_NAME}-member-{self.identity}", now, kind="member")
+        leases = api.list_namespaced_lease(
+            SETTINGS.NAMESPACE,
+            label_selector=f"{LEASE_KIND_LABEL}=member",
+            _request_timeout=REQUEST_TIMEOUT,
+        )
+        members = 0
+        for lease in leases.items:
+            if not _expired(lease, now):
+                members += 1
+            else:
+                # clean up after a replica that is gone
+                try:
+                    api.delete_namespaced_lease(
+                        lease.metadata.name, SETTINGS.NAMESPACE, _request_timeout=REQUEST_TIMEOUT
+                    )
+                except ApiException:
+                    pass
+        return max(members, 1)
+
+    def run_round(self, api: client.CoordinationV1Api, now: None | datetime = None) -> None:
+        """
+        Renew the Leases of this replica and take or release shards to hold its fair share.
+
+        Args:
+            api: The client used to reach the Leases.
+            now: The current time. Defaults to the current UTC time.
+        """
+        started_at = time.monotonic()
+        now = now or datetime.now(timezone.utc)
+        owned = self.owned_shards
+        fair_share = self.shard_count
+        if self.shard_count > 1:
+            fair_share = math.ceil(self.shard_count / self._live_members(api, now))
+
+        holding: set[int] = set()
+        releasing: set[int] = set()
+        # renew the shards already held first, so they are kept over free ones
+        for shard in sorted(owned) + sorted(set(range(self.shard_count)) - owned):
+            name = self._lease_name(shard)
+            if shard in owned and len(holding) >= fair_share:
+                # still held while the work in progress on it is drained
+                if self._try_hold(api, name, now, acquire=False):
+                    releasing.add(shard)
+                continue
+            if self._try_hold(api, name, now, acquire=len(holding) < fair_share):
+                holding.add(shard)
+
+        with self._lock:
+            self._owned = holding
+            # the Leases were renewed as of `now`, i.e. when the round started
+            self._renewed_at = started_at
+        if releasing:
+            # nothing new starts on the released shards, and what is in progress is finished
+            # before another replica can take them, so no job is submitted twice
+            logger.info(f"Releasing shards {sorted(releasing)} to the other replicas")
+            self._drain(releasing)
+            for shard in sorted(releasing):
+                self._release(api, self._lease_name(shard))
+        gained = holding - owned
+        if gained:
+            logger.info(f"Took over shards {sorted(gained)}")
+            for listener in self._listeners:
+                listener(gained)
+        if owned - holding - releasing:
+            logger.warning(f"Lost shards {sorted(owned - holding - releasing)}")
+
+    def stop_holding(self, api: client.CoordinationV1Api) -> None:
+        """Release every Lease held by this replica."""
+        with self._lock:
+            owned, self._owned = self._owned, set()
+        for shard in owned:
+            self._release(api, self._lease_name(shard))
+        if self.shard_count > 1:
+            self._release(api, f"{SETTINGS.LEASE_NAME}-member-{self.identity}")
+
+    def run(self, thread_event: threading.Event) -> None:
+        """Hold the shards of this replica until `thread_event` is set, then release them."""
+        if not self.enabled:
+            return
+
+        api = client.CoordinationV1Api(api_client())
+        while not thread_event.is_set():
+            try:
+                self.run_round(api)
+            except Exception as err:
+                # without renewing, this replica can't tell whether it still holds its shards
+                logger.exception(f"Couldn't renew the leases, dropping every shard: {err}")
+                with self._lock:
+                    self._owned = set()
+            thread_event.wait(SETTINGS.LEASE_RENEW_PERIOD)
+        self.stop_holding(api)
+
+
+coordinator = ShardCoordinator(
+    SETTINGS.POD_NAME, shard_count=SETTINGS.SHARD_COUNT, enabled=SETTINGS.LEADER_ELECTION
+)
+
+
+def leader_election(thread_event: threading.Event) -> None:
+    """Take part in the leader election until `thread_event` is set."""
+    assert hasattr(logger, "focus")  # make mypy happy
+    with logger.focus("PyKubeSlurm - Leader election logic"):
+        if not coordinator.enabled:
+            logger.debug("Leader election disabled. Handling every SlurmJob.")
+            return
+        logger.debug(f"Started thread. ID: {threading.get_ident()}")
+        coordinator.run(thread_event)
+        logger.debug(f"Thread {threading.get_ident()} stopped")
@@ -0,0 +1,158 @@
+"""Core module for the on-disk ledger of the SlurmJobs submitted to Slurm."""
+import json
+import sqlite3
+import threading
+from collections.abc import Iterable
+from pathlib import Path
+from typing import Any
+
+from loguru import logger
+
+from pykubeslurm.settings import SETTINGS
+
+
+class SubmissionLedger:
+    """
+    Persistent record of the SlurmJobs already submitted, indexed by the object UID.
+
+    The ledger lives in a SQLite database so it survives restarts of the operator. Every UID is
+    loaded in memory when the database is opened, so looking an object up costs nothing. The
+    spec last applied to each Slurm job is kept there too, and only read when the spec of its
+    SlurmJob changes.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self._path = path
+        self._lock = threading.Lock()
+        self._connection: None | sqlite3.Connection = None
+        self._uids: set[str] = set()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open the database on first use, creating it if needed."""
+        if self._connection is None:
+            assert hasattr(logger, "focus")  # make mypy happy
+            with logger.focus("PyKubeSlurm - Open submission ledger"):
+                self._path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+                self._connection = sqlite3.connect(self._path, check_same_thread=False)
+                self._connection.execute(
+                    "CREATE TABLE IF NOT EXISTS submissions ("
+                    "uid TEXT PRIMARY KEY, name TEXT NOT NULL, slurm_job_id INTEGER, "
+                    "recorded_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP, spec TEXT)"
+                )
+                columns = {
+                    column
+                    for (_, column, *_) in self._connection.execute(
+                        "PRAGMA table_info(submissions)"
+                    )
+                }
+                if "spec" not in columns:
+                    # ledger created by a version that didn't keep the applied specs
+                    self._connection.execute("ALTER TABLE submissions ADD COLUMN spec TEXT")
+                self._connection.commit()
+                self._uids = {
+                    uid for (uid,) in self._connection.execute("SELECT uid FROM submissions")
+                }
+                logger.debug(f"Loaded {len(self._uids)} submissions from {self._path}")
+        return self._connection
+
+    def __contains__(self, uid: str) -> bool:
+        with self._lock:
+            self._connect()
+            return uid in self._uids
+
+    def record(
+        self,
+        uid: str,
+        name: str,
+        slurm_job_id: None | int,
+        spec: None | dict[str, Any] = None,
+    ) -> None:
+        """
+        Record a SlurmJob as submitted.
+
+        Args:
+            uid: UID of the SlurmJob object.
+            name: Name of the SlurmJob object.
+            slurm_job_id: The Slurm job ID, if the submission was accepted.
+            spec: The spec the Slurm job was submitted with, if known.
+        """
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO submissions (uid, name, slurm_job_id, spec) "
+                "VALUES (?, ?, ?, ?)",
+                (uid, name, slurm_job_id, json.dumps(spec) if spec is not None else None),
+            )
+            connection.commit()
+            self._uids.add(uid)
+
+    def backfill(self, submissions: Iterable[tuple[str, str, None | int]]) -> None:
+        """
+        Record many SlurmJobs as submitted at once, in a single transaction.
+
+        Used for the SlurmJobs submitted before the ledger knew about them; the ones already
+        recorded are left untouched.
+
+        Args:
+            submissions: The UID, the name and the Slurm job ID (if any) of each SlurmJob.
+        """
+        with self._lock:
+            connection = self._connect()
+            missing = [submission for submission in submissions if submission[0] not in self._uids]
+            if not missing:
+                return
+            connection.executemany(
+                "INSERT OR IGNORE INTO submissions (uid, name, slurm_job_id) VALUES (?, ?, ?)",
+                missing,
+            )
+            connection.commit()
+            self._uids.update(uid for uid, _, _ in missing)
+
+    def record_spec(self, uid: str, spec: dict[str, Any]) -> None:
+        """Record the spec last applied to the Slurm job of a SlurmJob."""
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "UPDATE submissions SET spec = ? WHERE uid = ?", (json.dumps(spec), uid)
+            )
+            connection.commit()
+
+    def slurm_job_id(self, uid: str) -> None | int:
+        """Return the ID of the Slurm job recorded for a SlurmJob, if any."""
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT slurm_job_id FROM submissions WHERE uid = ?", (uid,)
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def applied_spec(self, uid: str) -> None | dict[str, Any]:
+        """Return the spec last applied to the Slurm job of a SlurmJob, if known."""
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT spec FROM submissions WHERE uid = ?", (uid,)
+            ).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return json.loads(row[0])
+
+    def forget(self, uids: Iterable[str]) -> None:
+        """Remove the given UIDs from the ledger."""
+        with self._lock:
+            connection = self._connect()
+            uids = [uid for uid in uids if uid in self._uids]
+            connection.executemany(
+                "DELETE FROM submissions WHERE uid = ?", ((uid,) for uid in uids)
+            )
+            connection.commit()
+            self._uids.difference_update(uids)
+
+    def prune(self, existing_uids: Iterable[str]) -> None:
+        """Remove the UIDs of objects that no longer exist in the cluster."""
+        with self._lock:
+            self._connect()
+            stale_uids = self._uids - set(existing_uids)
+        if stale_uids:
+            self.forget(stale_uids)
+
+
+ledger = SubmissionLedger(SETTINGS.CACHE_DIR.expanduser() / "ledger.sqlite3")
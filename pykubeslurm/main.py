@@ -1,18 +1,14 @@
 """Main module for the Operator app."""
 import sys
-import threading
-import time
 
 import typer
 from focalize import attach_focalize
 from kubernetes import config
 from loguru import logger
 
-from pykubeslurm.events import event_listener
-from pykubeslurm.health_check import init_health_check
-from pykubeslurm.scheduler import init_scheduler
+from pykubeslurm.runtime import runtime
 from pykubeslurm.settings import SETTINGS
-from pykubeslurm.vars import APP_STARTED_AT  # noqa: F401
+from pykubeslurm.supervisor import run_operator
 
 app = typer.Typer(name="PyKubeSlurm")
 
@@ -22,7 +18,6 @@ attach_focalize(sys.stderr, level=SETTINGS.DEBUG_LEVEL)
 @app.callback()
 def callback():  # type: ignore
     """PyKubeSlurm - A Kubernetes Operator for scheduling jobs on Slurm."""
-    init_scheduler()
 
 
 @app.command(name="run")
@@ -51,33 +46,11 @@ def run():  # type: ignore
             logger.error(f"Could not load kubernetes config: {err}")
             raise err
 
-        event = threading.Event()
-
-        event_listener_thread = threading.Thread(
-            name="EventListener", target=event_listener, args=(event,)
-        )
-        health_check_thread = threading.Thread(name="HealthCheck", target=init_health_check)
-
         try:
-            health_check_thread.start()
-            while True:
-                if not event_listener_thread.is_alive():
-                    logger.debug("Starting the event listener...")
-                    event_listener_thread.start()
-                time.sleep(5)
-        except KeyboardInterrupt:
-            logger.debug("Exiting by keyboard interruption...")
-            event.set()
-            event_listener_thread.join()
-            health_check_thread.join()
+            runtime.serve(run_operator())
         except config.config_exception.ConfigException as err:
             logger.error(f"Could not load kubernetes config: {err}")
             raise SystemExit(1)
-        except Exception as err:
-            event.set()
-            event_listener_thread.join()
-            health_check_thread.join()
-            raise err
 
 
 if __name__ == "__main__":
@@ -0,0 +1,131 @@
+"""Core module for the Prometheus metrics of the operator."""
+import time
+from collections.abc import Callable, Iterable, Iterator, Sequence
+from contextlib import contextmanager
+
+from kubernetes.client.exceptions import ApiException
+from loguru import logger
+from prometheus_client import Counter, Gauge, Histogram
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+# Buckets in seconds of the request and handling latencies
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Buckets in seconds of the reconciliation cycles, which may last much longer than a request
+CYCLE_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+class GaugeCollector(Collector):
+    """
+    Gauge computed on scrape from the state of another component, e.g. queue depths.
+
+    The values are read when Prometheus scrapes the operator instead of being kept up to date
+    on the hot path.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str],
+        values: Callable[[], Iterable[tuple[Sequence[str], float]]],
+    ) -> None:
+        """
+        Args:
+            name: The name of the gauge.
+            documentation: The help text of the gauge.
+            labelnames: The names of its labels.
+            values: Function returning the label values and the value of every series.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = values
+
+    def _family(self) -> GaugeMetricFamily:
+        return GaugeMetricFamily(self.name, self.documentation, labels=self.labelnames)
+
+    def describe(self) -> Iterator[GaugeMetricFamily]:
+        yield self._family()
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        family = self._family()
+        try:
+            for label_values, value in self._values():
+                family.add_metric(label_values, value)
+        except Exception as err:
+            logger.warning(f"Metrics collector {self.name} failed: {err}")
+        yield family
+
+
+SLURMRESTD_REQUEST_DURATION = Histogram(
+    "pykubeslurm_slurmrestd_request_duration_seconds",
+    "Time spent waiting for Slurmrestd responses.",
+    ("method", "endpoint", "status"),
+    buckets=LATENCY_BUCKETS,
+)
+KUBERNETES_REQUEST_DURATION = Histogram(
+    "pykubeslurm_kubernetes_request_duration_seconds",
+    "Time spent in Kubernetes API calls.",
+    ("operation", "status"),
+    buckets=LATENCY_BUCKETS,
+)
+EVENT_HANDLING_DURATION = Histogram(
+    "pykubeslurm_event_handling_duration_seconds",
+    "Time spent handling a Kubernetes event.",
+    ("type",),
+    buckets=LATENCY_BUCKETS,
+)
+RECONCILIATION_DURATION = Histogram(
+    "pykubeslurm_reconciliation_duration_seconds",
+    "Duration of the reconciliation cycles.",
+    buckets=CYCLE_BUCKETS,
+)
+RECONCILED_JOBS = Counter(
+    "pykubeslurm_reconciled_jobs_total", "Number of SlurmJobs polled by the reconciliation."
+)
+TOKEN_CACHE_REQUESTS = Counter(
+    "pykubeslurm_token_cache_requests_total",
+    "Number of Slurmrestd tokens asked to the token cache, by result (hit or miss).",
+    ("result",),
+)
+SLURMRESTD_CONCURRENCY_LIMIT = Gauge(
+    "pykubeslurm_slurmrestd_concurrency_limit",
+    "Current adaptive limit of concurrent requests to Slurmrestd.",
+)
+SLURMRESTD_OVERLOAD_SIGNALS = Counter(
+    "pykubeslurm_slurmrestd_overload_signals_total",
+    "Number of Slurmrestd requests failing with signs of overload (5xx, 5005 or transport).",
+    ("reason",),
+)
+SLURMRESTD_CIRCUIT_OPEN = Gauge(
+    "pykubeslurm_slurmrestd_circuit_open",
+    "Whether requests to Slurmrestd are held back after consecutive failures (1) or not (0).",
+)
+SLURMRESTD_RETRIES = Counter(
+    "pykubeslurm_slurmrestd_retries_total", "Number of Slurmrestd requests sent again."
+)
+WATCH_RESTARTS = Counter(
+    "pykubeslurm_watch_restarts_total",
+    "Number of restarts of the SlurmJobs watch, by reason.",
+    ("reason",),
+)
+
+
+@contextmanager
+def time_kubernetes_call(operation: str) -> Iterator[None]:
+    """Observe the duration of a Kubernetes API call and its outcome."""
+    started_at = time.perf_counter()
+    status = "success"
+    try:
+        yield
+    except ApiException as err:
+        status = str(err.status)
+        raise
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        KUBERNETES_REQUEST_DURATION.labels(operation=operation, status=status).observe(
+            time.perf_counter() - started_at
+        )
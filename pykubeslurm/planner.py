@@ -0,0 +1,137 @@
+"""Core module for planning when each SlurmJob is polled from Slurmrestd."""
+import heapq
+import threading
+import time
+
+from pykubeslurm.schemas import JobState
+from pykubeslurm.settings import SETTINGS
+
+# Once past its base interval, a job is polled again after this fraction of its time in a state
+BACKOFF_RATIO = 0.1
+
+FAST_POLLED_STATES = [JobState.SUBMITTED, JobState.UNKNOWN]
+
+
+def poll_interval(
+    state: JobState, in_state_for: float, until_next_transition: None | float = None
+) -> float:
+    """
+    Compute how long to wait before polling a job again.
+
+    Fresh submissions and jobs in an unknown state are polled every `RECONCILIATION_TICK`
+    seconds, pending and running jobs every `RECONCILIATION_TIME` seconds. The longer a job
+    stays in a state, the less often it is polled, up to `RECONCILIATION_MAX_INTERVAL` seconds.
+    Polling speeds up again as the expected transition of the job (its begin time or the end of
+    its time limit) gets closer.
+
+    When a state feed pushes the job state changes, pending and running jobs are only polled
+    every `RECONCILIATION_MAX_INTERVAL` seconds, as a safety net.
+
+    Args:
+        state: The current state of the job.
+        in_state_for: Seconds the job has been in its current state.
+        until_next_transition: Seconds until the job is expected to change state, if known.
+    """
+    if state in FAST_POLLED_STATES:
+        base_interval = SETTINGS.RECONCILIATION_TICK
+    elif SETTINGS.SLURM_STATE_FEED_FILE or SETTINGS.SLURM_STATE_FEED_SOCKET:
+        return SETTINGS.RECONCILIATION_MAX_INTERVAL
+    else:
+        base_interval = SETTINGS.RECONCILIATION_TIME
+    interval = min(
+        max(base_interval, in_state_for * BACKOFF_RATIO), SETTINGS.RECONCILIATION_MAX_INTERVAL
+    )
+    if until_next_transition is not None and until_next_transition > 0:
+        interval = min(interval, max(until_next_transition / 2, SETTINGS.RECONCILIATION_TICK))
+    return interval
+
+
+class PollPlanner:
+    """
+    Priority queue of the next time each SlurmJob is due to be polled.
+
+    Rescheduling a job doesn't remove its previous entry from the heap: stale entries are
+    skipped when they are popped.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._heap: list[tuple[float, str]] = []
+        self._due_at: dict[str, float] = {}
+        self._state_since: dict[str, tuple[JobState, float]] = {}
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._due_at
+
+    def __len__(self) -> int:
+        return len(self._due_at)
+
+    def schedule(self, name: str, due_at: float) -> None:
+        """Schedule the next poll of a job."""
+        with self._lock:
+            self._due_at[name] = due_at
+            heapq.heappush(self._heap, (due_at, name))
+
+    def forget(self, name: str) -> None:
+        """Stop polling a job."""
+        with self._lock:
+            self._due_at.pop(name, None)
+            self._state_since.pop(name, None)
+
+    def retain(self, names: set[str]) -> None:
+        """Stop polling every job but the given ones."""
+        with self._lock:
+            for name in self._due_at.keys() - names:
+                del self._due_at[name]
+            for name in self._state_since.keys() - names:
+                del self._state_since[name]
+
+    def pop_due(self, limit: int, now: None | float = None) -> list[str]:
+        """
+        Take the jobs due to be polled, the most overdue first.
+
+        Args:
+            limit: Maximum number of jobs to take; the others stay due for the next call.
+            now: The current timestamp. Defaults to `time.time()`.
+        """
+        now = time.time() if now is None else now
+        due: list[str] = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now and len(due) < limit:
+                due_at, name = heapq.heappop(self._heap)
+                if self._due_at.get(name) == due_at:
+                    del self._due_at[name]
+                    due.append(name)
+        return due
+
+    def observe(
+        self,
+        name: str,
+        state: JobState,
+        next_transition_at: None | float = None,
+        now: None | float = None,
+    ) -> None:
+        """
+        Record the state a job was polled in and schedule its next poll accordingly.
+
+        Args:
+            name: Key of the Job CRD.
+            state: The state the job was found in.
+            next_transition_at: Timestamp the job is expected to change state at, if known.
+            now: The current timestamp. Defaults to `time.time()`.
+        """
+        now = time.time() if now is None else now
+        previous_state, since = self._state_since.get(name, (state, now))
+        if previous_state != state:
+            since = now
+        self._state_since[name] = (state, since)
+
+        interval = poll_interval(
+            state,
+            now - since,
+            next_transition_at - now if next_transition_at is not None else None,
+        )
+        self.schedule(name, now + interval)
+
+
+poll_planner = PollPlanner()
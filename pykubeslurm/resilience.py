@@ -0,0 +1,106 @@
+"""Core module for retrying failed work and for backing off an unhealthy Slurmrestd."""
+import asyncio
+import random
+import time
+from dataclasses import dataclass
+
+from loguru import logger
+
+from pykubeslurm.metrics import SLURMRESTD_CIRCUIT_OPEN
+from pykubeslurm.settings import SETTINGS
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """Exponential backoff with full jitter between the attempts of a failed operation."""
+
+    attempts: int
+    base_delay: float
+    max_delay: float
+
+    def backoff(self, attempt: int) -> float:
+        """
+        Return the time in seconds to wait before the given retry, starting at 1.
+
+        The delay is drawn between 0 and `base_delay * 2 ** (attempt - 1)`, capped at
+        `max_delay`, so the retries of many failed operations don't all land at once.
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def should_retry(self, attempt: int) -> bool:
+        """Tell whether the given retry, starting at 1, is allowed."""
+        return attempt <= self.attempts
+
+
+retry_policy = RetryPolicy(
+    attempts=SETTINGS.RETRY_ATTEMPTS,
+    base_delay=SETTINGS.RETRY_BASE_DELAY,
+    max_delay=SETTINGS.RETRY_MAX_DELAY,
+)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of the requests made to Slurmrestd, used from an event loop.
+
+    After `threshold` consecutive failed requests, the circuit opens: new requests wait instead
+    of piling more load on an unhealthy Slurmrestd. Once `reset_timeout` seconds have passed, a
+    single request is let through as a probe: the circuit closes, releasing every waiting
+    request at once, as soon as a request succeeds, and opens again if the probe fails.
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float) -> None:
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: None | float = None
+        self._probe_started_at: None | float = None
+        self._closed = asyncio.Event()
+        self._closed.set()
+
+    @property
+    def is_open(self) -> bool:
+        """Whether requests are held back."""
+        return self.opened_at is not None
+
+    async def wait(self) -> None:
+        """Wait until a request can be sent, i.e. the circuit is closed or it is the probe."""
+        while self.opened_at is not None:
+            now = time.monotonic()
+            if self._probe_started_at is not None:
+                # a probe that never reported back, e.g. cancelled, is given up after a while
+                next_probe_at = self._probe_started_at + self.reset_timeout
+            else:
+                next_probe_at = self.opened_at + self.reset_timeout
+            if now >= next_probe_at:
+                self._probe_started_at = now
+                return
+            try:
+                await asyncio.wait_for(self._closed.wait(), next_probe_at - now)
+            except asyncio.TimeoutError:
+                pass
+
+    def record(self, success: bool) -> None:
+        """Record the outcome of a request."""
+        if success:
+            if self.opened_at is not None:
+                logger.info("Slurmrestd is healthy again. Closing the circuit.")
+            self.failures = 0
+            self.opened_at = None
+            self._probe_started_at = None
+            self._closed.set()
+            SLURMRESTD_CIRCUIT_OPEN.set(0)
+            return
+
+        self.failures += 1
+        if self.opened_at is None and self.failures < self.threshold:
+            return
+        if self.opened_at is None:
+            logger.warning(
+                f"Slurmrestd failed {self.failures} requests in a row. Holding requests back "
+                f"for {self.reset_timeout}s."
+            )
+        self.opened_at = time.monotonic()
+        self._probe_started_at = None
+        self._closed.clear()
+        SLURMRESTD_CIRCUIT_OPEN.set(1)
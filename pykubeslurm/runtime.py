@@ -0,0 +1,88 @@
+"""Core module for the long-lived asyncio runtime shared across the app."""
+import asyncio
+import threading
+from collections.abc import Awaitable, Callable, Coroutine
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, TypeVar
+
+from loguru import logger
+
+from pykubeslurm.settings import SETTINGS
+
+T = TypeVar("T")
+
+
+def thread_pool_size() -> int:
+    """
+    Return the number of threads running the blocking calls (e.g. the Kubernetes API).
+
+    The pool is sized to the concurrency limits, plus one thread each for the state feed and
+    the leader election.
+    """
+    return (
+        SETTINGS.RECONCILIATION_CONCURRENCY
+        + SETTINGS.SUBMISSION_CONCURRENCY
+        + SETTINGS.EVENT_WORKERS
+        + 2
+    )
+
+
+class Runtime:
+    """
+    Single asyncio event loop running for the whole life of the operator.
+
+    The operator serves its main coroutine on it (see `serve`), and every subsystem runs its
+    coroutines there, so they share the long-lived clients bound to it instead of setting up
+    an event loop, and the connections that go with it, on every cycle.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._loop: None | asyncio.AbstractEventLoop = None
+        self._cleanups: list[Callable[[], Awaitable[None]]] = []
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """The event loop of the runtime, for the other threads to hand their work to."""
+        with self._lock:
+            if self._loop is None:
+                raise RuntimeError("The runtime isn't running")
+            return self._loop
+
+    def serve(self, coro: Coroutine[Any, Any, T]) -> T:
+        """
+        Run the main coroutine of the operator with the calling thread as the runtime.
+
+        The other threads keep handing their work to the runtime while it serves.
+        Once the coroutine returns, the cleanups run and the event loop is closed.
+        """
+        with self._lock:
+            if self._loop is not None:
+                raise RuntimeError("The runtime is already running")
+            loop = self._loop = asyncio.new_event_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=thread_pool_size()))
+        asyncio.set_event_loop(loop)
+        try:
+            return loop.run_until_complete(coro)
+        finally:
+            loop.run_until_complete(self._clean_up())
+            loop.run_until_complete(loop.shutdown_default_executor())
+            with self._lock:
+                self._loop = None
+            asyncio.set_event_loop(None)
+            loop.close()
+
+    def add_cleanup(self, cleanup: Callable[[], Awaitable[None]]) -> None:
+        """Await the given function when the runtime stops, e.g. to close a client."""
+        self._cleanups.append(cleanup)
+
+    async def _clean_up(self) -> None:
+        while self._cleanups:
+            cleanup = self._cleanups.pop()
+            try:
+                await cleanup()
+            except Exception as err:
+                logger.warning(f"Error cleaning up the runtime: {err}")
+
+
+runtime = Runtime()
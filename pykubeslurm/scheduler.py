@@ -1,117 +1,433 @@
 """Core module for defining the reconciliation schedule logic."""
 import asyncio
+import time
+from collections.abc import Iterable
+from typing import Any
 
-from apscheduler.schedulers.background import BackgroundScheduler
-from kubernetes import client
 from loguru import logger
 
+from pykubeslurm.cache import job_store, object_key, split_key
 from pykubeslurm.errors import ERROR_DICT
-from pykubeslurm.helpers import datetime_in_string, run_coroutines
-from pykubeslurm.schemas import JobState, JobStatus
+from pykubeslurm.helpers import (
+    FINISHED_JOB_STATES,
+    datetime_in_string,
+    mark_finished,
+    patch_object_status,
+    run_coroutines,
+)
+from pykubeslurm.leader import coordinator
+from pykubeslurm.metrics import RECONCILED_JOBS, RECONCILIATION_DURATION
+from pykubeslurm.planner import poll_planner
+from pykubeslurm.schemas import (
+    JobState,
+    JobStatus,
+    SlurmJobState,
+    SlurmrestdErrorPayload,
+    SlurmrestdJobsResponse,
+)
 from pykubeslurm.settings import SETTINGS
-from pykubeslurm.slurmrestd_interface import backend_client
+from pykubeslurm.slurmrestd_interface import AsyncBackendClient, async_backend_client
 
+ACTIVE_JOB_STATES = [JobState.SUBMITTED, JobState.UNKNOWN, JobState.PENDING, JobState.RUNNING]
 
-async def process_job_crd(job_status: JobStatus, name: str) -> None:
+# Seconds taken off the time of the last job listing when asking slurmctld for what changed
+# since, so a clock skew between the operator and slurmctld can't hide a change
+UPDATE_TIME_MARGIN = 5
+
+
+# Slurm error "Nothing found with query", returned by slurmdbd for unknown jobs
+SLURMDB_NOTHING_FOUND_ERROR = 9003
+
+
+def _lookup_error(error: str, error_number: int = 0) -> SlurmJobState:
     """
-    Process the Job CRD by fetching its data from slurmrestd and updating the SlurmJob CRD.
+    Return the state of a Slurm job whose lookup failed.
 
     Args:
-        job_status: Job status instance model.
-        name: Name of the Job CRD.
+        error: Description of the failure.
+        error_number: The Slurm error number, 0 if the failure isn't reported by Slurm.
     """
-    api = client.CustomObjectsApi()
+    return SlurmJobState(
+        state=None,
+        reason=None,
+        errors=[
+            SlurmrestdErrorPayload(
+                description=None, error_number=error_number, error=error, source="pykubeslurm"
+            )
+        ],
+        next_transition_at=None,
+    )
 
-    assert hasattr(logger, "focus")  # make mypy happy
-    with logger.focus(f"PyKubeSlurm - SlurmJob {name} Reconciliation"):
-        logger.info(f"Started reconciliation for SlurmJob {name}")
-        slurmrestd_response = backend_client.get(f"/slurmdb/v0.0.36/job/{job_status.slurm_job_id}")
 
+async def _fetch_job_from_slurmdbd(
+    slurmrestd_client: AsyncBackendClient, slurm_job_id: int
+) -> SlurmJobState:
+    """
+    Fetch a single job from the slurmdbd.
+
+    A failed lookup only concerns its own job, which is returned with the error rather than
+    raised, so the rest of the reconciliation goes on.
+
+    Args:
+        slurmrestd_client: The client used to reach slurmrestd.
+        slurm_job_id: The Slurm job ID.
+    """
+    try:
+        slurmrestd_response = await slurmrestd_client.get(f"/slurmdb/v0.0.36/job/{slurm_job_id}")
         slurmrestd_response_data = slurmrestd_response.json()
-        errors = slurmrestd_response_data.get("errors")
-        if errors:
-            logger.error(
-                f"Error fetching job from slurmrestd: {slurmrestd_response_data['errors']}"
-            )
-            api.patch_namespaced_custom_object_status(
-                group=SETTINGS.CRD_GROUP,
-                version=SETTINGS.CRD_VERSION,
-                namespace=SETTINGS.NAMESPACE,
-                plural=SETTINGS.JOB_CRD_PLURAL,
-                name=name,
-                body={
-                    "status": {
-                        "slurmJobId": job_status.slurm_job_id,
-                        "state": JobState.UNKNOWN.value,
-                        "errors": [ERROR_DICT.get(error.get("error_number")) for error in errors],
-                        "updatedAt": datetime_in_string(),
-                        "reason": None,
-                        "lastAppliedSpec": job_status.last_applied_spec,
-                    }
+    except Exception as err:
+        logger.error(f"Error looking up job {slurm_job_id} on slurmdbd: {err!r}")
+        return _lookup_error(f"Couldn't look up the job on slurmdbd: {err!r}")
+    errors = slurmrestd_response_data.get("errors")
+    if errors:
+        return SlurmJobState(state=None, reason=None, errors=errors, next_transition_at=None)
+
+    # In Slurm, the tuple (job_id, cluster) is unique. As PyKubeSlurm doesn't support
+    # federated clusters yet, a job is expected to be listed once.
+    jobs = slurmrestd_response_data.get("jobs") or []
+    if not jobs:
+        logger.error(f"Job {slurm_job_id} wasn't found on slurmdbd")
+        return _lookup_error("Nothing found with query", SLURMDB_NOTHING_FOUND_ERROR)
+    if len(jobs) > 1:
+        logger.error(f"Job {slurm_job_id} is listed {len(jobs)} times on slurmdbd")
+        return _lookup_error("Federated clusters are not supported yet")
+    job = jobs[0]
+    return SlurmJobState(
+        state=job.get("state").get("current"),
+        reason=job.get("state").get("reason"),
+        errors=[],
+        next_transition_at=None,
+    )
+
+
+def _next_transition_at(job: dict[str, Any]) -> None | int:
+    """
+    Return when a job listed by slurmctld is expected to change state, if known.
+
+    Running jobs end at the latest at their `end_time` (start plus time limit), while pending
+    jobs are expected to start at their `start_time` (estimated by the backfill scheduler) or
+    to become eligible at their `eligible_time` (their begin time).
+    """
+    if job.get("job_state") == JobState.RUNNING:
+        return job.get("end_time") or None
+    if job.get("job_state") == JobState.PENDING:
+        return job.get("start_time") or job.get("eligible_time") or None
+    return None
+
+
+class JobListing:
+    """
+    Last listing of the Slurm jobs backing the SlurmJobs.
+
+    Given an `update_time`, slurmctld only lists the jobs again if any job changed since then;
+    otherwise the listing is empty, and the jobs are taken from here. A full listing is asked
+    for at least every `RECONCILIATION_MAX_INTERVAL` seconds all the same.
+    """
+
+    def __init__(self) -> None:
+        self.jobs: dict[int, SlurmJobState] = {}
+        self.listed_at: None | float = None
+        self.refreshed_at: None | float = None
+
+    def update_time(self, now: None | float = None) -> None | int:
+        """Return the `update_time` to list the jobs with, or None for a full listing."""
+        now = time.time() if now is None else now
+        if (
+            self.listed_at is None
+            or self.refreshed_at is None
+            or now - self.refreshed_at > SETTINGS.RECONCILIATION_MAX_INTERVAL
+        ):
+            return None
+        return int(self.listed_at) - UPDATE_TIME_MARGIN
+
+    def refresh(self, jobs: dict[int, SlurmJobState], listed_at: float) -> None:
+        """Replace the jobs with the ones of a listing made at `listed_at`."""
+        self.jobs = jobs
+        self.listed_at = self.refreshed_at = listed_at
+
+
+job_listing = JobListing()
+
+
+async def fetch_jobs_state(
+    slurmrestd_client: AsyncBackendClient, slurm_job_ids: set[int]
+) -> None | dict[int, SlurmJobState]:
+    """
+    Fetch the state of many Slurm jobs at once.
+
+    The jobs known by slurmctld are retrieved in a single request to the job listing endpoint,
+    sent with the `update_time` of the previous one so nothing is listed when no job changed
+    (see `JobListing`). Only the jobs slurmctld has already purged (see `MinJobAge` in
+    `slurm.conf`) are looked up one by one in the slurmdbd.
+
+    Args:
+        slurmrestd_client: The client used to reach slurmrestd.
+        slurm_job_ids: The Slurm job IDs to look for.
+
+    Returns:
+        dict: A map of Slurm job ID to its state.
+        None: None if the job listing failed.
+    """
+    assert hasattr(logger, "focus")  # make mypy happy
+    with logger.focus("PyKubeSlurm - Fetch Slurm jobs"):
+        update_time = job_listing.update_time()
+        listed_at = time.time()
+        params = {"update_time": update_time} if update_time is not None else {}
+        # the listing takes longer as the cluster grows, which isn't a sign of overload
+        slurmrestd_response = await slurmrestd_client.get(
+            "/slurm/v0.0.36/jobs", params=params, extensions={"latency_target": None}
+        )
+        response_json = SlurmrestdJobsResponse(**slurmrestd_response.json())  # type: ignore
+        if response_json.get("errors"):
+            logger.error(f"Error listing jobs from slurmrestd: {response_json.get('errors')}")
+            return None
+
+        jobs = response_json.get("jobs") or []
+        if jobs or update_time is None:
+            job_listing.refresh(
+                {
+                    job["job_id"]: SlurmJobState(
+                        state=job.get("job_state"),
+                        reason=job.get("state_reason"),
+                        errors=[],
+                        next_transition_at=_next_transition_at(job),
+                    )
+                    for job in jobs
+                    # only the jobs backing a SlurmJob are kept
+                    if job.get("job_id") in slurm_job_ids
+                    or job_store.by_slurm_job_id(job.get("job_id")) is not None
                 },
+                listed_at,
             )
+        else:
+            logger.debug("No Slurm job changed since the last listing")
+            job_listing.listed_at = listed_at
+        jobs_state = {
+            slurm_job_id: job_listing.jobs[slurm_job_id]
+            for slurm_job_id in slurm_job_ids
+            if slurm_job_id in job_listing.jobs
+        }
+
+        missing_job_ids = list(slurm_job_ids - jobs_state.keys())
+        if missing_job_ids:
+            logger.debug(f"Looking up {len(missing_job_ids)} jobs purged by slurmctld on slurmdbd")
+        missing_jobs_state = await run_coroutines(
+            *(
+                _fetch_job_from_slurmdbd(slurmrestd_client, slurm_job_id)
+                for slurm_job_id in missing_job_ids
+            ),
+            concurrency=SETTINGS.RECONCILIATION_CONCURRENCY,
+        )
+        jobs_state.update(zip(missing_job_ids, missing_jobs_state))
+
+    return jobs_state
+
+
+def _status_changes(job_status: JobStatus, desired_status: dict[str, Any]) -> dict[str, Any]:
+    """
+    Return the fields of the desired status that differ from the current one.
+
+    Empty values (None, [] or "") are considered equal to each other.
+
+    Args:
+        job_status: The current status of the Job CRD.
+        desired_status: The desired status, keyed by the CRD field names.
+    """
+    current_status = job_status.model_dump(mode="json", by_alias=True)
+    return {
+        field: value
+        for field, value in desired_status.items()
+        if (current_status.get(field) or None) != (value or None)
+    }
+
+
+async def process_job_crd(job_status: JobStatus, key: str, slurm_job: SlurmJobState) -> None:
+    """
+    Process the Job CRD by updating its status with the data fetched from slurmrestd.
+
+    Only the fields that changed are sent, as a merge patch; nothing is sent if none did. A
+    SlurmJob whose Slurm job just finished is labeled as such (see `helpers.mark_finished`).
+
+    Args:
+        job_status: Job status instance model.
+        key: Key of the Job CRD (`<namespace>/<name>`, see `pykubeslurm.cache.object_key`).
+        slurm_job: State of the Slurm job backing the Job CRD.
+    """
+    assert hasattr(logger, "focus")  # make mypy happy
+    with logger.focus(f"PyKubeSlurm - SlurmJob {key} Reconciliation"):
+        logger.info(f"Started reconciliation for SlurmJob {key}")
+
+        errors = slurm_job.get("errors")
+        if errors:
+            logger.error(f"Error fetching job from slurmrestd: {errors}")
+            desired_status = {
+                "state": JobState.UNKNOWN.value,
+                "errors": [
+                    ERROR_DICT.get(error["error_number"], error.get("error")) for error in errors
+                ],
+                "reason": None,
+            }
+        else:
+            state = JobState.from_slurm(slurm_job.get("state"))
+            reason = slurm_job.get("reason")
+            if state.value != slurm_job.get("state") and reason in (None, "", "None"):
+                # keep the Slurm state folded into the SlurmJob one, e.g. TIMEOUT, in sight
+                reason = slurm_job.get("state")
+            desired_status = {"state": state.value, "errors": [], "reason": reason}
+
+        status_changes = _status_changes(job_status, desired_status)
+        if not status_changes:
+            logger.debug(f"Job CRD {key} is up to date")
             return
 
-        # In Slurm, the tuple (job_id, cluster) is unique. As PyKubeSlurm doesn't support
-        # federated clusters yet, we take the first element of the job list.
-        assert (
-            len(slurmrestd_response_data["jobs"]) == 1
-        ), "Federated clusters are not supported yet"
-        job = slurmrestd_response_data["jobs"][0]
-        job_state = JobState(job.get("state").get("current"))
-        reason = job.get("state").get("reason")
-
-        logger.info(f"Updating Job CRD {name} to state {job_state.value}, reason: {reason}")
-        api.patch_namespaced_custom_object_status(
-            group=SETTINGS.CRD_GROUP,
-            version=SETTINGS.CRD_VERSION,
-            namespace=SETTINGS.NAMESPACE,
-            plural=SETTINGS.JOB_CRD_PLURAL,
-            name=name,
-            body={
-                "status": {
-                    "state": job_state.value,
-                    "reason": reason,
-                    "updatedAt": datetime_in_string(),
-                    "slurmJobId": job_status.slurm_job_id,
-                    "errors": [],
-                    "lastAppliedSpec": job_status.last_applied_spec,
-                }
-            },
+        logger.info(f"Updating Job CRD {key} with {status_changes}")
+        namespace, name = split_key(key)
+        await patch_object_status(
+            name, {"status": {**status_changes, "updatedAt": datetime_in_string()}}, namespace
         )
+        if status_changes.get("state") in FINISHED_JOB_STATES:
+            await mark_finished(name, namespace)
 
 
-def reconcile() -> None:
-    """Reconcile jobs submitted to slurmrestd."""
-    api = client.CustomObjectsApi()
+def plan_next_poll(key: str, slurm_job: SlurmJobState) -> None:
+    """
+    Schedule the next poll of a job according to the state it was just found in.
 
-    resources = api.list_namespaced_custom_object(
-        group=SETTINGS.CRD_GROUP,
-        version=SETTINGS.CRD_VERSION,
-        namespace=SETTINGS.NAMESPACE,
-        plural=SETTINGS.JOB_CRD_PLURAL,
-    )
+    The job is always either rescheduled or forgotten: a job left out of the planner would be
+    polled again on every reconciliation run.
+    """
+    state = JobState.UNKNOWN
+    try:
+        if not slurm_job.get("errors"):
+            state = JobState.from_slurm(slurm_job.get("state"))
+    finally:
+        if state in ACTIVE_JOB_STATES:
+            poll_planner.observe(key, state, slurm_job.get("next_transition_at"))
+        else:
+            poll_planner.forget(key)
 
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    tasks = [
-        process_job_crd(JobStatus(**resource.get("status")), resource.get("metadata").get("name"))
-        for resource in resources.get("items")
-        if resource.get("status").get("state")
-        in [JobState.SUBMITTED, JobState.UNKNOWN, JobState.PENDING, JobState.RUNNING]
-    ]
-    if not tasks:
-        logger.info("No jobs to reconcile")
-    asyncio.run(run_coroutines(*tasks))
-
-
-def init_scheduler() -> None:
-    """Initialize the scheduler."""
-    scheduler = BackgroundScheduler()
-    scheduler.add_job(
-        func=reconcile,
-        trigger="interval",
-        seconds=SETTINGS.RECONCILIATION_TIME,
-        id="reconcile_jobs",
-    )
-    scheduler.start()
+
+def _defer(keys: Iterable[str]) -> None:
+    """Leave jobs to the next reconciliation run, first in line."""
+    now = time.time()
+    for key in keys:
+        poll_planner.schedule(key, now)
+
+
+async def _reconcile_job(
+    semaphore: asyncio.Semaphore, key: str, job_status: JobStatus, slurm_job: SlurmJobState
+) -> None:
+    async with semaphore:
+        resource = job_store.get(key)
+        if resource is None or not coordinator.owns(resource):
+            # the shard was lost while the Slurm jobs were being fetched
+            return
+        plan_next_poll(key, slurm_job)
+        await process_job_crd(job_status, key, slurm_job)
+
+
+async def reconcile_jobs(active_jobs: dict[str, JobStatus], deadline: None | float = None) -> None:
+    """
+    Reconcile the given jobs, at most `RECONCILIATION_CONCURRENCY` of them at a time.
+
+    Args:
+        active_jobs: A map of Job CRD key to its status.
+        deadline: `time.monotonic()` value after which the jobs not reconciled yet are left to
+            the next run. Unbounded if None.
+    """
+    def _time_left() -> None | float:
+        return max(deadline - time.monotonic(), 0) if deadline is not None else None
+
+    slurm_job_ids = {job_status.slurm_job_id for job_status in active_jobs.values()}
+    try:
+        jobs_state = await asyncio.wait_for(
+            fetch_jobs_state(async_backend_client(), slurm_job_ids),  # type: ignore
+            _time_left(),
+        )
+    except asyncio.TimeoutError:
+        logger.warning("Fetching the Slurm jobs overran the reconciliation slice")
+        _defer(active_jobs)
+        return
+    if jobs_state is None:
+        logger.warning("Skipping reconciliation since the Slurm jobs couldn't be fetched")
+        return
+
+    semaphore = asyncio.Semaphore(SETTINGS.RECONCILIATION_CONCURRENCY)
+    tasks = {
+        asyncio.ensure_future(
+            _reconcile_job(
+                semaphore, key, job_status, jobs_state[job_status.slurm_job_id]  # type: ignore
+            )
+        ): key
+        for key, job_status in active_jobs.items()
+    }
+    done, pending = await asyncio.wait(tasks, timeout=_time_left())
+    for task in done:
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Error reconciling SlurmJob {tasks[task]}: {task.exception()}")
+    if pending:
+        logger.warning(
+            f"Reconciliation slice overran, leaving {len(pending)} SlurmJobs to the next run"
+        )
+        for task in pending:
+            task.cancel()
+        _defer(tasks[task] for task in pending)
+
+
+async def reconcile() -> None:
+    """
+    Reconcile the jobs submitted to slurmrestd that are due to be polled.
+
+    Every active job is planned for polling as soon as it is seen, then at an interval that
+    depends on its state (see `pykubeslurm.planner.poll_interval`). Only the jobs owned by this
+    replica are reconciled.
+
+    Each run is a time-boxed slice: it takes at most `RECONCILIATION_BUDGET` due jobs, the most
+    overdue first, and whatever isn't done after `RECONCILIATION_SLICE_TIME` seconds goes back
+    to the head of the planner for the next run. Only the due jobs are validated.
+    """
+    started_at = time.monotonic()
+    active_keys = {
+        object_key(resource)
+        for resource in job_store.by_state(*ACTIVE_JOB_STATES)
+        if resource["status"].get("slurmJobId") is not None and coordinator.owns(resource)
+    }
+    poll_planner.retain(active_keys)
+    now = time.time()
+    for key in active_keys:
+        if key not in poll_planner:
+            poll_planner.schedule(key, now)
+
+    due_jobs = {}
+    for key in poll_planner.pop_due(SETTINGS.RECONCILIATION_BUDGET):
+        resource = job_store.get(key)
+        if resource is not None:
+            due_jobs[key] = JobStatus(**resource["status"])
+    if not due_jobs:
+        logger.debug("No jobs to reconcile")
+        return
+
+    with RECONCILIATION_DURATION.time():
+        await reconcile_jobs(due_jobs, deadline=started_at + SETTINGS.RECONCILIATION_SLICE_TIME)
+    RECONCILED_JOBS.inc(len(due_jobs))
+
+
+async def reconciler(shutdown: asyncio.Event) -> None:
+    """
+    Run a reconciliation every `RECONCILIATION_TICK` seconds until `shutdown` is set.
+
+    Runs never overlap: a run overrunning its tick delays the next one. On shutdown, the run
+    in progress, time-boxed by `RECONCILIATION_SLICE_TIME`, is let finish.
+    """
+    assert hasattr(logger, "focus")  # make mypy happy
+    with logger.focus("PyKubeSlurm - Reconciliation logic"):
+        while not shutdown.is_set():
+            try:
+                await reconcile()
+            except Exception as err:
+                # keep the reconciler alive
+                logger.exception(err)
+            try:
+                await asyncio.wait_for(shutdown.wait(), SETTINGS.RECONCILIATION_TICK)
+            except asyncio.TimeoutError:
+                pass
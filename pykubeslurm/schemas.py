@@ -13,6 +13,7 @@ class KubernetesEventType(str, Enum):
     MODIFIED = "MODIFIED"
     DELETED = "DELETED"
     ERROR = "ERROR"
+    BOOKMARK = "BOOKMARK"
 
 
 class KubernetesEvent(BaseModel):
@@ -40,6 +41,50 @@ class JobState(str, Enum):
     def __str__(self) -> str:
         return self.value
 
+    @classmethod
+    def from_slurm(cls, state: None | str) -> "JobState":
+        """
+        Map the state of a Slurm job to the state of its SlurmJob.
+
+        Slurm has more states than a SlurmJob, e.g. TIMEOUT or NODE_FAIL, which are folded into
+        the closest one (see `SLURM_JOB_STATES`). States this operator doesn't know about map
+        to UNKNOWN.
+        """
+        if not state:
+            return cls.UNKNOWN
+        # e.g. "CANCELLED by 1000", as reported by the slurmdbd
+        return SLURM_JOB_STATES.get(state.split()[0], cls.UNKNOWN)
+
+
+# States of the Slurm jobs, as reported by slurmctld and the slurmdbd, and the state of the
+# SlurmJob each one maps to
+SLURM_JOB_STATES = {
+    "PENDING": JobState.PENDING,
+    "REQUEUED": JobState.PENDING,
+    "REQUEUE_FED": JobState.PENDING,
+    "REQUEUE_HOLD": JobState.PENDING,
+    "RESV_DEL_HOLD": JobState.PENDING,
+    "SPECIAL_EXIT": JobState.PENDING,
+    "RUNNING": JobState.RUNNING,
+    "COMPLETING": JobState.RUNNING,
+    "CONFIGURING": JobState.RUNNING,
+    "RESIZING": JobState.RUNNING,
+    "SIGNALING": JobState.RUNNING,
+    "STAGE_OUT": JobState.RUNNING,
+    "STOPPED": JobState.RUNNING,
+    "SUSPENDED": JobState.RUNNING,
+    "COMPLETED": JobState.COMPLETED,
+    "CANCELLED": JobState.CANCELLED,
+    "REVOKED": JobState.CANCELLED,
+    "FAILED": JobState.FAILED,
+    "BOOT_FAIL": JobState.FAILED,
+    "DEADLINE": JobState.FAILED,
+    "NODE_FAIL": JobState.FAILED,
+    "OUT_OF_MEMORY": JobState.FAILED,
+    "PREEMPTED": JobState.FAILED,
+    "TIMEOUT": JobState.FAILED,
+}
+
 
 class KubernetesObjectMeta(BaseModel):
     """Kubernetes object metadata."""
@@ -47,8 +92,10 @@ class KubernetesObjectMeta(BaseModel):
     model_config = ConfigDict(arbitrary_types_allowed=True, extra="allow")
 
     name: str
+    uid: None | str = None
     generate_name: None | str = Field(None, alias="generateName")
     namespace: str
+    generation: None | int = None
     labels: dict[str, str] = Field(default_factory=dict)
     annotations: dict[str, str] = Field(default_factory=dict)
     creation_timestamp: None | datetime.datetime = Field(None, alias="creationTimestamp")
@@ -197,6 +244,9 @@ class JobStatus(BaseModel):
     state: None | JobState = Field(None)
     updated_at: None | str = Field(None, alias="updatedAt")
     reason: None | str = Field(None)
+    spec_hash: None | str = Field(None, alias="specHash")
+    observed_generation: None | int = Field(None, alias="observedGeneration")
+    # whole spec applied to the Slurm job, only written by the versions without `spec_hash`
     last_applied_spec: None | str = Field(None, alias="lastAppliedSpec")
 
 
@@ -270,3 +320,18 @@ class SlurmrestdJobSubmissionResponse(SlurmrestdResponse):
     job_id: None | int
     step_id: None | str
     job_submit_user_msg: None | str
+
+
+class SlurmrestdJobsResponse(SlurmrestdResponse):
+    """Slurmrestd response for the job listing endpoints, e.g. `GET /slurm/v0.0.36/jobs`."""
+
+    jobs: list[dict[str, Any]]
+
+
+class SlurmJobState(TypedDict):
+    """State of a Slurm job normalized from the slurmctld or slurmdbd job payloads."""
+
+    state: None | str
+    reason: None | str
+    errors: list[SlurmrestdErrorPayload]
+    next_transition_at: None | int
@@ -1,3 +1,4 @@
+import socket
 from pathlib import Path
 
 from pydantic import Field, field_validator
@@ -31,9 +32,74 @@ class Settings(BaseSettings):
         description="Name of the Kubernetes context to use. Ignored if the app is run in cluster.",
     )
     NAMESPACE: str = Field("default", description="Namespace to use for the application.")
+    WATCH_NAMESPACES: list[str] = Field(
+        default_factory=list,
+        description=(
+            "Namespaces whose SlurmJobs are handled, as a JSON list, all watched through a single "
+            'cluster-wide stream. `["*"]` handles every namespace. If empty, only the SlurmJobs '
+            "of NAMESPACE are handled."
+        ),
+    )
+    KUBERNETES_QPS: float = Field(
+        20,
+        gt=0,
+        description=(
+            "Maximum number of requests per second sent to the Kubernetes API, to stay within "
+            "its API Priority and Fairness limits."
+        ),
+    )
+    KUBERNETES_BURST: int = Field(
+        30,
+        gt=0,
+        description=(
+            "Maximum number of requests sent to the Kubernetes API at once above KUBERNETES_QPS."
+        ),
+    )
     EVENT_LISTENER_TIMEOUT: int = Field(
         10, description="Timeout in seconds for the event listener."
     )
+    LIST_PAGE_SIZE: int = Field(
+        500, gt=0, description="Maximum number of SlurmJobs fetched per page when listing them."
+    )
+    EVENT_WORKERS: int = Field(
+        8, gt=0, description="Number of workers handling the Kubernetes events concurrently."
+    )
+    SHUTDOWN_TIMEOUT: float = Field(
+        20,
+        gt=0,
+        description=(
+            "Time in seconds given to the operator to drain its queues on SIGTERM, after which "
+            "the work left is cancelled. Keep it below the pod termination grace period."
+        ),
+    )
+    POD_NAME: str = Field(
+        default_factory=socket.gethostname,
+        description="Name of this replica of the operator, used as holder of its leases.",
+    )
+    LEADER_ELECTION: bool = Field(
+        False,
+        description=(
+            "Whether the replicas of the operator elect who handles the SlurmJobs through "
+            "coordination.k8s.io Leases. Required to run more than one replica."
+        ),
+    )
+    LEASE_NAME: str = Field("pykubeslurm", description="Name (or prefix) of the Leases used.")
+    LEASE_DURATION: int = Field(
+        15,
+        gt=0,
+        description="Time in seconds after which a Lease that isn't renewed can be taken over.",
+    )
+    LEASE_RENEW_PERIOD: float = Field(
+        5, gt=0, description="Time in seconds between two renewals of the Leases."
+    )
+    SHARD_COUNT: int = Field(
+        1,
+        gt=0,
+        description=(
+            "Number of shards the SlurmJobs are split into by UID when leader election is "
+            "enabled. Each shard is handled by a single replica; 1 means plain leader election."
+        ),
+    )
     SLURMRESTD_USER_TOKEN: str = Field(
         "ubuntu", description="Call the Slurmrestd endpoints on behalf of this user."
     )
@@ -57,10 +123,142 @@ class Settings(BaseSettings):
         24 * 60 * 60,
         description="The Slurmrestd JWT token will expire after this many seconds.",
     )
+    SLURMRESTD_TOKEN_REFRESH_MARGIN: float = Field(
+        5 * 60,
+        ge=0,
+        description="Refresh the Slurmrestd JWT tokens this many seconds before they expire.",
+    )
+    SLURMRESTD_TOKEN_POOL_SIZE: int = Field(
+        1024,
+        gt=0,
+        description="Maximum number of users whose Slurmrestd tokens are kept in memory.",
+    )
+    SLURM_USER_ANNOTATION: None | str = Field(
+        None,
+        description=(
+            "Annotation of the SlurmJobs holding the user to submit them as. "
+            "If unset or missing, the SLURMRESTD_USER_TOKEN user is used."
+        ),
+    )
+    SLURM_ALLOWED_USERS: dict[str, list[str]] = Field(
+        default_factory=dict,
+        description=(
+            "Users the SlurmJobs of each namespace may be submitted as through "
+            'SLURM_USER_ANNOTATION, as a JSON object mapping a namespace (or "*" for every '
+            "namespace) to a list of users. SlurmJobs annotated with any other user, or root, "
+            "are rejected."
+        ),
+    )
     RECONCILIATION_TIME: int = Field(
         60,
         gt=0,
-        description="Time in seconds to reconcile jobs submitted to slurmrestd.",
+        description="Base time in seconds between two polls of a pending or running job.",
+    )
+    RECONCILIATION_TICK: int = Field(
+        5,
+        gt=0,
+        description=(
+            "Time in seconds between two reconciliation runs, which poll the jobs due. "
+            "Fresh submissions are polled at this pace."
+        ),
+    )
+    RECONCILIATION_MAX_INTERVAL: int = Field(
+        15 * 60,
+        gt=0,
+        description="Maximum time in seconds between two polls of an active job.",
+    )
+    RECONCILIATION_BUDGET: int = Field(
+        1000,
+        gt=0,
+        description="Maximum number of jobs polled per reconciliation run.",
+    )
+    SLURM_STATE_FEED_FILE: None | Path = Field(
+        None,
+        description=(
+            "Job event log to follow for Slurm job state changes, such as the file written by "
+            "the jobcomp/filetxt plugin. Polling then becomes a slow safety net."
+        ),
+    )
+    SLURM_STATE_FEED_SOCKET: None | Path = Field(
+        None,
+        description=(
+            "Path of a Unix socket to listen on for Slurm job state changes. Takes precedence "
+            "over SLURM_STATE_FEED_FILE. Polling then becomes a slow safety net."
+        ),
+    )
+    RECONCILIATION_SLICE_TIME: float = Field(
+        4,
+        gt=0,
+        description=(
+            "Maximum time in seconds spent by a reconciliation run. The jobs left are polled "
+            "first by the next run."
+        ),
+    )
+    RECONCILIATION_CONCURRENCY: int = Field(
+        50,
+        gt=0,
+        description="Maximum number of SlurmJobs processed concurrently during a reconciliation.",
+    )
+    SLURMRESTD_MAX_CONNECTIONS: int = Field(
+        50,
+        gt=0,
+        description="Maximum number of connections kept open to the Slurmrestd endpoint.",
+    )
+    SUBMISSION_CONCURRENCY: int = Field(
+        20, gt=0, description="Maximum number of concurrent job submissions to Slurmrestd."
+    )
+    SLURMRESTD_RATE_LIMIT: float = Field(
+        20, gt=0, description="Maximum number of requests per second sent to Slurmrestd."
+    )
+    SLURMRESTD_BURST: int = Field(
+        40,
+        gt=0,
+        description="Maximum number of requests sent to Slurmrestd at once above the rate limit.",
+    )
+    SLURMRESTD_MIN_CONCURRENCY: int = Field(
+        2,
+        gt=0,
+        description=(
+            "Lowest value the adaptive limit of concurrent requests to Slurmrestd can drop to. "
+            "The limit grows back up to SLURMRESTD_MAX_CONNECTIONS while Slurmrestd is healthy."
+        ),
+    )
+    SLURMRESTD_LATENCY_TARGET: float = Field(
+        2,
+        gt=0,
+        description=(
+            "Time in seconds above which a Slurmrestd response is taken as a sign of overload, "
+            "lowering the limit of concurrent requests."
+        ),
+    )
+    SLURMRESTD_BREAKER_THRESHOLD: int = Field(
+        5,
+        gt=0,
+        description=(
+            "Number of consecutive failed Slurmrestd requests after which requests are held "
+            "back until Slurmrestd answers a probe again."
+        ),
+    )
+    SLURMRESTD_BREAKER_RESET_TIME: float = Field(
+        2,
+        gt=0,
+        description="Time in seconds requests are held back before Slurmrestd is probed again.",
+    )
+    RETRY_ATTEMPTS: int = Field(
+        5,
+        ge=0,
+        description=(
+            "Number of times a failed idempotent Slurmrestd request, Kubernetes event or job "
+            "submission is retried."
+        ),
+    )
+    RETRY_BASE_DELAY: float = Field(
+        0.1,
+        gt=0,
+        description="Base time in seconds of the exponential backoff between two retries.",
+    )
+    RETRY_MAX_DELAY: float = Field(
+        10, gt=0, description="Maximum time in seconds between two retries."
     )
     HEALTH_CHECK_ADDRESS: str = Field(
         "0.0.0.0",
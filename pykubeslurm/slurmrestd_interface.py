@@ -4,16 +4,56 @@ Core module for Jobbergate API identity management.
 Code adapted from the [Cluster Agent](https://github.com/omnivector-solutions/cluster-agent/blob/main/cluster_agent/identity/slurmrestd.py)
 project by Omnivector Solutions, LLC.
 """
+import asyncio
+import math
+import re
 import sys
+import threading
+import time
 import typing
-from datetime import datetime, timedelta
+from collections import OrderedDict
+from pathlib import Path
 
 import httpx
 from jose import jwt
-from jose.exceptions import ExpiredSignatureError, JWTClaimsError, JWTError
+from jose.exceptions import JWTError
 from loguru import logger
 
+from pykubeslurm.metrics import (
+    SLURMRESTD_OVERLOAD_SIGNALS,
+    SLURMRESTD_REQUEST_DURATION,
+    SLURMRESTD_RETRIES,
+    TOKEN_CACHE_REQUESTS,
+)
+from pykubeslurm.resilience import CircuitBreaker, retry_policy
+from pykubeslurm.runtime import runtime
 from pykubeslurm.settings import SETTINGS
+from pykubeslurm.throttle import AdaptiveThrottle, RequestPriority
+
+# Tokens expiring within this many seconds are considered expired
+TOKEN_EXPIRATION_LEEWAY = 10
+
+# Path segments made of digits only, i.e. the Slurm job IDs
+JOB_ID_IN_PATH = re.compile(r"/\d+(?=/|$)")
+
+# Slurm error "Zero Bytes were transmitted or received", returned when slurmctld is overwhelmed
+SLURM_ZERO_BYTES_ERROR = 5005
+
+# Slurm error SLURMCTLD_COMMUNICATIONS_BACKOFF, returned when slurmctld limits the rate of RPCs
+SLURM_TOO_MANY_RPCS_ERROR = 1804
+
+# Slurm errors telling slurmctld is overwhelmed, by reason reported as an overload signal
+SLURM_OVERLOAD_ERRORS = {SLURM_ZERO_BYTES_ERROR: "5005", SLURM_TOO_MANY_RPCS_ERROR: "1804"}
+
+# Statuses of a proxy or Slurmrestd itself failing to serve the request
+OVERLOAD_STATUS_CODES = frozenset({502, 503, 504})
+
+# Methods that can be sent again without side effects. Other requests can be marked as
+# idempotent with the `idempotent` request extension.
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+# Transport errors raised before the request reached Slurmrestd, so any request can be retried
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
 
 
 def _load_jwt_key_string() -> str:
@@ -41,19 +81,38 @@ def _load_jwt_key_string() -> str:
     return secret_key
 
 
-def _load_token_from_cache() -> typing.Union[str, None]:
+def _token_path(username: str) -> None | Path:
+    """
+    Return the path of the cached token of the given user.
+
+    Returns:
+        Path: The token path, one file per user.
+        None: None if the username can't be used as a file name.
+    """
+    if not username or username != Path(username).name or username.startswith("."):
+        return None
+    return SETTINGS.CACHE_DIR / "slurmrestd" / "tokens" / username
+
+
+def _load_token_from_cache(username: str) -> None | tuple[str, float]:
     """
     Load the slurmrestd auth token from the cache directory.
 
+    The token file is only used to warm start the in-memory token cache.
+
+    Args:
+        username: The username the token must have been issued for.
+
     Returns:
-        str: The Slurmrestd auth token
+        tuple: The Slurmrestd auth token and its expiration timestamp
         None: None if the token is one of the following:
             * Doesn't exist
             * Can't be read
+            * Is issued for another user
             * Is expired
     """
-    token_path = SETTINGS.CACHE_DIR / "slurmrestd/token"
-    if not token_path.exists():
+    token_path = _token_path(username)
+    if token_path is None or not token_path.exists():
         return None
 
     assert hasattr(logger, "focus")  # make mypy happy
@@ -66,33 +125,29 @@ def _load_token_from_cache() -> typing.Union[str, None]:
             )
             return None
 
-    secret_key = _load_jwt_key_string()
-
     with logger.focus("PyKubeSlurm - Decode Existing Token from Cache"):
         try:
-            jwt.decode(
-                token,
-                secret_key,
-                options=dict(verify_signature=False, verify_exp=True, leeway=-10),
-            )
-        except ExpiredSignatureError:
-            logger.warning("Cached token is expired. Will acquire a new one.")
-            return None
-        except JWTClaimsError:
-            logger.warning("Cached token is malformed. Will acquire a new one")
-            return None
+            claims = jwt.get_unverified_claims(token)
         except JWTError:
             logger.warning("Cached token is malformed. Will acquire a new one")
             return None
 
-    return token
+        if claims.get("sun") != username:
+            logger.debug(f"Cached token isn't issued for {username}. Will acquire a new one")
+            return None
+        if claims.get("exp", 0) <= time.time() + TOKEN_EXPIRATION_LEEWAY:
+            logger.warning("Cached token is expired. Will acquire a new one.")
+            return None
+
+    return token, claims["exp"]
 
 
-def _write_token_to_cache(token: str) -> None:
+def _write_token_to_cache(username: str, token: str) -> None:
     """
     Write the Slurmrestd token to the cache.
 
     Args:
+        username (str): The username the token is issued for
         token (str): The Slurmrestd auth token
     """
     assert hasattr(logger, "focus")  # make mypy happy
@@ -107,7 +162,10 @@ def _write_token_to_cache(token: str) -> None:
                 )
                 return
 
-        token_path = SETTINGS.CACHE_DIR / "slurmrestd" / "token"
+        token_path = _token_path(username)
+        if token_path is None:
+            logger.warning(f"Invalid username {username!r}. Token will not be saved.")
+            return
         if not token_path.parent.exists():
             token_path.parent.mkdir(parents=True, exist_ok=True)
         try:
@@ -117,91 +175,317 @@ def _write_token_to_cache(token: str) -> None:
             logger.error(f"Couldn't save token to {token_path}")
 
 
-def acquire_token(username: str) -> str:
+def _generate_token(username: str) -> tuple[str, float]:
     """
-    Generate a JWT token to be used against Slurmrestd.
+    Generate a JWT token to be used against Slurmrestd and save it to the cache directory.
 
     Args:
         username: The username which requests will be made on behalf of.
     Returns:
-        str: The JWT token.
+        tuple: The JWT token and its expiration timestamp.
     """
     assert hasattr(logger, "focus")  # make mypy happy
     with logger.focus("PyKubeSlurm - Generate JWT Token"):
-        logger.debug("Attempting to use cached token")
-        token = _load_token_from_cache()
+        secret_key = _load_jwt_key_string()
+
+        now = int(time.time())
+        expires_at = now + int(SETTINGS.SLURMRESTD_EXP_TIME_IN_SECONDS)
+        payload = {
+            "exp": expires_at,
+            "iat": now,
+            "sun": username,
+        }
+        token = jwt.encode(payload, secret_key, algorithm="HS256")
+        _write_token_to_cache(username, token)
 
-        if token is None:
-            secret_key = _load_jwt_key_string()
+        logger.debug("Successfully generated auth token")
+    return token, expires_at
 
-            now = datetime.now()
-            payload = {
-                "exp": now + timedelta(seconds=SETTINGS.SLURMRESTD_EXP_TIME_IN_SECONDS),
-                "iat": now,
-                "sun": username,
-            }
-            token = jwt.encode(payload, secret_key, algorithm="HS256")
-            _write_token_to_cache(token)
 
-        logger.debug("Successfully generated auth token")
-    return token
+def _log_refresh_failure(refreshing: asyncio.Future[tuple[str, float]]) -> None:
+    if not refreshing.cancelled() and refreshing.exception() is not None:
+        # the token is minted again once it expires
+        logger.error(f"Couldn't refresh the Slurmrestd token: {refreshing.exception()}")
 
 
-def inject_token(
-    request: httpx.Request,
-    username: typing.Optional[str] = None,
-) -> httpx.Request:
+class TokenCache:
     """
-    Inject a token based on the provided username into the request.
+    Bounded in-memory pool of the Slurmrestd tokens and their expiration, keyed by username.
 
-    For requests that need to use something except the default username,
-    this injector should be used at the request level (instead of at client
-    initialization), for example:
+    The pool keeps the `SLURMRESTD_TOKEN_POOL_SIZE` most recently used tokens. Reads take no
+    lock; only storing a new token does. A token is minted on a miss and refreshed in the
+    background once it is within `SLURMRESTD_TOKEN_REFRESH_MARGIN` seconds of its expiration,
+    so requests never wait for a new token unless the cached one has already expired.
 
-    ```python
-    client.get(url, auth=lambda r: inject_token(r, username=username))
-    ```
+    Tokens are minted and refreshed in the worker threads of the event loop's default executor,
+    once for all the requests of a user missing the cache at the same time.
+    """
 
-    Returns:
-        httpx.Request: The intercepted request object.
+    def __init__(self, max_size: None | int = None) -> None:
+        self._max_size = max_size if max_size is not None else SETTINGS.SLURMRESTD_TOKEN_POOL_SIZE
+        self._lock = threading.Lock()
+        self._tokens: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._refreshing: set[str] = set()
+        self._minting: dict[str, asyncio.Future[tuple[str, float]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._tokens)
+
+    def _store(self, username: str, token: tuple[str, float]) -> None:
+        with self._lock:
+            self._tokens[username] = token
+            self._tokens.move_to_end(username)
+            while len(self._tokens) > self._max_size:
+                self._tokens.popitem(last=False)
+
+    def _refresh(self, username: str) -> tuple[str, float]:
+        try:
+            token = _generate_token(username)
+            self._store(username, token)
+            return token
+        finally:
+            with self._lock:
+                self._refreshing.discard(username)
+
+    def _refresh_in_background(self, username: str) -> None:
+        with self._lock:
+            if username in self._refreshing:
+                return
+            self._refreshing.add(username)
+        refreshing = asyncio.get_running_loop().run_in_executor(None, self._refresh, username)
+        refreshing.add_done_callback(_log_refresh_failure)
+
+    def _cached(self, username: str) -> None | str:
+        """Return the token of the given user kept in memory, unless it has expired."""
+        cached = self._tokens.get(username)
+        if cached is None:
+            return None
+        try:
+            self._tokens.move_to_end(username)
+        except KeyError:
+            # evicted in the meantime, the token is still good for this request
+            pass
+
+        now = time.time()
+        if cached[1] <= now + TOKEN_EXPIRATION_LEEWAY:
+            return None
+        TOKEN_CACHE_REQUESTS.labels(result="hit").inc()
+        if cached[1] <= now + SETTINGS.SLURMRESTD_TOKEN_REFRESH_MARGIN:
+            self._refresh_in_background(username)
+        return cached[0]
+
+    def _load_or_mint(self, username: str) -> tuple[str, float]:
+        """Warm start the token of the given user from disk, or mint a new one. Blocking."""
+        cached = _load_token_from_cache(username)
+        if cached is not None:
+            TOKEN_CACHE_REQUESTS.labels(result="hit").inc()
+            self._store(username, cached)
+            return cached
+        TOKEN_CACHE_REQUESTS.labels(result="miss").inc()
+        return self._refresh(username)
+
+    async def async_get(self, username: str) -> str:
+        """
+        Return a valid token for the given user without blocking the event loop.
+
+        Args:
+            username: The username which requests will be made on behalf of.
+        """
+        cached = self._cached(username)
+        if cached is not None:
+            return cached
+
+        minting = self._minting.get(username)
+        if minting is None:
+            minting = asyncio.ensure_future(asyncio.to_thread(self._load_or_mint, username))
+            self._minting[username] = minting
+            minting.add_done_callback(lambda _: self._minting.pop(username, None))
+        # a cancelled request doesn't cancel the minting the others wait for
+        token, _ = await asyncio.shield(minting)
+        return token
+
+
+token_cache = TokenCache()
+
+
+class SlurmrestdAuth(httpx.Auth):
     """
-    if username is None:
-        username = SETTINGS.SLURMRESTD_USER_TOKEN
+    Authentication of the requests made to Slurmrestd on behalf of the given user.
+
+    The token is minted off the event loop, so only asynchronous clients are supported, e.g.
+    `client.post(url, auth=SlurmrestdAuth(username))`.
+    """
+
+    def __init__(self, username: typing.Optional[str] = None) -> None:
+        self.username = username
 
-    token = _load_token_from_cache()
-    if token is None:
-        token = acquire_token(username)
+    def sync_auth_flow(
+        self, request: httpx.Request
+    ) -> typing.Generator[httpx.Request, httpx.Response, None]:
+        raise RuntimeError("SlurmrestdAuth can only be used by asynchronous clients")
 
-    request.headers["x-slurm-user-name"] = username
-    request.headers["x-slurm-user-token"] = token
-    return request
+    async def async_auth_flow(
+        self, request: httpx.Request
+    ) -> typing.AsyncGenerator[httpx.Request, httpx.Response]:
+        username = self.username if self.username is not None else SETTINGS.SLURMRESTD_USER_TOKEN
+        request.headers["x-slurm-user-name"] = username
+        request.headers["x-slurm-user-token"] = await token_cache.async_get(username)
+        yield request
 
 
-class BackendClient(httpx.Client):
-    """Client extension class to customize log messages and the auth method when a request is made to the Slurmrestd API."""
+def slurm_errors(response: httpx.Response) -> None | list[dict[str, typing.Any]]:
+    """
+    Return the Slurm errors reported in the body of a Slurmrestd response.
 
-    _token: typing.Optional[str]
+    Returns:
+        list: The Slurm errors, empty if the response reports none.
+        None: None if the body isn't a Slurmrestd payload, e.g. the error page of a proxy.
+    """
+    if not response.is_stream_consumed:
+        return None
+    try:
+        body = response.json()
+    except ValueError:
+        return None
+    if not isinstance(body, dict) or not isinstance(body.get("errors", []), list):
+        return None
+    return [error for error in body.get("errors") or [] if isinstance(error, dict)]
+
+
+def overload_reason(response: httpx.Response) -> None | str:
+    """
+    Tell whether a Slurmrestd response shows signs of overload of Slurmrestd or slurmctld.
+
+    Slurmrestd answers ordinary Slurm errors, e.g. an invalid partition or an unknown job, with
+    a 500 and the errors in its body: those aren't overload. Only the body of the error
+    responses is looked at, so the healthy ones aren't parsed twice.
+
+    Returns:
+        str: The sign of overload, i.e. one of `SLURM_OVERLOAD_ERRORS`, a 502, 503 or 504, or
+            a 5xx without Slurm errors in its body.
+        None: None if the response is healthy or reports an ordinary Slurm error.
+    """
+    if response.is_success:
+        return None
+    errors = slurm_errors(response)
+    for error in errors or []:
+        if error.get("error_number") in SLURM_OVERLOAD_ERRORS:
+            return SLURM_OVERLOAD_ERRORS[error["error_number"]]
+    if response.status_code in OVERLOAD_STATUS_CODES:
+        return "5xx"
+    if response.is_server_error and not errors:
+        return "5xx"
+    return None
+
+
+class AsyncBackendClient(httpx.AsyncClient):
+    """
+    Client of the Slurmrestd API sharing a single connection pool, logging every request and
+    authenticating it with the token of its user.
+
+    Requests go through an `AdaptiveThrottle`, so bursts of reconciliation or submissions don't
+    flood slurmrestd and slurmctld. The priority of a request is given as the `priority`
+    extension, e.g. `client.post(url, extensions={"priority": RequestPriority.SUBMISSION})`;
+    it defaults to `RequestPriority.POLL`. The `latency_target` extension overrides the
+    latency above which the response is taken as a sign of overload; None leaves the latency
+    out, e.g. for the job listing, whose duration grows with the number of jobs.
+
+    Idempotent requests (see `IDEMPOTENT_METHODS` and the `idempotent` extension) failing with
+    a transport error, a 5xx or the Slurm error 5005 are retried with exponential backoff; the
+    others only when they never reached Slurmrestd. After consecutive failures, a
+    `CircuitBreaker` holds every request back until Slurmrestd recovers.
+    """
 
     def __init__(self) -> None:
-        self._token = None
+        self.throttle = AdaptiveThrottle(
+            rate=SETTINGS.SLURMRESTD_RATE_LIMIT,
+            burst=SETTINGS.SLURMRESTD_BURST,
+            min_limit=SETTINGS.SLURMRESTD_MIN_CONCURRENCY,
+            max_limit=SETTINGS.SLURMRESTD_MAX_CONNECTIONS,
+            latency_target=SETTINGS.SLURMRESTD_LATENCY_TARGET,
+        )
+        self.breaker = CircuitBreaker(
+            threshold=SETTINGS.SLURMRESTD_BREAKER_THRESHOLD,
+            reset_timeout=SETTINGS.SLURMRESTD_BREAKER_RESET_TIME,
+        )
         super().__init__(
             base_url=SETTINGS.SLURMRESTD_ENDPOINT,
-            auth=inject_token,
+            auth=SlurmrestdAuth(),
             event_hooks=dict(
                 request=[self._log_request],
                 response=[self._log_response],
             ),
             timeout=SETTINGS.SLURMRESTD_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=SETTINGS.SLURMRESTD_MAX_CONNECTIONS,
+                max_keepalive_connections=SETTINGS.SLURMRESTD_MAX_CONNECTIONS,
+            ),
         )
 
+    async def send(self, request: httpx.Request, **kwargs: typing.Any) -> httpx.Response:
+        """
+        Send a request once the circuit breaker and the throttle let it through, retrying it
+        if it failed and can be sent again.
+        """
+        priority = request.extensions.get("priority", RequestPriority.POLL)
+        idempotent = request.extensions.get("idempotent", request.method in IDEMPOTENT_METHODS)
+        latency_target = request.extensions.get("latency_target", self.throttle.latency_target)
+        attempt = 0
+        while True:
+            await self.breaker.wait()
+            started_at = await self.throttle.acquire(priority)
+            response: None | httpx.Response = None
+            reason: None | str = None
+            try:
+                response = await super().send(request, **kwargs)
+                reason = overload_reason(response)
+            except httpx.TransportError as err:
+                # timeouts and refused connections included
+                reason = "transport"
+                retryable = idempotent or isinstance(err, NOT_SENT_ERRORS)
+                if not (retryable and retry_policy.should_retry(attempt + 1)):
+                    raise
+            finally:
+                if reason is not None:
+                    SLURMRESTD_OVERLOAD_SIGNALS.labels(reason=reason).inc()
+                self.throttle.release(
+                    started_at,
+                    overloaded=reason is not None,
+                    latency_target=math.inf if latency_target is None else latency_target,
+                )
+                if response is not None or reason is not None:
+                    self.breaker.record(success=reason is None)
+
+            if response is not None:
+                if reason is None or not idempotent or not retry_policy.should_retry(attempt + 1):
+                    return response
+                await response.aclose()
+            attempt += 1
+            delay = retry_policy.backoff(attempt)
+            SLURMRESTD_RETRIES.inc()
+            logger.warning(
+                f"{request.method} {request.url} failed ({reason}). "
+                f"Retrying in {delay:.2f}s (attempt {attempt} of {retry_policy.attempts})."
+            )
+            await asyncio.sleep(delay)
+
     @staticmethod
-    def _log_request(request: httpx.Request) -> None:
+    async def _log_request(request: httpx.Request) -> None:
+        request.extensions["started_at"] = time.perf_counter()
         assert hasattr(logger, "focus")  # make mypy happy
         with logger.focus("PyKubeSlurm - Make Request to the Slurmrestd API"):
             logger.debug(f"Making request: {request.method} {request.url}")
 
     @staticmethod
-    def _log_response(response: httpx.Response) -> None:
+    async def _log_response(response: httpx.Response) -> None:
+        request = response.request
+        if "started_at" in request.extensions:
+            SLURMRESTD_REQUEST_DURATION.labels(
+                method=request.method,
+                # job IDs would make one series per job
+                endpoint=JOB_ID_IN_PATH.sub("/{job_id}", request.url.path),
+                status=response.status_code,
+            ).observe(time.perf_counter() - request.extensions["started_at"])
         assert hasattr(logger, "focus")  # make mypy happy
         with logger.focus("PyKubeSlurm - Request Completed"):
             logger.debug(
@@ -211,4 +495,27 @@ class BackendClient(httpx.Client):
             )
 
 
-backend_client = BackendClient()
+_async_backend_client: None | AsyncBackendClient = None
+
+
+async def _close_async_backend_client() -> None:
+    global _async_backend_client
+
+    if _async_backend_client is not None:
+        await _async_backend_client.aclose()
+        _async_backend_client = None
+
+
+def async_backend_client() -> AsyncBackendClient:
+    """
+    Return the asynchronous client shared by every coroutine of the runtime.
+
+    The client, and its pool of persistent connections, is created on first use and closed
+    when the runtime stops. It must only be used from the runtime event loop.
+    """
+    global _async_backend_client
+
+    if _async_backend_client is None:
+        _async_backend_client = AsyncBackendClient()
+        runtime.add_cleanup(_close_async_backend_client)
+    return _async_backend_client
@@ -0,0 +1,271 @@
+"""Core module for the sources pushing Slurm job state changes to the operator."""
+import abc
+import asyncio
+import os
+import re
+import socket
+import threading
+import time
+from collections.abc import Iterator
+from functools import partial
+from pathlib import Path
+from typing import TextIO
+
+from loguru import logger
+
+from pykubeslurm.cache import job_store, object_key
+from pykubeslurm.leader import coordinator
+from pykubeslurm.runtime import runtime
+from pykubeslurm.scheduler import plan_next_poll, process_job_crd
+from pykubeslurm.schemas import JobState, JobStatus, SlurmJobState
+from pykubeslurm.settings import SETTINGS
+
+JOB_EVENT_FIELD = re.compile(r"(\w+)=(\S*)")
+
+# Time in seconds between two checks for new data or for the stop request
+WAIT_INTERVAL = 0.5
+
+# Time in seconds after which a connection that sends nothing is closed
+CONNECTION_IDLE_TIMEOUT = 30
+
+
+def parse_job_event(line: str) -> None | tuple[int, SlurmJobState]:
+    """
+    Parse a job state change written as `key=value` pairs.
+
+    The format is the one written by the `jobcomp/filetxt` plugin, e.g.
+    `JobId=42 UserId=ubuntu(1000) JobState=COMPLETED ...`. Only `JobId`, `JobState` and the
+    optional `Reason` are used, so a `PrologSlurmctld` or `EpilogSlurmctld` script can report
+    job starts and ends with a single line such as `JobId=42 JobState=RUNNING`.
+
+    Returns:
+        tuple: The Slurm job ID and its new state.
+        None: None if the line isn't a job state change this operator knows about.
+    """
+    fields = dict(JOB_EVENT_FIELD.findall(line))
+    try:
+        slurm_job_id = int(fields["JobId"])
+        state = fields["JobState"]
+    except (KeyError, ValueError):
+        return None
+    if JobState.from_slurm(state) == JobState.UNKNOWN:
+        return None
+    return slurm_job_id, SlurmJobState(
+        state=state, reason=fields.get("Reason") or None, errors=[], next_transition_at=None
+    )
+
+
+class StateSource(abc.ABC):
+    """Source of Slurm job state changes, read as lines of `key=value` pairs."""
+
+    @abc.abstractmethod
+    def lines(self, stop: threading.Event) -> Iterator[str]:
+        """Yield the lines of the source as they arrive, until `stop` is set."""
+
+
+class FileStateSource(StateSource):
+    """
+    Follow a job event log such as the file written by `jobcomp/filetxt`.
+
+    The file is read from its end: the jobs that changed before the operator started are
+    caught up by the reconciliation. A rotated or truncated file is read again from its start.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+
+    def _open(self) -> None | TextIO:
+        try:
+            return self.path.open()
+        except FileNotFoundError:
+            return None
+
+    def _rotated(self, stream: TextIO) -> bool:
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return False
+        return stat.st_ino != os.fstat(stream.fileno()).st_ino or stat.st_size < stream.tell()
+
+    def lines(self, stop: threading.Event) -> Iterator[str]:
+        stream = self._open()
+        if stream is not None:
+            stream.seek(0, os.SEEK_END)
+        partial_line = ""
+        try:
+            while not stop.is_set():
+                if stream is None:
+                    stream = self._open()
+                    if stream is None:
+                        stop.wait(WAIT_INTERVAL)
+                        continue
+
+                line = stream.readline()
+                if line.endswith("\n"):
+                    yield partial_line + line
+                    partial_line = ""
+                    continue
+                partial_line += line
+
+                if self._rotated(stream):
+                    logger.debug(f"{self.path} was rotated. Reading it from the start.")
+                    stream.close()
+                    stream = None
+                    partial_line = ""
+                    continue
+                stop.wait(WAIT_INTERVAL)
+        finally:
+            if stream is not None:
+                stream.close()
+
+
+class SocketStateSource(StateSource):
+    """
+    Listen on a local Unix socket for job state changes.
+
+    Every connection sends one or more lines, e.g.
+    `echo "JobId=$SLURM_JOB_ID JobState=RUNNING" | socat - UNIX-CONNECT:<path>` from a
+    `PrologSlurmctld` script. Connections are read one at a time, and one that stays silent
+    for `CONNECTION_IDLE_TIMEOUT` seconds is closed so it can't hold the others back.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+
+    def _read(self, connection: socket.socket, stop: threading.Event) -> Iterator[str]:
+        connection.settimeout(WAIT_INTERVAL)
+        buffer = b""
+        last_read_at = time.monotonic()
+        while not stop.is_set():
+            try:
+                data = connection.recv(4096)
+            except socket.timeout:
+                if time.monotonic() - last_read_at >= CONNECTION_IDLE_TIMEOUT:
+                    logger.warning(f"Closing a connection to {self.path} idle for too long")
+                    return
+                continue
+            if not data:
+                break
+            last_read_at = time.monotonic()
+            *lines, buffer = (buffer + data).split(b"\n")
+            for line in lines:
+                yield line.decode(errors="replace") + "\n"
+        if buffer:
+            yield buffer.decode(errors="replace")
+
+    def lines(self, stop: threading.Event) -> Iterator[str]:
+        self.path.unlink(missing_ok=True)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+            server.bind(str(self.path))
+            server.listen()
+            server.settimeout(WAIT_INTERVAL)
+            try:
+                while not stop.is_set():
+                    try:
+                        connection, _ = server.accept()
+                    except socket.timeout:
+                        continue
+                    with connection:
+                        yield from self._read(connection, stop)
+            finally:
+                self.path.unlink(missing_ok=True)
+
+
+async def apply_job_event(slurm_job_id: int, slurm_job: SlurmJobState) -> None:
+    """
+    Update the SlurmJob backed by the given Slurm job with its new state.
+
+    The next poll of the job is rescheduled as if it had just been polled.
+    """
+    resource = job_store.by_slurm_job_id(slurm_job_id)
+    if resource is None:
+        logger.debug(f"Ignoring Slurm job {slurm_job_id}, which doesn't back any SlurmJob")
+        return
+    if not coordinator.owns(resource):
+        return
+
+    key = object_key(resource)
+    plan_next_poll(key, slurm_job)
+    await process_job_crd(JobStatus(**resource["status"]), key, slurm_job)
+
+
+class JobEventDispatcher:
+    """
+    Apply the job events on the runtime without holding the state feed on each status patch.
+
+    The events of a given Slurm job are applied in the order they were pushed.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.loop = loop
+        self._tasks: dict[int, asyncio.Task[None]] = {}
+
+    def dispatch(self, slurm_job_id: int, slurm_job: SlurmJobState) -> None:
+        """Schedule the event on the runtime. Safe to call from any thread."""
+        self.loop.call_soon_threadsafe(self._start, slurm_job_id, slurm_job)
+
+    def _start(self, slurm_job_id: int, slurm_job: SlurmJobState) -> None:
+        previous = self._tasks.get(slurm_job_id)
+        task = self.loop.create_task(self._apply(previous, slurm_job_id, slurm_job))
+        self._tasks[slurm_job_id] = task
+        task.add_done_callback(partial(self._done, slurm_job_id))
+
+    async def _apply(
+        self, previous: None | asyncio.Task[None], slurm_job_id: int, slurm_job: SlurmJobState
+    ) -> None:
+        if previous is not None:
+            await asyncio.wait([previous])
+        await apply_job_event(slurm_job_id, slurm_job)
+
+    def _done(self, slurm_job_id: int, task: asyncio.Task[None]) -> None:
+        if self._tasks.get(slurm_job_id) is task:
+            del self._tasks[slurm_job_id]
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(
+                f"Error applying the new state of Slurm job {slurm_job_id}: {task.exception()}"
+            )
+
+    async def drain(self) -> None:
+        """Wait for the events dispatched so far to be applied."""
+        await asyncio.sleep(0)  # let the events dispatched from other threads start
+        while self._tasks:
+            await asyncio.wait(list(self._tasks.values()))
+
+
+def build_state_source() -> None | StateSource:
+    """Return the state source configured in the settings, if any."""
+    if SETTINGS.SLURM_STATE_FEED_SOCKET is not None:
+        return SocketStateSource(SETTINGS.SLURM_STATE_FEED_SOCKET.expanduser())
+    if SETTINGS.SLURM_STATE_FEED_FILE is not None:
+        return FileStateSource(SETTINGS.SLURM_STATE_FEED_FILE.expanduser())
+    return None
+
+
+def state_feed(thread_event: threading.Event, source: None | StateSource = None) -> None:
+    """
+    Apply the job state changes pushed by the configured state source until `thread_event` is set.
+
+    Args:
+        thread_event: Event set when the operator stops.
+        source: The state source to read. Defaults to the one configured in the settings.
+    """
+    source = source or build_state_source()
+    assert hasattr(logger, "focus")  # make mypy happy
+    with logger.focus("PyKubeSlurm - State feed logic"):
+        if source is None:
+            logger.debug("No Slurm state feed configured. Relying on polling only.")
+            return
+
+        logger.debug(f"Started thread. ID: {threading.get_ident()}")
+        dispatcher = JobEventDispatcher(runtime.loop)
+        while not thread_event.is_set():
+            try:
+                for line in source.lines(thread_event):
+                    job_event = parse_job_event(line)
+                    if job_event is not None:
+                        dispatcher.dispatch(*job_event)
+            except Exception as err:
+                # keep thread alive
+                logger.exception(err)
+                thread_event.wait(SETTINGS.EVENT_LISTENER_TIMEOUT)
+        logger.debug(f"Thread {threading.get_ident()} stopped")
@@ -0,0 +1,176 @@
+"""Core module for streaming the job submissions sent to Slurmrestd."""
+import time
+from collections.abc import Awaitable, Callable
+
+from loguru import logger
+
+from pykubeslurm.resilience import retry_policy
+from pykubeslurm.schemas import Job
+from pykubeslurm.settings import SETTINGS
+from pykubeslurm.slurmrestd_interface import (
+    NOT_SENT_ERRORS,
+    AsyncBackendClient,
+    async_backend_client,
+)
+from pykubeslurm.workqueue import WorkerPool, WorkQueue
+
+SubmitFunction = Callable[[AsyncBackendClient, Job], Awaitable[None]]
+UnconfirmedFunction = Callable[[Job, str], Awaitable[None]]
+
+# Errors telling the job wasn't submitted, so it can safely be submitted again. Any other
+# failure may have reached Slurm, so submitting again could run the job twice.
+RETRYABLE_ERRORS = NOT_SENT_ERRORS
+
+
+def _keep_pending(pending: Job, job_schema: Job) -> Job:
+    """Merge function of the submission queue: a job waiting to be submitted is kept as is."""
+    return pending
+
+
+class JobSubmitter:
+    """
+    Stream of job submissions sent to Slurmrestd by a pool of workers.
+
+    Jobs are submitted as they are added, at most `SUBMISSION_CONCURRENCY` at a time over the
+    persistent connections of the client shared on the runtime, so a slow submission holds no
+    other one back. The workers run as tasks of the runtime event loop.
+
+    A job whose submission failed without reaching Slurm (see `RETRYABLE_ERRORS`) is queued
+    again after an exponential backoff, up to `RETRY_ATTEMPTS` times. Any other failure, e.g.
+    a timeout once the request was sent, may have reached Slurm: the job is handed to
+    `unconfirmed` instead, so it can be recorded as such and never submitted again.
+    """
+
+    def __init__(
+        self, submit: SubmitFunction, unconfirmed: None | UnconfirmedFunction = None
+    ) -> None:
+        """
+        Args:
+            submit: Coroutine function submitting a single job through the given client.
+            unconfirmed: Coroutine function recording a job whose submission failed and may
+                have reached Slurm, with the reason of the failure.
+        """
+        self._submit = submit
+        self._unconfirmed = unconfirmed
+        self._queue: WorkQueue[Job] = WorkQueue(merge=_keep_pending)
+        self._workers: None | WorkerPool[Job] = None
+        self._client: None | AsyncBackendClient = None
+        self._in_flight: set[str] = set()
+        self._attempts: dict[str, int] = {}
+        self._running = 0
+        self._busy_since = 0.0
+        self._submitted_since = 0
+        self.submitted = 0
+        self.busy_seconds = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """Jobs submitted per second spent submitting."""
+        return self.submitted / self.busy_seconds if self.busy_seconds else 0.0
+
+    @property
+    def pending(self) -> int:
+        """Number of jobs waiting to be submitted, now or again after a failure."""
+        return len(self._queue)
+
+    def add(self, job_schema: Job) -> None:
+        """Queue a job for submission, unless it is already waiting or being submitted."""
+        assert job_schema.metadata.uid is not None  # make mypy happy
+        if job_schema.metadata.uid in self._in_flight:
+            return
+        self._in_flight.add(job_schema.metadata.uid)
+        self._queue.add(job_schema.metadata.uid, job_schema)
+
+    def _started(self) -> None:
+        if self._running == 0:
+            self._busy_since = time.monotonic()
+            self._submitted_since = self.submitted
+        self._running += 1
+
+    def _finished(self) -> None:
+        self._running -= 1
+        if self._running > 0:
+            return
+        elapsed = time.monotonic() - self._busy_since
+        self.busy_seconds += elapsed
+        submitted = self.submitted - self._submitted_since
+        if submitted:
+            logger.info(
+                f"Submitted {submitted} SlurmJobs in {elapsed:.3f}s "
+                f"({submitted / elapsed if elapsed else 0:.1f} jobs/s, "
+                f"{self.throughput:.1f} jobs/s overall)"
+            )
+
+    async def _submit_one(self, job_schema: Job) -> None:
+        uid = job_schema.metadata.uid
+        assert uid is not None and self._client is not None  # make mypy happy
+        requeued = False
+        self._started()
+        try:
+            await self._submit(self._client, job_schema)
+            self.submitted += 1
+        except RETRYABLE_ERRORS as err:
+            attempt = self._attempts.get(uid, 0) + 1
+            if self._queue.shutting_down or not retry_policy.should_retry(attempt):
+                logger.error(f"Gave up submitting SlurmJob {job_schema.metadata.name}: {err}")
+                return
+            delay = retry_policy.backoff(attempt)
+            logger.warning(
+                f"Couldn't submit SlurmJob {job_schema.metadata.name} ({err}). "
+                f"Retrying in {delay:.2f}s (attempt {attempt} of {retry_policy.attempts})."
+            )
+            self._attempts[uid] = attempt
+            self._queue.add_after(uid, job_schema, delay)
+            requeued = True
+        except Exception as err:
+            logger.exception(f"Error submitting SlurmJob {job_schema.metadata.name}: {err}")
+            if self._unconfirmed is not None:
+                await self._record_unconfirmed(job_schema, type(err).__name__)
+        finally:
+            if not requeued:
+                self._attempts.pop(uid, None)
+                self._in_flight.discard(uid)
+            self._finished()
+
+    async def _record_unconfirmed(self, job_schema: Job, reason: str) -> None:
+        assert self._unconfirmed is not None  # make mypy happy
+        try:
+            await self._unconfirmed(job_schema, reason)
+        except Exception as err:
+            logger.exception(
+                f"Error recording the submission of SlurmJob {job_schema.metadata.name}: {err}"
+            )
+
+    async def drain(self, predicate: Callable[[Job], bool]) -> None:
+        """Wait until none of the jobs being submitted matches the given predicate."""
+        if self._workers is not None:
+            await self._workers.drain(predicate)
+
+    def start(self) -> None:
+        """Start submitting the queued jobs on the running event loop."""
+        self._client = async_backend_client()
+        self._workers = WorkerPool(
+            self._queue,
+            self._submit_one,
+            workers=SETTINGS.SUBMISSION_CONCURRENCY,
+            name="Submitter",
+        )
+        self._workers.start()
+
+    async def stop(self, timeout: None | float = None) -> None:
+        """
+        Submit the queued jobs and stop.
+
+        The jobs waiting to be submitted again get a last attempt.
+
+        Args:
+            timeout: Seconds to wait for the queued jobs to be submitted, after which the
+                submissions left are cancelled. Unbounded if None.
+        """
+        if self._workers is None:
+            self._queue.shut_down()
+            return
+        await self._workers.stop(timeout)
+        self._workers = None
+        if self.pending:
+            logger.warning(f"Stopped with {self.pending} SlurmJobs left to submit")
@@ -0,0 +1,71 @@
+"""Core module for running the subsystems of the operator on the runtime event loop."""
+import asyncio
+import signal
+import threading
+
+from loguru import logger
+
+from pykubeslurm.events import event_listener
+from pykubeslurm.health_check import main as start_health_check
+from pykubeslurm.leader import leader_election
+from pykubeslurm.scheduler import reconciler
+from pykubeslurm.state_sources import state_feed
+
+SHUTDOWN_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+
+
+async def run_operator(shutdown: None | asyncio.Event = None) -> None:
+    """
+    Run every subsystem of the operator until SIGTERM or SIGINT is received.
+
+    The event listener (with its workers and the job submitter), the reconciler and the
+    health check server are tasks of the running event loop. The state feed and the leader
+    election, which block on files, sockets and the Leases API, run in threads it drives.
+
+    On shutdown, the watch stops right away, the events already received and the queued
+    submissions are drained for up to `SHUTDOWN_TIMEOUT` seconds, the reconciliation run in
+    progress finishes and the Leases are released. A subsystem stopping unexpectedly shuts
+    the others down the same way, and its error is raised.
+
+    Args:
+        shutdown: Event to set to stop the operator. Defaults to a new one, set by the signals.
+    """
+    shutdown = shutdown or asyncio.Event()
+    thread_event = threading.Event()
+    loop = asyncio.get_running_loop()
+    for signum in SHUTDOWN_SIGNALS:
+        loop.add_signal_handler(signum, shutdown.set)
+
+    assert hasattr(logger, "focus")  # make mypy happy
+    with logger.focus("PyKubeSlurm - Supervisor logic"):
+        runner = await start_health_check()
+        tasks = [
+            asyncio.create_task(event_listener(shutdown), name="EventListener"),
+            asyncio.create_task(reconciler(shutdown), name="Reconciler"),
+            asyncio.create_task(asyncio.to_thread(state_feed, thread_event), name="StateFeed"),
+            asyncio.create_task(
+                asyncio.to_thread(leader_election, thread_event), name="LeaderElection"
+            ),
+        ]
+        shutdown_task = asyncio.create_task(shutdown.wait())
+        failure: None | BaseException = None
+        try:
+            # the state feed and the leader election return right away when they're disabled
+            running = {shutdown_task, *tasks}
+            while shutdown_task in running and failure is None:
+                done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done - {shutdown_task}:
+                    if task.exception() is not None:
+                        failure = task.exception()
+                        logger.error(f"{task.get_name()} failed: {failure}")
+        finally:
+            logger.info("Shutting down")
+            shutdown.set()
+            thread_event.set()
+            await asyncio.gather(shutdown_task, *tasks, return_exceptions=True)
+            await runner.cleanup()
+            for signum in SHUTDOWN_SIGNALS:
+                loop.remove_signal_handler(signum)
+            logger.info("Stopped")
+        if failure is not None:
+            raise failure
@@ -0,0 +1,171 @@
+"""Core module for the client-side throttling of the requests made to Slurmrestd and Kubernetes."""
+import asyncio
+import enum
+import heapq
+import itertools
+import threading
+import time
+
+from pykubeslurm.metrics import SLURMRESTD_CONCURRENCY_LIMIT
+
+# Factor the concurrency limit is multiplied by when Slurmrestd shows signs of overload
+DECREASE_FACTOR = 0.5
+
+
+class RequestPriority(enum.IntEnum):
+    """Priority classes of the requests made to Slurmrestd. Lower values are sent first."""
+
+    SUBMISSION = 0
+    UPDATE = 1
+    POLL = 2
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at `rate` tokens per second, holding at most `burst` tokens.
+
+    It never waits by itself: callers either take tokens when available and otherwise ask how
+    long until the next one, so the waiting order stays in their hands, or reserve a token and
+    wait the time they are told to. It can be shared across threads.
+    """
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def try_take(self) -> bool:
+        """Take a token if one is available."""
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def delay(self) -> float:
+        """Return the time in seconds until the next token is available."""
+        with self._lock:
+            self._refill()
+            return max(0.0, (1 - self._tokens) / self.rate)
+
+    def reserve(self) -> float:
+        """
+        Take a token, borrowing it from the future if none is available.
+
+        Returns:
+            float: The time in seconds to wait before using the token.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+
+class AdaptiveThrottle:
+    """
+    Rate and concurrency limiter of the requests made to Slurmrestd, used from an event loop.
+
+    Requests are let through at most `rate` per second (with bursts up to `burst`) and at most
+    `limit` at once. The limit adapts AIMD-style: it grows by one every `limit` successful
+    requests, up to `max_limit`, and is halved, down to `min_limit`, when a request shows signs
+    of overload (slower than `latency_target`, failed, 5xx or Slurm error 5005). Only requests
+    sent after the last decrease can decrease it again, so a burst of failures halves it once.
+
+    Waiting requests are let through by priority, then in arrival order.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int,
+        min_limit: int,
+        max_limit: int,
+        latency_target: float,
+    ) -> None:
+        self.bucket = TokenBucket(rate, burst)
+        self.min_limit = min_limit
+        self.max_limit = max(min_limit, max_limit)
+        self.latency_target = latency_target
+        self.limit = float(self.max_limit)
+        self.in_flight = 0
+        self._decreased_at = float("-inf")
+        self._counter = itertools.count()
+        self._waiters: list[tuple[int, int, asyncio.Future[None]]] = []
+        self._timer: None | asyncio.TimerHandle = None
+        SLURMRESTD_CONCURRENCY_LIMIT.set(self.limit)
+
+    def _dispatch(self) -> None:
+        while self._waiters and self.in_flight < int(self.limit):
+            future = self._waiters[0][2]
+            if future.done():
+                # cancelled while waiting
+                heapq.heappop(self._waiters)
+                continue
+            if not self.bucket.try_take():
+                if self._timer is None:
+                    self._timer = asyncio.get_running_loop().call_later(
+                        self.bucket.delay(), self._on_timer
+                    )
+                return
+            heapq.heappop(self._waiters)
+            self.in_flight += 1
+            future.set_result(None)
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        self._dispatch()
+
+    async def acquire(self, priority: RequestPriority = RequestPriority.POLL) -> float:
+        """
+        Wait until a request of the given priority can be sent.
+
+        Returns:
+            float: The time the request was let through, to hand back to `release`.
+        """
+        if not self._waiters and self.in_flight < int(self.limit) and self.bucket.try_take():
+            self.in_flight += 1
+            return time.monotonic()
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # let through right before being cancelled: hand the slot to the next one
+                self.in_flight -= 1
+                self._dispatch()
+            raise
+        return time.monotonic()
+
+    def release(
+        self, started_at: float, overloaded: bool, latency_target: None | float = None
+    ) -> None:
+        """
+        Record the outcome of a request let through at `started_at` and free its slot.
+
+        Args:
+            started_at: The time returned by `acquire`.
+            overloaded: Whether the request showed signs of overload of Slurmrestd.
+            latency_target: The latency target of the request. Defaults to the throttle's.
+        """
+        if latency_target is None:
+            latency_target = self.latency_target
+        self.in_flight -= 1
+        if overloaded or time.monotonic() - started_at > latency_target:
+            if started_at >= self._decreased_at:
+                self.limit = max(float(self.min_limit), self.limit * DECREASE_FACTOR)
+                self._decreased_at = time.monotonic()
+        else:
+            self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+        SLURMRESTD_CONCURRENCY_LIMIT.set(self.limit)
+        self._dispatch()
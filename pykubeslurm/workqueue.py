@@ -0,0 +1,227 @@
+"""Core module for the keyed work queue and the worker pool draining it."""
+import asyncio
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from typing import Generic, TypeVar
+
+from loguru import logger
+
+from pykubeslurm.resilience import RetryPolicy
+
+T = TypeVar("T")
+
+
+class WorkQueue(Generic[T]):
+    """
+    Work queue holding at most one item per key, used from the runtime event loop.
+
+    Adding an item for a key already waiting in the queue merges both items into one. A key is
+    handed to a single worker at a time: items added while it is being processed wait until the
+    worker marks it as done, so the items of a key are processed in order. Failed items can be
+    added back after a delay, before any newer item of their key.
+    """
+
+    def __init__(self, merge: Callable[[T, T], T]) -> None:
+        """
+        Args:
+            merge: Function merging the pending item of a key with a newer one.
+        """
+        self._merge = merge
+        self._wakeup = asyncio.Event()
+        self._queue: deque[str] = deque()
+        self._pending: dict[str, T] = {}
+        self._processing: set[str] = set()
+        self._delayed: dict[str, tuple[asyncio.TimerHandle, T]] = {}
+        self._shutting_down = False
+
+    def add(self, key: str, item: T) -> None:
+        """Add an item to the queue, merging it with the pending item of the same key."""
+        if key in self._delayed:
+            # processed after the delayed item it is merged with
+            handle, delayed_item = self._delayed[key]
+            self._delayed[key] = (handle, self._merge(delayed_item, item))
+            return
+        if key in self._pending:
+            self._pending[key] = self._merge(self._pending[key], item)
+            return
+        self._pending[key] = item
+        if key not in self._processing:
+            self._queue.append(key)
+            self._wakeup.set()
+
+    def add_after(self, key: str, item: T, delay: float) -> None:
+        """Add an item back to the queue after `delay` seconds, e.g. to retry it."""
+        if key in self._pending:
+            # the item is older than the pending one
+            item = self._merge(item, self._pending.pop(key))
+            if key in self._queue:
+                self._queue.remove(key)
+        handle = asyncio.get_running_loop().call_later(delay, self._add_delayed, key)
+        self._delayed[key] = (handle, item)
+
+    def _add_delayed(self, key: str) -> None:
+        _, item = self._delayed.pop(key)
+        self.add(key, item)
+
+    def get_nowait(self) -> None | tuple[str, T]:
+        """
+        Take the next item out of the queue without waiting.
+
+        Returns:
+            tuple: The key and its item.
+            None: None if the queue is empty.
+        """
+        if not self._queue:
+            return None
+        key = self._queue.popleft()
+        self._processing.add(key)
+        return key, self._pending.pop(key)
+
+    async def get(self) -> None | tuple[str, T]:
+        """
+        Wait until an item is available and take it out of the queue.
+
+        Returns:
+            tuple: The key and its item.
+            None: None if the queue is shut down and empty.
+        """
+        while not self._queue and not self._shutting_down:
+            self._wakeup.clear()
+            await self._wakeup.wait()
+        return self.get_nowait()
+
+    def done(self, key: str) -> None:
+        """Mark a key as processed, queueing it again if items arrived in the meantime."""
+        self._processing.discard(key)
+        if key in self._pending:
+            self._queue.append(key)
+            self._wakeup.set()
+
+    def shut_down(self) -> None:
+        """
+        Stop accepting waits; workers drain the remaining items and then stop.
+
+        The items waiting to be added back are added right away, for a last attempt.
+        """
+        self._shutting_down = True
+        for key, (handle, _) in list(self._delayed.items()):
+            handle.cancel()
+            self._add_delayed(key)
+        self._wakeup.set()
+
+    @property
+    def shutting_down(self) -> bool:
+        """Whether the queue was shut down."""
+        return self._shutting_down
+
+    def __len__(self) -> int:
+        """Return the number of keys waiting to be processed, now or after a delay."""
+        return len(self._pending) + len(self._delayed)
+
+
+@dataclass
+class WorkerStats:
+    """Processing statistics of a single worker."""
+
+    processed: int = 0
+    total_seconds: float = 0.0
+    last_seconds: float = 0.0
+
+    @property
+    def average_seconds(self) -> float:
+        """Average time in seconds spent per item."""
+        return self.total_seconds / self.processed if self.processed else 0.0
+
+
+class WorkerPool(Generic[T]):
+    """
+    Pool of tasks draining a `WorkQueue` with the given coroutine function.
+
+    With a retry policy, an item whose handling failed is added back to the queue after an
+    exponential backoff, until it succeeds or runs out of attempts.
+    """
+
+    def __init__(
+        self,
+        queue: WorkQueue[T],
+        handler: Callable[[T], Awaitable[None]],
+        workers: int,
+        name: str,
+        retry: None | RetryPolicy = None,
+    ) -> None:
+        self.queue = queue
+        self._handler = handler
+        self._retry = retry
+        self._attempts: dict[str, int] = {}
+        self._handling: dict[str, T] = {}
+        self._handled = asyncio.Condition()
+        self._names = [f"{name}-{index}" for index in range(workers)]
+        self._tasks: list[asyncio.Task[None]] = []
+        self.stats = {worker_name: WorkerStats() for worker_name in self._names}
+
+    async def _work(self, stats: WorkerStats) -> None:
+        while (work := await self.queue.get()) is not None:
+            key, item = work
+            started_at = time.monotonic()
+            self._handling[key] = item
+            try:
+                await self._handler(item)
+                self._attempts.pop(key, None)
+            except Exception as err:
+                self._handle_failure(key, item, err)
+            finally:
+                elapsed = time.monotonic() - started_at
+                stats.processed += 1
+                stats.total_seconds += elapsed
+                stats.last_seconds = elapsed
+                self.queue.done(key)
+                del self._handling[key]
+                async with self._handled:
+                    self._handled.notify_all()
+
+    def _handle_failure(self, key: str, item: T, err: Exception) -> None:
+        attempt = self._attempts.get(key, 0) + 1
+        if self._retry is None or self.queue.shutting_down or not self._retry.should_retry(attempt):
+            self._attempts.pop(key, None)
+            logger.exception(f"Error processing {key}: {err}")
+            return
+        self._attempts[key] = attempt
+        delay = self._retry.backoff(attempt)
+        logger.warning(
+            f"Error processing {key}: {err}. "
+            f"Retrying in {delay:.2f}s (attempt {attempt} of {self._retry.attempts})."
+        )
+        self.queue.add_after(key, item, delay)
+
+    async def drain(self, predicate: Callable[[T], bool]) -> None:
+        """Wait until none of the items being handled matches the given predicate."""
+        async with self._handled:
+            await self._handled.wait_for(
+                lambda: not any(predicate(item) for item in self._handling.values())
+            )
+
+    def start(self) -> None:
+        """Start the workers on the running event loop."""
+        self._tasks = [
+            asyncio.create_task(self._work(self.stats[worker_name]), name=worker_name)
+            for worker_name in self._names
+        ]
+
+    async def stop(self, timeout: None | float = None) -> None:
+        """
+        Drain the queue and wait for the workers to finish.
+
+        Args:
+            timeout: Seconds to wait for the queue to drain, after which the workers are
+                cancelled. Unbounded if None.
+        """
+        self.queue.shut_down()
+        if not self._tasks:
+            return
+        _, pending = await asyncio.wait(self._tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
@@ -46,6 +46,7 @@ def job_object() -> Generator[dict[str, Any], None, None]:
         "kind": "SlurmJob",
         "metadata": {
             "name": "dummy",
+            "uid": "9d4f3a52-8c3b-4b65-9e3c-2d5c1d4a7f10",
             "namespace": "unittests",
             "creation_timestamp": "2023-10-30T12:00:00.000000000Z",
         },
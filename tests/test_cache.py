@@ -0,0 +1,98 @@
+"""This module contains unit tests for the `cache.py` module."""
+from typing import Any
+from unittest import mock
+
+from pykubeslurm.cache import JobStore, ModelCache, object_key, split_key
+from pykubeslurm.schemas import Job, JobState, KubernetesEventType
+
+
+def _slurm_job(name: str, resource_version: str, **status: Any) -> dict[str, Any]:
+    return {
+        "metadata": {"name": name, "resourceVersion": resource_version},
+        "spec": {"script": "#!/bin/bash\necho 'Testing is cool'"},
+        "status": status or None,
+    }
+
+
+def test_job_store__indexes():
+    store = JobStore()
+    store.upsert(_slurm_job("first", "1", state="RUNNING", slurmJobId=1))
+    store.upsert(_slurm_job("second", "2", state="PENDING", slurmJobId=2))
+    store.upsert(_slurm_job("third", "3"))
+
+    assert len(store) == 3
+    assert store.get("second")["status"]["slurmJobId"] == 2
+    assert store.by_slurm_job_id(1)["metadata"]["name"] == "first"
+    assert [obj["metadata"]["name"] for obj in store.by_state(JobState.RUNNING)] == ["first"]
+    assert [obj["metadata"]["name"] for obj in store.by_state(None)] == ["third"]
+
+    store.upsert(_slurm_job("first", "4", state="COMPLETED", slurmJobId=1))
+    assert store.by_state(JobState.RUNNING) == []
+    assert store.by_state(JobState.COMPLETED) == [store.get("first")]
+
+    store.delete(store.get("first"))
+    assert store.get("first") is None
+    assert store.by_slurm_job_id(1) is None
+    assert store.by_state(JobState.COMPLETED) == []
+
+
+def test_job_store__replace_returns_the_changes():
+    store = JobStore()
+    store.upsert(_slurm_job("kept", "1"))
+    store.upsert(_slurm_job("modified", "2"))
+    store.upsert(_slurm_job("deleted", "3"))
+
+    events = store.replace(
+        [_slurm_job("kept", "1"), _slurm_job("modified", "5"), _slurm_job("added", "6")], "6"
+    )
+
+    assert [(event["type"], event["object"]["metadata"]["name"]) for event in events] == [
+        (KubernetesEventType.DELETED, "deleted"),
+        (KubernetesEventType.MODIFIED, "modified"),
+        (KubernetesEventType.ADDED, "added"),
+    ]
+    assert sorted(obj["metadata"]["name"] for obj in store.list()) == ["added", "kept", "modified"]
+    assert store.resource_version == "6"
+
+
+def test_job_store__objects_are_keyed_by_namespace():
+    store = JobStore()
+    first = {"metadata": {"name": "job", "namespace": "first"}, "status": {"state": "RUNNING"}}
+    second = {"metadata": {"name": "job", "namespace": "second"}, "status": {"state": "PENDING"}}
+    store.upsert(first)
+    store.upsert(second)
+
+    assert len(store) == 2
+    assert object_key(first) == "first/job"
+    assert split_key("first/job") == ("first", "job")
+    assert split_key("job") == (None, "job")
+    assert store.get("first/job") is first
+    assert store.by_namespace("second") == [second]
+    assert store.by_state(JobState.RUNNING) == [first]
+
+    store.delete(first)
+    assert store.by_namespace("first") == []
+    assert store.get("second/job") is second
+
+
+def test_model_cache__validates_each_version_once():
+    cache = ModelCache(Job)
+    job = {
+        "apiVersion": "dummy",
+        "kind": "SlurmJob",
+        **_slurm_job("first", "1"),
+        "metadata": {"name": "first", "namespace": "jobs", "resourceVersion": "1"},
+    }
+
+    with mock.patch.object(cache, "_model", wraps=Job) as mocked_model:
+        first = cache.get(job)
+        assert cache.get(job) is first
+        assert mocked_model.call_count == 1
+
+        changed = {**job, "metadata": {**job["metadata"], "resourceVersion": "2"}}
+        assert cache.get(changed) is not first
+        assert mocked_model.call_count == 2
+        assert len(cache) == 1
+
+    cache.forget(changed)
+    assert len(cache) == 0
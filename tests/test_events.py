@@ -4,54 +4,458 @@ This module contains tests for `pykubeslurm/events.py` module.
 The `events.py` module is responsibe for defining how the kubernetes events are
 captured and handled in a high level overview.
 """
-import threading
+import asyncio
+import time
+from collections.abc import AsyncIterator, Callable, Iterator
+from pathlib import Path
 from typing import Any
 from unittest import mock
 
-from kubernetes import client
+import pytest
+from kubernetes.client.exceptions import ApiException
 
-from pykubeslurm.events import event_listener
-from pykubeslurm.schemas import KubernetesEvent, KubernetesEventType
+from pykubeslurm.cache import JobStore, ModelCache
+from pykubeslurm.events import _drain, _relist, _take_over, event_listener, is_noop_event
+from pykubeslurm.helpers import ACTIVE_SELECTOR
+from pykubeslurm.kube_client import AsyncKubernetesClient
+from pykubeslurm.leader import ShardCoordinator, shard_of
+from pykubeslurm.ledger import SubmissionLedger
+from pykubeslurm.schemas import Job, KubernetesEvent, KubernetesEventType
 from pykubeslurm.settings import SETTINGS
+from pykubeslurm.workqueue import WorkQueue
 
 
-@mock.patch("pykubeslurm.events.watch")
+@pytest.fixture(autouse=True)
+def reset_module_state(tmp_path: Path) -> Iterator[None]:
+    """Give every test its own store, model cache and ledger, so no state leaks across tests."""
+    with mock.patch("pykubeslurm.events.job_store", JobStore()), mock.patch(
+        "pykubeslurm.events.job_models", ModelCache(Job)
+    ), mock.patch("pykubeslurm.events.ledger", SubmissionLedger(tmp_path / "ledger.sqlite3")):
+        yield
+
+
+async def _run_event_listener(until: Callable[[], bool]) -> None:
+    """Run the event listener until the given condition is met, then shut it down."""
+    shutdown = asyncio.Event()
+    task = asyncio.create_task(event_listener(shutdown))
+    for _ in range(100):
+        await asyncio.sleep(0.01)
+        if until():
+            break
+    shutdown.set()
+    await asyncio.wait_for(task, 5)
+
+
+def _watch_streams(
+    mocked_client: mock.MagicMock, streams: Callable[..., list[dict[str, Any]]]
+) -> None:
+    """Make the watch of the mocked client yield the events returned by `streams`."""
+
+    async def _watch(path: str, **params: Any) -> AsyncIterator[dict[str, Any]]:
+        for event in streams(path, **params):
+            yield event
+        # the API server holds the stream open
+        await asyncio.Event().wait()
+
+    mocked_client.watch = mock.Mock(side_effect=_watch)
+
+
+def _list_pages(mocked_client: mock.MagicMock) -> None:
+    """Make the mocked client list the objects page by page through its mocked `get_object`."""
+
+    def _pages(path: str, limit: int, **params: Any) -> AsyncIterator[dict[str, Any]]:
+        return AsyncKubernetesClient.list_pages(mocked_client, path, limit, **params)
+
+    mocked_client.list_pages = mock.Mock(side_effect=_pages)
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.events.job_submitter")
+@mock.patch("pykubeslurm.events.job_store", new_callable=JobStore)
+@mock.patch("pykubeslurm.events.async_kubernetes_client")
 @mock.patch("pykubeslurm.events.handle_k8s_event")
-def test_events__test_k8s_event_stream(
-    mocked_handle_k8s_event: mock.MagicMock,
-    mocked_watch: mock.MagicMock,
+async def test_events__test_k8s_event_stream(
+    mocked_handle_k8s_event: mock.AsyncMock,
+    mocked_async_kubernetes_client: mock.MagicMock,
+    mocked_job_store: JobStore,
+    mocked_job_submitter: mock.MagicMock,
     job_object: dict[str, Any],
-    set_event,
     init_logging_in_testing,
 ):
-    dummy_event = threading.Event()
-
+    mocked_job_submitter.stop = mock.AsyncMock()
+    mocked_client = mocked_async_kubernetes_client.return_value
     k8s_event = KubernetesEvent(
-        raw_object={},
+        raw_object=job_object,
         type=KubernetesEventType.ADDED,
         object=job_object,
     )
+    mocked_client.get_object = mock.AsyncMock(
+        return_value={"metadata": {"resourceVersion": "1"}, "items": []}
+    )
+    _list_pages(mocked_client)
+    _watch_streams(mocked_client, lambda path, **params: [{"type": "ADDED", "object": job_object}])
+
+    await _run_event_listener(until=lambda: mocked_handle_k8s_event.await_count > 0)
+
+    path = f"/apis/{SETTINGS.CRD_GROUP}/{SETTINGS.CRD_VERSION}/namespaces/{SETTINGS.NAMESPACE}"
+    mocked_client.get_object.assert_awaited_once_with(
+        f"{path}/{SETTINGS.JOB_CRD_PLURAL}",
+        labelSelector=ACTIVE_SELECTOR,
+        limit=SETTINGS.LIST_PAGE_SIZE,
+    )
+    mocked_client.watch.assert_called_once_with(
+        f"{path}/{SETTINGS.JOB_CRD_PLURAL}",
+        resourceVersion="1",
+        allowWatchBookmarks=True,
+        labelSelector=ACTIVE_SELECTOR,
+    )
+    mocked_handle_k8s_event.assert_awaited_once_with(k8s_event)
+    mocked_job_submitter.start.assert_called_once_with()
+    mocked_job_submitter.stop.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.events.job_submitter")
+@mock.patch("pykubeslurm.events.job_store", new_callable=JobStore)
+@mock.patch("pykubeslurm.events.async_kubernetes_client")
+@mock.patch("pykubeslurm.events.handle_k8s_event")
+async def test_events__resume_watch_and_relist_on_gone(
+    mocked_handle_k8s_event: mock.AsyncMock,
+    mocked_async_kubernetes_client: mock.MagicMock,
+    mocked_job_store: JobStore,
+    mocked_job_submitter: mock.MagicMock,
+    job_object: dict[str, Any],
+    init_logging_in_testing,
+):
+    mocked_job_submitter.stop = mock.AsyncMock()
+    mocked_client = mocked_async_kubernetes_client.return_value
+    job_object["metadata"]["resourceVersion"] = "3"
+    mocked_client.get_object = mock.AsyncMock(
+        side_effect=[
+            {"metadata": {"resourceVersion": "1"}, "items": []},
+            {"metadata": {"resourceVersion": "2"}, "items": []},
+        ]
+    )
+    _list_pages(mocked_client)
+
+    async def _watch(
+        path: str, resourceVersion: str, **params: Any
+    ) -> AsyncIterator[dict[str, Any]]:
+        if resourceVersion == "1":
+            raise ApiException(status=410, reason="Gone")
+        if resourceVersion == "2":
+            yield {"type": "BOOKMARK", "object": {"metadata": {"resourceVersion": "2"}}}
+            yield {"type": "ADDED", "object": job_object}
+            # the API server closes the stream
+            return
+        await asyncio.Event().wait()
+
+    mocked_client.watch = mock.Mock(side_effect=_watch)
+
+    await _run_event_listener(until=lambda: mocked_client.watch.call_count == 3)
+
+    # the watch is resumed from the last event seen, and the objects listed only after the 410
+    assert mocked_client.get_object.await_count == 2
+    assert [
+        call.kwargs["resourceVersion"] for call in mocked_client.watch.call_args_list
+    ] == ["1", "2", "3"]
+    mocked_handle_k8s_event.assert_awaited_once_with(
+        KubernetesEvent(raw_object=job_object, type=KubernetesEventType.ADDED, object=job_object)
+    )
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.events.job_submitter")
+@mock.patch("pykubeslurm.events.job_store", new_callable=JobStore)
+@mock.patch("pykubeslurm.events.async_kubernetes_client")
+@mock.patch("pykubeslurm.events.handle_k8s_event")
+async def test_events__single_cluster_wide_stream_for_many_namespaces(
+    mocked_handle_k8s_event: mock.AsyncMock,
+    mocked_async_kubernetes_client: mock.MagicMock,
+    mocked_job_store: JobStore,
+    mocked_job_submitter: mock.MagicMock,
+    job_object: dict[str, Any],
+    init_logging_in_testing,
+):
+    mocked_job_submitter.stop = mock.AsyncMock()
+    mocked_client = mocked_async_kubernetes_client.return_value
+
+    def _job(namespace: str, resource_version: str) -> dict[str, Any]:
+        metadata = {"namespace": namespace, "resourceVersion": resource_version}
+        return {**job_object, "metadata": {**job_object["metadata"], **metadata}}
+
+    mocked_client.get_object = mock.AsyncMock(
+        return_value={
+            "metadata": {"resourceVersion": "1"},
+            "items": [_job("first", "1"), _job("ignored", "1")],
+        }
+    )
+    _list_pages(mocked_client)
+    _watch_streams(
+        mocked_client,
+        lambda path, **params: [
+            {"type": "ADDED", "object": _job("second", "2")},
+            {"type": "ADDED", "object": _job("ignored", "3")},
+        ],
+    )
+
+    with mock.patch.object(SETTINGS, "WATCH_NAMESPACES", ["first", "second"]):
+        await _run_event_listener(until=lambda: mocked_handle_k8s_event.await_count == 2)
+
+    path = f"/apis/{SETTINGS.CRD_GROUP}/{SETTINGS.CRD_VERSION}/{SETTINGS.JOB_CRD_PLURAL}"
+    mocked_client.get_object.assert_awaited_once_with(
+        path, labelSelector=ACTIVE_SELECTOR, limit=SETTINGS.LIST_PAGE_SIZE
+    )
+    mocked_client.watch.assert_called_once_with(
+        path, resourceVersion="1", allowWatchBookmarks=True, labelSelector=ACTIVE_SELECTOR
+    )
+    # same name, different namespaces: both are kept and handled
+    assert sorted(
+        call.args[0].object["metadata"]["namespace"]
+        for call in mocked_handle_k8s_event.await_args_list
+    ) == ["first", "second"]
+    assert mocked_job_store.by_namespace("ignored") == []
+    assert len(mocked_job_store) == 2
 
-    mocked_watch.Watch = mock.Mock()
-    mocked_watch.Watch.return_value.stream = mock.Mock(return_value=[k8s_event.model_dump(mode="json")])
-    mocked_watch.Watch.return_value.stop = mock.Mock(return_value=None)
 
-    set_dummy_event_thread = threading.Thread(
-        name="ControlThread", target=set_event, args=(dummy_event,)
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.events.job_submitter")
+@mock.patch("pykubeslurm.events.job_store", new_callable=JobStore)
+@mock.patch("pykubeslurm.events.async_kubernetes_client")
+@mock.patch("pykubeslurm.events.handle_k8s_event")
+async def test_events__shutdown_drains_the_received_events(
+    mocked_handle_k8s_event: mock.AsyncMock,
+    mocked_async_kubernetes_client: mock.MagicMock,
+    mocked_job_store: JobStore,
+    mocked_job_submitter: mock.MagicMock,
+    job_object: dict[str, Any],
+    init_logging_in_testing,
+):
+    mocked_job_submitter.stop = mock.AsyncMock()
+    mocked_client = mocked_async_kubernetes_client.return_value
+    resources = [
+        {**job_object, "metadata": {**job_object["metadata"], "name": f"job-{index}"}}
+        for index in range(3)
+    ]
+    mocked_client.get_object = mock.AsyncMock(
+        return_value={"metadata": {"resourceVersion": "1"}, "items": resources}
     )
-    set_dummy_event_thread.start()
+    _list_pages(mocked_client)
+    _watch_streams(mocked_client, lambda path, **params: [])
+    handled: list[str] = []
 
-    event_listener(dummy_event)
+    async def _handle_k8s_event(event: KubernetesEvent) -> None:
+        await asyncio.sleep(0.05)
+        handled.append(event.object["metadata"]["name"])
 
-    set_dummy_event_thread.join()
+    mocked_handle_k8s_event.side_effect = _handle_k8s_event
 
-    mocked_handle_k8s_event.assert_any_call(k8s_event)
-    # mocked_watch.Watch.return_value.stream.assert_any_call(
-    #     client.CustomObjectsApi().list_namespaced_custom_object,
-    #     group=SETTINGS.CRD_GROUP,
-    #     version=SETTINGS.CRD_VERSION,
-    #     namespace=SETTINGS.NAMESPACE,
-    #     plural=SETTINGS.JOB_CRD_PLURAL,
-    # )
-    mocked_watch.Watch.return_value.stop.assert_called_once_with()
-    mocked_watch.Watch.assert_any_call()
+    with mock.patch.object(SETTINGS, "EVENT_WORKERS", 1):
+        # shut down as soon as the objects are listed, before they are handled
+        await _run_event_listener(until=lambda: mocked_client.watch.called)
+
+    assert sorted(handled) == ["job-0", "job-1", "job-2"]
+    mocked_job_submitter.stop.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.events.job_store", new_callable=JobStore)
+async def test_events__take_over_dispatches_the_owned_shards(mocked_job_store: JobStore):
+    coordinator = ShardCoordinator("replica-0", shard_count=2)
+    resources = [{"metadata": {"name": f"job-{index}", "uid": str(index)}} for index in range(10)]
+    for resource in resources:
+        mocked_job_store.upsert(resource)
+    queue: WorkQueue[KubernetesEvent] = WorkQueue(merge=lambda pending, event: event)
+
+    with mock.patch("pykubeslurm.events.coordinator", coordinator):
+        coordinator._owned = {1}
+        coordinator._renewed_at = time.monotonic()
+        _take_over(queue, {1})
+
+    dispatched = []
+    queue.shut_down()
+    while (work := await queue.get()) is not None:
+        dispatched.append(work[0])
+        assert work[1].type == KubernetesEventType.ADDED
+    assert dispatched == [
+        resource["metadata"]["name"] for resource in resources if shard_of(resource, 2) == 1
+    ]
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.events.async_kubernetes_client")
+async def test_events__relist_backfills_the_ledger_at_once(
+    mocked_async_kubernetes_client: mock.MagicMock,
+    job_object: dict[str, Any],
+    init_logging_in_testing,
+):
+    resources = [
+        {
+            **job_object,
+            "metadata": {**job_object["metadata"], "name": f"job-{index}", "uid": str(index)},
+        }
+        for index in range(3)
+    ]
+    resources[0]["status"] = {"state": "RUNNING", "slurmJobId": 7}
+    resources[1]["status"] = {"state": "UNKNOWN"}
+
+    async def _pages(path: str, limit: int, **params: Any) -> AsyncIterator[dict[str, Any]]:
+        yield {"metadata": {"resourceVersion": "1"}, "items": resources}
+
+    mocked_async_kubernetes_client.return_value.list_pages = mock.Mock(side_effect=_pages)
+    queue: WorkQueue[KubernetesEvent] = WorkQueue(merge=lambda pending, event: event)
+
+    with mock.patch("pykubeslurm.events.ledger") as mocked_ledger:
+        assert await _relist(queue) == "1"
+
+    mocked_ledger.backfill.assert_called_once_with([("0", "job-0", 7), ("1", "job-1", None)])
+    mocked_ledger.record.assert_not_called()
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.events.event_workers")
+@mock.patch("pykubeslurm.events.job_submitter")
+async def test_events__drain_waits_for_the_work_on_the_released_shards(
+    mocked_job_submitter: mock.MagicMock,
+    mocked_event_workers: mock.MagicMock,
+    job_object: dict[str, Any],
+):
+    mocked_job_submitter.drain = mock.AsyncMock()
+    mocked_event_workers.drain = mock.AsyncMock()
+    job_schema = Job(**job_object)
+    shard = shard_of(job_object, 2)
+
+    with mock.patch("pykubeslurm.events.coordinator", ShardCoordinator("replica-0", 2)):
+        await _drain({shard})
+
+    (in_events,) = mocked_event_workers.drain.await_args.args
+    (in_submissions,) = mocked_job_submitter.drain.await_args.args
+    event = KubernetesEvent(raw_object={}, type=KubernetesEventType.ADDED, object=job_object)
+    assert in_events(event)
+    assert in_submissions(job_schema)
+    with mock.patch("pykubeslurm.events.coordinator", ShardCoordinator("replica-0", 2)):
+        await _drain({1 - shard})
+    (in_submissions,) = mocked_job_submitter.drain.await_args.args
+    assert not in_submissions(job_schema)
+
+
+def test_is_noop_event__drops_replays_and_status_only_changes(job_object: dict[str, Any]):
+    def _version(resource_version: str, generation: None | int, **changes: Any) -> dict[str, Any]:
+        metadata = {**job_object["metadata"], "resourceVersion": resource_version}
+        if generation is not None:
+            metadata["generation"] = generation
+        return {**job_object, "metadata": metadata, **changes}
+
+    def _event(event_type: KubernetesEventType, obj: dict[str, Any]) -> KubernetesEvent:
+        return KubernetesEvent(raw_object=obj, type=event_type, object=obj)
+
+    previous = _version("1", 1)
+    status_patch = _version("2", 1, status={"state": "RUNNING"})
+    spec_change = _version("3", 2, spec={**job_object["spec"], "time_limit": 60})
+
+    assert not is_noop_event(None, _event(KubernetesEventType.ADDED, previous))
+    assert is_noop_event(previous, _event(KubernetesEventType.ADDED, previous))
+    assert is_noop_event(previous, _event(KubernetesEventType.MODIFIED, status_patch))
+    assert not is_noop_event(previous, _event(KubernetesEventType.MODIFIED, spec_change))
+    assert not is_noop_event(previous, _event(KubernetesEventType.DELETED, previous))
+    # the spec changed while the job was waiting to be submitted with its first version
+    submitted = _version("4", 2, status={"state": "SUBMITTED", "observedGeneration": 1})
+    assert not is_noop_event(spec_change, _event(KubernetesEventType.MODIFIED, submitted))
+    applied = _version("5", 2, status={"state": "SUBMITTED", "observedGeneration": 2})
+    assert is_noop_event(submitted, _event(KubernetesEventType.MODIFIED, applied))
+    # without a generation, the spec itself is compared
+    assert is_noop_event(
+        _version("1", None),
+        _event(KubernetesEventType.MODIFIED, _version("2", None, status={"state": "RUNNING"})),
+    )
+    assert not is_noop_event(
+        _version("1", None),
+        _event(
+            KubernetesEventType.MODIFIED,
+            _version("2", None, spec={**job_object["spec"], "time_limit": 60}),
+        ),
+    )
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.events.job_submitter")
+@mock.patch("pykubeslurm.events.job_store", new_callable=JobStore)
+@mock.patch("pykubeslurm.events.async_kubernetes_client")
+@mock.patch("pykubeslurm.events.handle_k8s_event")
+async def test_events__status_patches_are_not_handled(
+    mocked_handle_k8s_event: mock.AsyncMock,
+    mocked_async_kubernetes_client: mock.MagicMock,
+    mocked_job_store: JobStore,
+    mocked_job_submitter: mock.MagicMock,
+    job_object: dict[str, Any],
+    init_logging_in_testing,
+):
+    mocked_job_submitter.stop = mock.AsyncMock()
+    mocked_client = mocked_async_kubernetes_client.return_value
+    listed = {**job_object, "metadata": {**job_object["metadata"], "resourceVersion": "1"}}
+    listed["metadata"]["generation"] = 1
+    patched = {
+        **listed,
+        "metadata": {**listed["metadata"], "resourceVersion": "2"},
+        "status": {"state": "RUNNING"},
+    }
+    mocked_client.get_object = mock.AsyncMock(
+        return_value={"metadata": {"resourceVersion": "1"}, "items": [listed]}
+    )
+    _list_pages(mocked_client)
+    _watch_streams(mocked_client, lambda path, **params: [{"type": "MODIFIED", "object": patched}])
+
+    await _run_event_listener(
+        until=lambda: (mocked_job_store.get("unittests/dummy") or {}).get("status") is not None
+    )
+
+    # only the listed object is handled, but the store still follows the status
+    mocked_handle_k8s_event.assert_awaited_once()
+    assert mocked_handle_k8s_event.await_args.args[0].type == KubernetesEventType.ADDED
+    assert mocked_job_store.get("unittests/dummy")["status"] == {"state": "RUNNING"}
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.events.ledger")
+@mock.patch("pykubeslurm.events.job_submitter")
+@mock.patch("pykubeslurm.events.job_store", new_callable=JobStore)
+@mock.patch("pykubeslurm.events.async_kubernetes_client")
+@mock.patch("pykubeslurm.events.handle_k8s_event")
+async def test_events__lists_page_by_page_and_forgets_finished_jobs(
+    mocked_handle_k8s_event: mock.AsyncMock,
+    mocked_async_kubernetes_client: mock.MagicMock,
+    mocked_job_store: JobStore,
+    mocked_job_submitter: mock.MagicMock,
+    mocked_ledger: mock.MagicMock,
+    job_object: dict[str, Any],
+    init_logging_in_testing,
+):
+    mocked_job_submitter.stop = mock.AsyncMock()
+    mocked_client = mocked_async_kubernetes_client.return_value
+    resources = [
+        {**job_object, "metadata": {**job_object["metadata"], "name": f"job-{index}"}}
+        for index in range(2)
+    ]
+    mocked_client.get_object = mock.AsyncMock(
+        side_effect=[
+            {"metadata": {"resourceVersion": "1", "continue": "next"}, "items": resources[:1]},
+            {"metadata": {"resourceVersion": "1"}, "items": resources[1:]},
+        ]
+    )
+    _list_pages(mocked_client)
+    finished = {
+        **resources[0],
+        "metadata": {**resources[0]["metadata"], "labels": {"pykubeslurm/active": "false"}},
+    }
+    _watch_streams(mocked_client, lambda path, **params: [{"type": "DELETED", "object": finished}])
+
+    await _run_event_listener(until=lambda: len(mocked_job_store) == 1)
+
+    assert mocked_client.get_object.await_args_list[1].kwargs["continue"] == "next"
+    # both listed jobs are handled, but the one labeled as finished afterwards isn't deleted
+    assert mocked_handle_k8s_event.await_count == 2
+    assert all(
+        call.args[0].type == KubernetesEventType.ADDED
+        for call in mocked_handle_k8s_event.await_args_list
+    )
+    mocked_ledger.forget.assert_called_once_with([job_object["metadata"]["uid"]])
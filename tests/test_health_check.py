@@ -12,7 +12,9 @@ from unittest import mock
 import pytest
 from aiohttp.test_utils import TestClient
 
-from pykubeslurm.health_check import health_check, init_health_check, main
+# registers the gauges of the SlurmJobs and of the work queues, as the operator does
+import pykubeslurm.events  # noqa: F401
+from pykubeslurm.health_check import health_check, main, metrics
 from pykubeslurm.settings import SETTINGS
 
 
@@ -24,6 +26,18 @@ async def test_health_check_ok(health_check_server: TestClient):
     assert text == "OK"
 
 
+@pytest.mark.asyncio
+async def test_metrics__exposes_the_registry():
+    resp = await metrics(mock.Mock())
+
+    assert resp.status == 200
+    assert resp.content_type == "text/plain"
+    assert resp.charset == "utf-8"
+    assert b"# TYPE pykubeslurm_jobs gauge" in resp.body
+    assert b"# TYPE pykubeslurm_queue_depth gauge" in resp.body
+    assert b"# TYPE pykubeslurm_slurmrestd_retries_total counter" in resp.body
+
+
 @pytest.mark.asyncio
 @mock.patch("pykubeslurm.health_check.web.TCPSite")
 @mock.patch("pykubeslurm.health_check.web.Application")
@@ -37,10 +51,11 @@ async def test_health_check_server__test_main_logic(
     mocked_app_runner.return_value.setup = mock.AsyncMock(return_value=None)
     mocked_tcp_site.return_value.start = mock.AsyncMock(return_value=None)
 
-    await main()
+    runner = await main()
 
-    mocked_web_application.return_value.router.add_get.assert_called_once_with(
-        "/health", health_check
+    assert runner is mocked_app_runner.return_value
+    mocked_web_application.return_value.router.add_get.assert_has_calls(
+        [mock.call("/health", health_check), mock.call("/metrics", metrics)]
     )
     mocked_web_application.assert_called_once_with()
     mocked_app_runner.assert_called_once_with(mocked_web_application.return_value)
@@ -51,21 +66,3 @@ async def test_health_check_server__test_main_logic(
         SETTINGS.HEALTH_CHECK_ADDRESS,
         SETTINGS.HEALTH_CHECK_PORT,
     )
-
-
-@mock.patch("pykubeslurm.health_check.asyncio")
-def test_health_check_server__test_init_health_check_logic(
-    mocked_asyncio: mock.MagicMock,
-):
-    mocked_main = mock.MagicMock(return_value=None)
-    mocked_asyncio.new_event_loop.return_value.create_task = mock.MagicMock(return_value=None)
-    mocked_asyncio.new_event_loop.return_value.run_forever = mock.MagicMock(return_value=None)
-    with mock.patch("pykubeslurm.health_check.main", mocked_main):
-        init_health_check()
-
-    mocked_main.assert_called_once_with()
-    mocked_asyncio.new_event_loop.assert_called_once_with()
-    mocked_asyncio.new_event_loop.return_value.create_task.assert_called_once_with(
-        mocked_main.return_value
-    )
-    mocked_asyncio.new_event_loop.return_value.run_forever.assert_called_once_with()
@@ -1,45 +1,621 @@
 """This module contains unit tests for the helpers.py module."""
+import json
 from typing import Any
 from unittest import mock
 
-from pykubeslurm.helpers import handle_k8s_event
-from pykubeslurm.schemas import Job, KubernetesEvent, KubernetesEventType
+import httpx
+import pytest
 
+from pykubeslurm.helpers import (
+    SPEC_HASH_LENGTH,
+    _add_slurm_job,
+    _record_unconfirmed_submission,
+    _slurm_user,
+    _submit_slurm_job,
+    _update_job_crd,
+    _update_slurm_job,
+    handle_k8s_event,
+    mark_finished,
+    spec_hash,
+)
+from pykubeslurm.schemas import Job, JobState, KubernetesEvent, KubernetesEventType
+from pykubeslurm.settings import SETTINGS
 
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.helpers.ledger")
 @mock.patch("pykubeslurm.helpers._add_slurm_job")
-def test_handle_k8s_event_added(mock_add_slurm_job: mock.Mock, job_object: dict[str, Any]):
+async def test_handle_k8s_event_added(
+    mock_add_slurm_job: mock.Mock, mocked_ledger: mock.MagicMock, job_object: dict[str, Any]
+):
+    mocked_ledger.__contains__.return_value = False
     event = KubernetesEvent(
         raw_object={},
         type=KubernetesEventType.ADDED,
         object=job_object,
     )
 
-    handle_k8s_event(event)
+    await handle_k8s_event(event)
+
+    mock_add_slurm_job.assert_awaited_once_with(Job(**event.object))
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.helpers.job_models")
+@mock.patch("pykubeslurm.helpers.ledger")
+@mock.patch("pykubeslurm.helpers._add_slurm_job")
+async def test_handle_k8s_event_added__skips_validation_of_submitted_jobs(
+    mock_add_slurm_job: mock.Mock,
+    mocked_ledger: mock.MagicMock,
+    mocked_job_models: mock.MagicMock,
+    job_object: dict[str, Any],
+):
+    mocked_ledger.__contains__.return_value = True
+    job_object["status"] = {"state": "SUBMITTED", "slurmJobId": 7}
+    event = KubernetesEvent(raw_object={}, type=KubernetesEventType.ADDED, object=job_object)
+
+    await handle_k8s_event(event)
+
+    mocked_job_models.get.assert_not_called()
+    mock_add_slurm_job.assert_not_called()
 
-    mock_add_slurm_job.assert_called_once_with(Job(**event.object))
 
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.helpers._update_job_crd")
+@mock.patch("pykubeslurm.helpers.ledger")
+@mock.patch("pykubeslurm.helpers._add_slurm_job")
+async def test_handle_k8s_event_added__restores_the_status_of_submitted_jobs(
+    mock_add_slurm_job: mock.Mock,
+    mocked_ledger: mock.MagicMock,
+    mocked_update_job_crd: mock.Mock,
+    job_object: dict[str, Any],
+    init_logging_in_testing,
+):
+    # submitted, but writing the status failed
+    mocked_ledger.__contains__.return_value = True
+    mocked_ledger.slurm_job_id.return_value = 7
+    mocked_ledger.applied_spec.return_value = {"time_limit": 60}
+    event = KubernetesEvent(raw_object={}, type=KubernetesEventType.ADDED, object=job_object)
+
+    await handle_k8s_event(event)
+
+    mock_add_slurm_job.assert_not_called()
+    mocked_update_job_crd.assert_called_once_with(
+        state=JobState.SUBMITTED,
+        errors=None,
+        name="dummy",
+        namespace="unittests",
+        slurm_job_id=7,
+        applied_spec={"time_limit": 60},
+    )
 
+
+@pytest.mark.asyncio
 @mock.patch("pykubeslurm.helpers._update_slurm_job")
-def test_handle_k8s_event_modified(mock_update_slurm_job: mock.Mock, job_object: dict[str, Any]):
+async def test_handle_k8s_event_modified(
+    mock_update_slurm_job: mock.Mock, job_object: dict[str, Any]
+):
     event = KubernetesEvent(
         raw_object={},
         type=KubernetesEventType.MODIFIED,
         object=job_object,
     )
 
-    handle_k8s_event(event)
+    await handle_k8s_event(event)
 
-    mock_update_slurm_job.assert_called_once_with(Job(**event.object))
+    mock_update_slurm_job.assert_awaited_once_with(Job(**event.object))
 
 
+@pytest.mark.asyncio
 @mock.patch("pykubeslurm.helpers._delete_slurm_job")
-def test_handle_k8s_event_deleted(mock_delete_slurm_job: mock.Mock, job_object: dict[str, Any]):
+async def test_handle_k8s_event_deleted(
+    mock_delete_slurm_job: mock.Mock, job_object: dict[str, Any]
+):
     event = KubernetesEvent(
         raw_object={},
         type=KubernetesEventType.DELETED,
         object=job_object,
     )
 
-    handle_k8s_event(event)
+    await handle_k8s_event(event)
+
+    mock_delete_slurm_job.assert_awaited_once_with(Job(**event.object))
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.helpers.job_submitter")
+@mock.patch("pykubeslurm.helpers.ledger")
+async def test_add_slurm_job__queues_new_jobs(
+    mocked_ledger: mock.MagicMock,
+    mocked_job_submitter: mock.MagicMock,
+    job_object: dict[str, Any],
+    init_logging_in_testing,
+):
+    mocked_ledger.__contains__.return_value = False
+    job = Job(**job_object)
+
+    await _add_slurm_job(job)
+
+    mocked_job_submitter.add.assert_called_once_with(job)
+    mocked_ledger.record.assert_not_called()
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.helpers._update_job_crd")
+@mock.patch("pykubeslurm.helpers.ledger")
+async def test_submit_slurm_job__records_the_submission(
+    mocked_ledger: mock.MagicMock,
+    mocked_update_job_crd: mock.Mock,
+    job_object: dict[str, Any],
+    init_logging_in_testing,
+):
+    slurmrestd_client = mock.Mock()
+    slurmrestd_client.post = mock.AsyncMock()
+    slurmrestd_client.post.return_value.json = mock.Mock(return_value={"errors": [], "job_id": 7})
+    slurmrestd_client.post.return_value.is_server_error = False
+    job = Job(**job_object)
+
+    await _submit_slurm_job(slurmrestd_client, job)
+
+    slurmrestd_client.post.assert_awaited_once()
+    applied_spec = job.job_properties(exclude={"get_user_environment"})
+    mocked_ledger.record.assert_called_once_with(
+        job.metadata.uid, "dummy", 7, spec=applied_spec
+    )
+    mocked_update_job_crd.assert_called_once_with(
+        state=JobState.SUBMITTED,
+        errors=None,
+        name="dummy",
+        namespace="unittests",
+        slurm_job_id=7,
+        applied_spec=applied_spec,
+        generation=job.metadata.generation,
+    )
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.helpers._update_job_crd")
+@mock.patch("pykubeslurm.helpers.ledger")
+async def test_submit_slurm_job__unconfirmed_submissions_are_not_sent_again(
+    mocked_ledger: mock.MagicMock,
+    mocked_update_job_crd: mock.Mock,
+    job_object: dict[str, Any],
+    init_logging_in_testing,
+):
+    slurmrestd_client = mock.Mock()
+    slurmrestd_client.post = mock.AsyncMock(return_value=httpx.Response(503))
+    job = Job(**job_object)
+
+    # returns instead of raising, so the submitter doesn't submit the job again
+    await _submit_slurm_job(slurmrestd_client, job)
+
+    mocked_ledger.record.assert_called_once_with(job.metadata.uid, "dummy", None)
+    mocked_update_job_crd.assert_called_once_with(
+        state=JobState.UNKNOWN,
+        errors=["Slurmrestd couldn't confirm the submission of the job (5xx)"],
+        name="dummy",
+        namespace="unittests",
+    )
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.helpers._update_job_crd")
+@mock.patch("pykubeslurm.helpers.ledger")
+async def test_submit_slurm_job__slurm_errors_reject_the_job(
+    mocked_ledger: mock.MagicMock,
+    mocked_update_job_crd: mock.Mock,
+    job_object: dict[str, Any],
+    init_logging_in_testing,
+):
+    slurmrestd_client = mock.Mock()
+    slurmrestd_client.post = mock.AsyncMock(
+        return_value=httpx.Response(
+            500, json={"errors": [{"error_number": 2015, "error": "Invalid partition name"}]}
+        )
+    )
+    job = Job(**job_object)
+
+    with mock.patch("pykubeslurm.helpers.mark_finished") as mocked_mark_finished:
+        await _submit_slurm_job(slurmrestd_client, job)
+
+    applied_spec = job.job_properties(exclude={"get_user_environment"})
+    mocked_ledger.record.assert_called_once_with(
+        job.metadata.uid, "dummy", None, spec=applied_spec
+    )
+    mocked_update_job_crd.assert_called_once_with(
+        state=JobState.REJECTED,
+        errors=["Invalid partition name"],
+        name="dummy",
+        namespace="unittests",
+        slurm_job_id=None,
+        applied_spec=applied_spec,
+        generation=job.metadata.generation,
+    )
+    mocked_mark_finished.assert_awaited_once_with("dummy", "unittests")
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.helpers._update_job_crd")
+@mock.patch("pykubeslurm.helpers.ledger")
+async def test_record_unconfirmed_submission__after_a_timeout(
+    mocked_ledger: mock.MagicMock,
+    mocked_update_job_crd: mock.Mock,
+    job_object: dict[str, Any],
+    init_logging_in_testing,
+):
+    mocked_ledger.__contains__.return_value = False
+    slurmrestd_client = mock.Mock()
+    slurmrestd_client.post = mock.AsyncMock(side_effect=httpx.ReadTimeout("timed out"))
+    job = Job(**job_object)
+
+    # raised to the submitter, which hands the job back to `_record_unconfirmed_submission`
+    with pytest.raises(httpx.ReadTimeout):
+        await _submit_slurm_job(slurmrestd_client, job)
+    await _record_unconfirmed_submission(job, "ReadTimeout")
+
+    mocked_ledger.record.assert_called_once_with(job.metadata.uid, "dummy", None)
+    mocked_update_job_crd.assert_called_once_with(
+        state=JobState.UNKNOWN,
+        errors=["Slurmrestd couldn't confirm the submission of the job (ReadTimeout)"],
+        name="dummy",
+        namespace="unittests",
+    )
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.helpers._update_job_crd")
+@mock.patch("pykubeslurm.helpers.ledger")
+async def test_record_unconfirmed_submission__keeps_recorded_submissions(
+    mocked_ledger: mock.MagicMock,
+    mocked_update_job_crd: mock.Mock,
+    job_object: dict[str, Any],
+    init_logging_in_testing,
+):
+    # e.g. the status of an accepted job couldn't be written
+    mocked_ledger.__contains__.return_value = True
+
+    await _record_unconfirmed_submission(Job(**job_object), "ApiException")
+
+    mocked_ledger.record.assert_not_called()
+    mocked_update_job_crd.assert_not_called()
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.helpers.job_submitter")
+@mock.patch("pykubeslurm.helpers.ledger")
+async def test_add_slurm_job__skips_recorded_jobs(
+    mocked_ledger: mock.MagicMock,
+    mocked_job_submitter: mock.MagicMock,
+    job_object: dict[str, Any],
+    init_logging_in_testing,
+):
+    mocked_ledger.__contains__.return_value = True
+
+    await _add_slurm_job(Job(**job_object))
+
+    mocked_job_submitter.add.assert_not_called()
+    mocked_ledger.record.assert_not_called()
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.helpers.job_submitter")
+@mock.patch("pykubeslurm.helpers.ledger")
+async def test_add_slurm_job__backfills_jobs_with_a_status(
+    mocked_ledger: mock.MagicMock,
+    mocked_job_submitter: mock.MagicMock,
+    job_object: dict[str, Any],
+    init_logging_in_testing,
+):
+    mocked_ledger.__contains__.return_value = False
+    job = Job(**job_object, status={"state": "RUNNING", "slurmJobId": 3})
+
+    await _add_slurm_job(job)
+
+    mocked_job_submitter.add.assert_not_called()
+    mocked_ledger.record.assert_called_once_with(job.metadata.uid, "dummy", 3)
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.helpers._update_job_crd")
+@mock.patch("pykubeslurm.helpers.ledger")
+@mock.patch("pykubeslurm.helpers.async_backend_client")
+async def test_update_slurm_job__sends_the_spec_changes(
+    mocked_async_backend_client: mock.MagicMock,
+    mocked_ledger: mock.MagicMock,
+    mocked_update_job_crd: mock.Mock,
+    job_object: dict[str, Any],
+    init_logging_in_testing,
+):
+    slurmrestd_client = mocked_async_backend_client.return_value
+    slurmrestd_client.post = mock.AsyncMock()
+    slurmrestd_client.post.return_value.json = mock.Mock(return_value={"errors": []})
+    applied_spec = Job(**job_object).job_properties(exclude={"get_user_environment"})
+    mocked_ledger.applied_spec.return_value = applied_spec
+    job_object["metadata"]["generation"] = 2
+    job_object["spec"]["time_limit"] = 3600
+    job = Job(
+        **job_object,
+        status={
+            "state": "PENDING",
+            "slurmJobId": 3,
+            "specHash": spec_hash(applied_spec),
+            "observedGeneration": 1,
+        },
+    )
+
+    await _update_slurm_job(job)
 
-    mock_delete_slurm_job.assert_called_once_with(Job(**event.object))
+    slurmrestd_client.post.assert_awaited_once()
+    assert slurmrestd_client.post.await_args.args == ("/slurm/v0.0.36/job/3",)
+    assert slurmrestd_client.post.await_args.kwargs["json"] == {"time_limit": 3600}
+    desired_spec = job.job_properties(exclude={"get_user_environment"})
+    mocked_ledger.record_spec.assert_called_once_with(job.metadata.uid, desired_spec)
+    mocked_update_job_crd.assert_called_once_with(
+        name="dummy",
+        namespace="unittests",
+        slurm_job_id=3,
+        errors=None,
+        applied_spec=desired_spec,
+        generation=2,
+    )
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.helpers._update_job_crd")
+@mock.patch("pykubeslurm.helpers.ledger")
+@mock.patch("pykubeslurm.helpers.async_backend_client")
+async def test_update_slurm_job__updates_jobs_submitted_before_the_spec_hash(
+    mocked_async_backend_client: mock.MagicMock,
+    mocked_ledger: mock.MagicMock,
+    mocked_update_job_crd: mock.Mock,
+    job_object: dict[str, Any],
+    init_logging_in_testing,
+):
+    slurmrestd_client = mocked_async_backend_client.return_value
+    slurmrestd_client.post = mock.AsyncMock()
+    slurmrestd_client.post.return_value.json = mock.Mock(return_value={"errors": []})
+    # ledger row migrated from a version that didn't keep the applied specs
+    mocked_ledger.applied_spec.return_value = None
+    last_applied_spec = json.dumps(job_object["spec"])
+    job_object["metadata"]["generation"] = 2
+    job_object["spec"]["time_limit"] = 3600
+    job = Job(
+        **job_object,
+        status={"state": "PENDING", "slurmJobId": 3, "lastAppliedSpec": last_applied_spec},
+    )
+
+    await _update_slurm_job(job)
+
+    assert slurmrestd_client.post.await_args.kwargs["json"] == {"time_limit": 3600}
+    assert mocked_update_job_crd.call_args.kwargs["applied_spec"] == job.job_properties(
+        exclude={"get_user_environment"}
+    )
+
+    # without any change, nothing is sent
+    slurmrestd_client.post.reset_mock()
+    status = {"state": "PENDING", "lastAppliedSpec": json.dumps(job_object["spec"])}
+    unchanged = Job(**{**job_object, "status": status})
+    await _update_slurm_job(unchanged)
+    slurmrestd_client.post.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.helpers.ledger")
+@mock.patch("pykubeslurm.helpers.async_backend_client")
+async def test_update_slurm_job__waits_for_the_submission(
+    mocked_async_backend_client: mock.MagicMock,
+    mocked_ledger: mock.MagicMock,
+    job_object: dict[str, Any],
+    init_logging_in_testing,
+):
+    job_object["metadata"]["generation"] = 2
+
+    await _update_slurm_job(Job(**job_object))
+
+    mocked_ledger.applied_spec.assert_not_called()
+    mocked_async_backend_client.assert_not_called()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("generation, observed_generation", [(1, 1), (2, 1)])
+@mock.patch("pykubeslurm.helpers.ledger")
+@mock.patch("pykubeslurm.helpers.async_backend_client")
+async def test_update_slurm_job__skips_unchanged_specs(
+    mocked_async_backend_client: mock.MagicMock,
+    mocked_ledger: mock.MagicMock,
+    generation: int,
+    observed_generation: int,
+    job_object: dict[str, Any],
+    init_logging_in_testing,
+):
+    applied_spec = Job(**job_object).job_properties(exclude={"get_user_environment"})
+    job_object["metadata"]["generation"] = generation
+    job = Job(
+        **job_object,
+        status={
+            "state": "PENDING",
+            "slurmJobId": 3,
+            "specHash": spec_hash(applied_spec),
+            "observedGeneration": observed_generation,
+        },
+    )
+
+    await _update_slurm_job(job)
+
+    mocked_ledger.applied_spec.assert_not_called()
+    mocked_async_backend_client.assert_not_called()
+
+
+@mock.patch("pykubeslurm.helpers.datetime_in_string", return_value="2023-11-01T00:00:00Z")
+@mock.patch("pykubeslurm.helpers.custom_objects_api")
+def test_update_job_crd__sends_a_single_status_merge_patch(
+    mocked_custom_objects_api: mock.MagicMock, mocked_datetime_in_string: mock.Mock
+):
+    api = mocked_custom_objects_api.return_value
+
+    _update_job_crd(
+        state=JobState.SUBMITTED,
+        errors=None,
+        name="dummy",
+        namespace="unittests",
+        slurm_job_id=7,
+        applied_spec={"time_limit": 60},
+        generation=1,
+    )
+    _update_job_crd(errors=None, name="dummy", namespace="unittests")
+
+    api.get_namespaced_custom_object.assert_not_called()
+    bodies = [call.kwargs["body"] for call in api.patch_namespaced_custom_object_status.mock_calls]
+    assert bodies == [
+        {
+            "status": {
+                "errors": None,
+                "updatedAt": "2023-11-01T00:00:00Z",
+                "slurmJobId": 7,
+                "state": "SUBMITTED",
+                "specHash": spec_hash({"time_limit": 60}),
+                "observedGeneration": 1,
+            }
+        },
+        # the fields left out are kept as they are
+        {"status": {"errors": None, "updatedAt": "2023-11-01T00:00:00Z"}},
+    ]
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.helpers.custom_objects_api")
+async def test_mark_finished__labels_the_job(mocked_custom_objects_api: mock.MagicMock):
+    await mark_finished("dummy", "unittests")
+
+    mocked_custom_objects_api.return_value.patch_namespaced_custom_object.assert_called_once_with(
+        group=SETTINGS.CRD_GROUP,
+        version=SETTINGS.CRD_VERSION,
+        namespace="unittests",
+        plural=SETTINGS.JOB_CRD_PLURAL,
+        name="dummy",
+        body={"metadata": {"labels": {"pykubeslurm/active": "false"}}},
+    )
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.helpers._add_slurm_job")
+@mock.patch("pykubeslurm.helpers.mark_finished")
+async def test_handle_k8s_event__labels_finished_jobs_only_once(
+    mocked_mark_finished: mock.AsyncMock,
+    mock_add_slurm_job: mock.Mock,
+    job_object: dict[str, Any],
+):
+    job_object["status"] = {"state": "COMPLETED"}
+    event = KubernetesEvent(raw_object={}, type=KubernetesEventType.ADDED, object=job_object)
+
+    await handle_k8s_event(event)
+    job_object["metadata"]["labels"] = {"pykubeslurm/active": "false"}
+    with mock.patch("pykubeslurm.helpers.ledger") as mocked_ledger:
+        mocked_ledger.__contains__.return_value = True
+        await handle_k8s_event(event)
+
+    mocked_mark_finished.assert_awaited_once_with("dummy", "unittests")
+    mock_add_slurm_job.assert_not_called()
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.helpers.coordinator")
+@mock.patch("pykubeslurm.helpers._add_slurm_job")
+async def test_handle_k8s_event__skips_jobs_no_longer_owned(
+    mock_add_slurm_job: mock.Mock, mocked_coordinator: mock.MagicMock, job_object: dict[str, Any]
+):
+    mocked_coordinator.owns.return_value = False
+    event = KubernetesEvent(raw_object={}, type=KubernetesEventType.ADDED, object=job_object)
+
+    await handle_k8s_event(event)
+
+    mock_add_slurm_job.assert_not_called()
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.helpers.coordinator")
+async def test_submit_slurm_job__skips_jobs_no_longer_owned(
+    mocked_coordinator: mock.MagicMock, job_object: dict[str, Any], init_logging_in_testing
+):
+    mocked_coordinator.owns.return_value = False
+    slurmrestd_client = mock.Mock()
+    slurmrestd_client.post = mock.AsyncMock()
+
+    await _submit_slurm_job(slurmrestd_client, Job(**job_object))
+
+    slurmrestd_client.post.assert_not_awaited()
+
+
+def test_spec_hash__is_canonical():
+    assert spec_hash({"a": 1, "b": [1, 2]}) == spec_hash({"b": [1, 2], "a": 1})
+    assert spec_hash({"a": 1}) != spec_hash({"a": 2})
+    assert len(spec_hash({"a": 1})) == SPEC_HASH_LENGTH
+
+
+@mock.patch.object(SETTINGS, "SLURM_ALLOWED_USERS", {"unittests": ["alice"]})
+def test_slurm_user__from_annotation(job_object: dict[str, Any]):
+    job_object["metadata"]["annotations"] = {"pykubeslurm/slurm-user": "alice"}
+    job = Job(**job_object)
+
+    assert _slurm_user(job) == SETTINGS.SLURMRESTD_USER_TOKEN
+    with mock.patch.object(SETTINGS, "SLURM_USER_ANNOTATION", "pykubeslurm/slurm-user"):
+        assert _slurm_user(job) == "alice"
+        assert _slurm_user(Job(**{**job_object, "metadata": {"name": "x", "namespace": "y"}})) == (
+            SETTINGS.SLURMRESTD_USER_TOKEN
+        )
+
+
+@pytest.mark.parametrize(
+    "user, allowed_users",
+    [
+        ("bob", {"unittests": ["alice"]}),
+        ("alice", {"other": ["alice"]}),
+        ("root", {"unittests": ["root"], "*": ["root"]}),
+    ],
+)
+@mock.patch.object(SETTINGS, "SLURM_USER_ANNOTATION", "pykubeslurm/slurm-user")
+def test_slurm_user__rejects_users_not_allowed(
+    user: str, allowed_users: dict[str, list[str]], job_object: dict[str, Any]
+):
+    job_object["metadata"]["annotations"] = {"pykubeslurm/slurm-user": user}
+
+    with mock.patch.object(SETTINGS, "SLURM_ALLOWED_USERS", allowed_users):
+        with pytest.raises(ValueError, match=f"Slurm user {user} isn't allowed"):
+            _slurm_user(Job(**job_object))
+
+
+@mock.patch.object(SETTINGS, "SLURM_USER_ANNOTATION", "pykubeslurm/slurm-user")
+@mock.patch.object(SETTINGS, "SLURM_ALLOWED_USERS", {"*": ["alice"]})
+def test_slurm_user__allowed_in_every_namespace(job_object: dict[str, Any]):
+    job_object["metadata"]["annotations"] = {"pykubeslurm/slurm-user": "alice"}
+
+    assert _slurm_user(Job(**job_object)) == "alice"
+
+
+@pytest.mark.asyncio
+@mock.patch.object(SETTINGS, "SLURM_USER_ANNOTATION", "pykubeslurm/slurm-user")
+@mock.patch("pykubeslurm.helpers.mark_finished")
+@mock.patch("pykubeslurm.helpers._update_job_crd")
+@mock.patch("pykubeslurm.helpers.ledger")
+async def test_submit_slurm_job__rejects_users_not_allowed(
+    mocked_ledger: mock.MagicMock,
+    mocked_update_job_crd: mock.Mock,
+    mocked_mark_finished: mock.AsyncMock,
+    job_object: dict[str, Any],
+    init_logging_in_testing,
+):
+    job_object["metadata"]["annotations"] = {"pykubeslurm/slurm-user": "root"}
+    slurmrestd_client = mock.Mock()
+    slurmrestd_client.post = mock.AsyncMock()
+
+    await _submit_slurm_job(slurmrestd_client, Job(**job_object))
+
+    slurmrestd_client.post.assert_not_awaited()
+    mocked_ledger.record.assert_not_called()
+    mocked_update_job_crd.assert_called_once_with(
+        state=JobState.REJECTED,
+        errors=["Slurm user root isn't allowed in namespace unittests"],
+        name="dummy",
+        namespace="unittests",
+    )
+    mocked_mark_finished.assert_awaited_once_with("dummy", "unittests")
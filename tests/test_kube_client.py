@@ -0,0 +1,139 @@
+"""This module contains unit tests for the `kube_client.py` module."""
+import json
+import socket
+from typing import Any
+from unittest import mock
+
+import httpx
+import pytest
+from kubernetes import client
+from kubernetes.client.exceptions import ApiException
+
+from pykubeslurm.kube_client import AsyncKubernetesClient, api_client
+from pykubeslurm.runtime import thread_pool_size
+
+
+def _kubernetes_client(handler: Any) -> AsyncKubernetesClient:
+    configuration = client.Configuration(host="https://kubernetes.default")
+    configuration.api_key = {"authorization": "Bearer dummy-token"}
+    kubernetes_client = AsyncKubernetesClient(configuration)
+    kubernetes_client._transport = httpx.MockTransport(handler)
+    return kubernetes_client
+
+
+@pytest.mark.asyncio
+async def test_get_object__sends_the_token():
+    requests: list[httpx.Request] = []
+
+    def _handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, json={"metadata": {"resourceVersion": "1"}, "items": []})
+
+    async with _kubernetes_client(_handler) as kubernetes_client:
+        resources = await kubernetes_client.get_object("/apis/dummy/v1/slurmjobs")
+
+    assert resources == {"metadata": {"resourceVersion": "1"}, "items": []}
+    assert requests[0].url == "https://kubernetes.default/apis/dummy/v1/slurmjobs"
+    assert requests[0].headers["Authorization"] == "Bearer dummy-token"
+
+
+@pytest.mark.asyncio
+async def test_get_object__raises_api_exceptions():
+    def _handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(403, json={"kind": "Status", "code": 403})
+
+    async with _kubernetes_client(_handler) as kubernetes_client:
+        with pytest.raises(ApiException) as err:
+            await kubernetes_client.get_object("/apis/dummy/v1/slurmjobs")
+
+    assert err.value.status == 403
+
+
+@pytest.mark.asyncio
+async def test_list_pages__follows_the_continue_token():
+    pages = {
+        None: {"metadata": {"resourceVersion": "1", "continue": "next"}, "items": [{"a": 1}]},
+        "next": {"metadata": {"resourceVersion": "1"}, "items": [{"b": 2}]},
+    }
+    requests: list[httpx.Request] = []
+
+    def _handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, json=pages[request.url.params.get("continue")])
+
+    async with _kubernetes_client(_handler) as kubernetes_client:
+        received = [
+            page
+            async for page in kubernetes_client.list_pages(
+                "/apis/dummy/v1/slurmjobs", limit=1, labelSelector="active!=false"
+            )
+        ]
+
+    assert received == [pages[None], pages["next"]]
+    assert [dict(request.url.params) for request in requests] == [
+        {"labelSelector": "active!=false", "limit": "1"},
+        {"labelSelector": "active!=false", "limit": "1", "continue": "next"},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_watch__yields_the_events_until_the_stream_ends():
+    events = [
+        {"type": "ADDED", "object": {"metadata": {"name": "dummy", "resourceVersion": "2"}}},
+        {"type": "BOOKMARK", "object": {"metadata": {"resourceVersion": "3"}}},
+    ]
+    requests: list[httpx.Request] = []
+
+    def _handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, content="\n".join(json.dumps(event) for event in events) + "\n")
+
+    async with _kubernetes_client(_handler) as kubernetes_client:
+        received = [
+            event
+            async for event in kubernetes_client.watch(
+                "/apis/dummy/v1/slurmjobs", resourceVersion="1", allowWatchBookmarks=True
+            )
+        ]
+
+    assert received == events
+    assert dict(requests[0].url.params) == {
+        "resourceVersion": "1",
+        "allowWatchBookmarks": "true",
+        "watch": "true",
+    }
+
+
+@pytest.mark.asyncio
+async def test_watch__raises_expired_resource_versions():
+    error = {"type": "ERROR", "object": {"kind": "Status", "code": 410, "message": "too old"}}
+
+    def _handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, content=json.dumps(error) + "\n")
+
+    async with _kubernetes_client(_handler) as kubernetes_client:
+        with pytest.raises(ApiException) as err:
+            async for _ in kubernetes_client.watch("/apis/dummy/v1/slurmjobs"):
+                pass
+
+    assert err.value.status == 410
+
+
+@mock.patch("pykubeslurm.kube_client.kubernetes_rate_limiter")
+def test_api_client__pooled_compressed_and_throttled(mocked_rate_limiter: mock.Mock):
+    mocked_rate_limiter.reserve.return_value = 0
+    api_client.cache_clear()
+    try:
+        api = api_client()
+        assert api is api_client()
+        pool_kw = api.rest_client.pool_manager.connection_pool_kw
+        assert pool_kw["maxsize"] == thread_pool_size()
+        assert (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1) in pool_kw["socket_options"]
+        assert api.default_headers["Accept-Encoding"] == "gzip"
+
+        with mock.patch.object(client.ApiClient, "request") as mocked_request:
+            api.request("GET", "https://kubernetes.default/version")
+        mocked_rate_limiter.reserve.assert_called_once_with()
+        mocked_request.assert_called_once_with("GET", "https://kubernetes.default/version")
+    finally:
+        api_client.cache_clear()
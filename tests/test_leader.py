@@ -0,0 +1,187 @@
+import copy
+from datetime import datetime, timedelta, timezone
+from http import HTTPStatus
+from typing import Any
+from unittest import mock
+
+from kubernetes import client
+from kubernetes.client.exceptions import ApiException
+
+from pykubeslurm.leader import ShardCoordinator, shard_of
+from pykubeslurm.settings import SETTINGS
+
+NOW = datetime(2023, 11, 1, tzinfo=timezone.utc)
+
+
+class FakeLeaseApi:
+    """In-memory stand-in of `CoordinationV1Api`, checking resource versions like the API server."""
+
+    def __init__(self) -> None:
+        self.leases: dict[str, client.V1Lease] = {}
+        self._version = 0
+
+    def _store(self, lease: client.V1Lease) -> None:
+        self._version += 1
+        lease = copy.deepcopy(lease)
+        lease.metadata.resource_version = str(self._version)
+        self.leases[lease.metadata.name] = lease
+
+    def read_namespaced_lease(
+        self, name: str, namespace: str, **kwargs: Any
+    ) -> client.V1Lease:
+        if name not in self.leases:
+            raise ApiException(status=HTTPStatus.NOT_FOUND)
+        return copy.deepcopy(self.leases[name])
+
+    def create_namespaced_lease(
+        self, namespace: str, body: client.V1Lease, **kwargs: Any
+    ) -> None:
+        if body.metadata.name in self.leases:
+            raise ApiException(status=HTTPStatus.CONFLICT)
+        self._store(body)
+
+    def replace_namespaced_lease(
+        self, name: str, namespace: str, body: client.V1Lease, **kwargs: Any
+    ) -> None:
+        if self.leases[name].metadata.resource_version != body.metadata.resource_version:
+            raise ApiException(status=HTTPStatus.CONFLICT)
+        self._store(body)
+
+    def delete_namespaced_lease(self, name: str, namespace: str, **kwargs: Any) -> None:
+        del self.leases[name]
+
+    def list_namespaced_lease(
+        self, namespace: str, label_selector: str, **kwargs: Any
+    ) -> client.V1LeaseList:
+        key, value = label_selector.split("=")
+        return client.V1LeaseList(
+            items=[
+                copy.deepcopy(lease)
+                for lease in self.leases.values()
+                if (lease.metadata.labels or {}).get(key) == value
+            ]
+        )
+
+
+def _resource(uid: str) -> dict:
+    return {"metadata": {"name": f"job-{uid}", "uid": uid}}
+
+
+def test_shard_of__is_stable_and_spread():
+    shards = [shard_of(_resource(str(index)), 4) for index in range(1000)]
+
+    assert shards == [shard_of(_resource(str(index)), 4) for index in range(1000)]
+    assert all(shards.count(shard) > 150 for shard in range(4))
+
+
+def test_coordinator__disabled_owns_everything():
+    coordinator = ShardCoordinator("replica-0", shard_count=4, enabled=False)
+
+    assert coordinator.owns(_resource("dummy"))
+    assert coordinator.owned_shards == {0, 1, 2, 3}
+
+
+def test_coordinator__single_leader_and_failover():
+    api = FakeLeaseApi()
+    first = ShardCoordinator("replica-0")
+    second = ShardCoordinator("replica-1")
+
+    first.run_round(api, NOW)  # type: ignore
+    second.run_round(api, NOW)  # type: ignore
+
+    assert first.owns(_resource("dummy"))
+    assert not second.owns(_resource("dummy"))
+    assert api.leases[SETTINGS.LEASE_NAME].spec.holder_identity == "replica-0"
+
+    # the leader stops renewing: its lease is taken over once expired
+    second.run_round(api, NOW + timedelta(seconds=SETTINGS.LEASE_DURATION - 1))  # type: ignore
+    assert not second.owns(_resource("dummy"))
+    second.run_round(api, NOW + timedelta(seconds=SETTINGS.LEASE_DURATION + 1))  # type: ignore
+    assert second.owns(_resource("dummy"))
+    assert api.leases[SETTINGS.LEASE_NAME].spec.lease_transitions == 1
+
+    first.run_round(api, NOW + timedelta(seconds=SETTINGS.LEASE_DURATION + 2))  # type: ignore
+    assert not first.owns(_resource("dummy"))
+
+
+def test_coordinator__release_hands_over_right_away():
+    api = FakeLeaseApi()
+    first = ShardCoordinator("replica-0")
+    second = ShardCoordinator("replica-1")
+    first.run_round(api, NOW)  # type: ignore
+
+    first.stop_holding(api)  # type: ignore
+    second.run_round(api, NOW + timedelta(seconds=1))  # type: ignore
+
+    assert not first.owns(_resource("dummy"))
+    assert second.owns(_resource("dummy"))
+
+
+def test_coordinator__shards_are_balanced_across_replicas():
+    api = FakeLeaseApi()
+    first = ShardCoordinator("replica-0", shard_count=4)
+    second = ShardCoordinator("replica-1", shard_count=4)
+    taken_over: list[set[int]] = []
+    second.add_listener(taken_over.append)
+
+    first.run_round(api, NOW)  # type: ignore
+    assert first.owned_shards == {0, 1, 2, 3}
+
+    # the newcomer registers, then the first replica releases the shards beyond its fair share
+    second.run_round(api, NOW)  # type: ignore
+    assert second.owned_shards == set()
+    first.run_round(api, NOW + timedelta(seconds=1))  # type: ignore
+    second.run_round(api, NOW + timedelta(seconds=1))  # type: ignore
+
+    assert first.owned_shards == {0, 1}
+    assert second.owned_shards == {2, 3}
+    assert taken_over == [{2, 3}]
+    resources = [_resource(str(index)) for index in range(100)]
+    assert all(first.owns(resource) != second.owns(resource) for resource in resources)
+
+
+def test_coordinator__drains_shards_before_releasing_them():
+    api = FakeLeaseApi()
+    first = ShardCoordinator("replica-0", shard_count=4)
+    second = ShardCoordinator("replica-1", shard_count=4)
+    drained: list[tuple[set[int], set[int], list[str]]] = []
+
+    def _drain(shards: set[int], timeout: float) -> None:
+        # the shards are no longer handled, but still held while their work is finished
+        holders = [api.leases[first._lease_name(shard)].spec.holder_identity for shard in shards]
+        drained.append((shards, first.owned_shards, holders))
+
+    first.add_drainer(_drain)
+    first.run_round(api, NOW)  # type: ignore
+    second.run_round(api, NOW)  # type: ignore
+    first.run_round(api, NOW + timedelta(seconds=1))  # type: ignore
+
+    assert drained == [({2, 3}, {0, 1}, ["replica-0", "replica-0"])]
+    assert not api.leases[first._lease_name(2)].spec.holder_identity
+
+
+@mock.patch("pykubeslurm.leader.client")
+def test_coordinator__run_drops_shards_when_renewal_fails(mocked_client: mock.MagicMock):
+    coordinator = ShardCoordinator("replica-0")
+    thread_event = mock.Mock()
+    thread_event.is_set.side_effect = [False, True]
+
+    with mock.patch.object(coordinator, "run_round", side_effect=ApiException(status=500)):
+        coordinator._owned = {0}
+        coordinator.run(thread_event)
+
+    assert coordinator.owned_shards == set()
+
+
+def test_coordinator__ownership_lapses_without_renewal():
+    api = FakeLeaseApi()
+    coordinator = ShardCoordinator("replica-0")
+
+    with mock.patch("pykubeslurm.leader.time.monotonic", return_value=100.0) as mocked_now:
+        coordinator.run_round(api, NOW)  # type: ignore
+        assert coordinator.owns(_resource("dummy"))
+
+        # the renewals stall: the shard is given up before another replica can take it over
+        mocked_now.return_value = 100.0 + SETTINGS.LEASE_DURATION
+        assert coordinator.owned_shards == {0}
+        assert not coordinator.owns(_resource("dummy"))
@@ -0,0 +1,71 @@
+"""This module contains unit tests for the `ledger.py` module."""
+import sqlite3
+from pathlib import Path
+
+from pykubeslurm.ledger import SubmissionLedger
+
+
+def test_submission_ledger__survives_restarts(tmp_path: Path, init_logging_in_testing):
+    path = tmp_path / "cache" / "ledger.sqlite3"
+
+    ledger = SubmissionLedger(path)
+    assert "first-uid" not in ledger
+    ledger.record("first-uid", "first", 1)
+    ledger.record("second-uid", "second", None)
+    assert "first-uid" in ledger
+
+    reopened_ledger = SubmissionLedger(path)
+    assert "first-uid" in reopened_ledger
+    assert "second-uid" in reopened_ledger
+    assert reopened_ledger.slurm_job_id("first-uid") == 1
+    assert reopened_ledger.slurm_job_id("second-uid") is None
+
+
+def test_submission_ledger__forget_and_prune(tmp_path: Path, init_logging_in_testing):
+    ledger = SubmissionLedger(tmp_path / "ledger.sqlite3")
+    ledger.record("first-uid", "first", 1)
+    ledger.record("second-uid", "second", 2)
+    ledger.record("third-uid", "third", 3)
+
+    ledger.forget(["first-uid"])
+    ledger.prune(["second-uid"])
+
+    assert "first-uid" not in ledger
+    assert "second-uid" in ledger
+    assert "third-uid" not in SubmissionLedger(tmp_path / "ledger.sqlite3")
+
+
+def test_submission_ledger__applied_specs(tmp_path: Path, init_logging_in_testing):
+    path = tmp_path / "ledger.sqlite3"
+    sqlite3.connect(path).execute(
+        "CREATE TABLE submissions (uid TEXT PRIMARY KEY, name TEXT NOT NULL, "
+        "slurm_job_id INTEGER, recorded_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+    ).connection.commit()
+
+    # ledgers written before the applied specs were kept are migrated
+    ledger = SubmissionLedger(path)
+    ledger.record("first-uid", "first", 1, spec={"time_limit": 60})
+    ledger.record("second-uid", "second", 2)
+    assert ledger.applied_spec("first-uid") == {"time_limit": 60}
+    assert ledger.applied_spec("second-uid") is None
+    assert ledger.applied_spec("unknown-uid") is None
+
+    ledger.record_spec("second-uid", {"time_limit": 120})
+    assert SubmissionLedger(path).applied_spec("second-uid") == {"time_limit": 120}
+
+
+def test_submission_ledger__backfill(tmp_path: Path, init_logging_in_testing):
+    path = tmp_path / "ledger.sqlite3"
+    ledger = SubmissionLedger(path)
+    ledger.record("first-uid", "first", 1, spec={"time_limit": 60})
+
+    ledger.backfill(
+        [("first-uid", "first", 10), ("second-uid", "second", 2), ("third-uid", "third", None)]
+    )
+
+    reopened_ledger = SubmissionLedger(path)
+    assert all(uid in reopened_ledger for uid in ["first-uid", "second-uid", "third-uid"])
+    # the submissions already recorded are left untouched
+    assert reopened_ledger.slurm_job_id("first-uid") == 1
+    assert reopened_ledger.applied_spec("first-uid") == {"time_limit": 60}
+    assert reopened_ledger.slurm_job_id("second-uid") == 2
@@ -0,0 +1,47 @@
+"""This module contains unit tests for the `metrics.py` module."""
+import pytest
+from kubernetes.client.exceptions import ApiException
+from prometheus_client import REGISTRY, CollectorRegistry, generate_latest
+
+from pykubeslurm.metrics import GaugeCollector, time_kubernetes_call
+
+
+def _kubernetes_calls(status: str) -> float:
+    name = "pykubeslurm_kubernetes_request_duration_seconds_count"
+    return REGISTRY.get_sample_value(name, {"operation": "dummy", "status": status}) or 0
+
+
+def test_gauge_collector__computes_the_values_on_scrape(init_logging_in_testing):
+    registry = CollectorRegistry()
+    states = {"RUNNING": 7}
+
+    def _failing_values():
+        raise RuntimeError("dummy")
+
+    def _job_counts():
+        return [([state], count) for state, count in states.items()]
+
+    registry.register(GaugeCollector("dummy_jobs", "Dummy gauge.", ["state"], _job_counts))
+    registry.register(GaugeCollector("dummy_failing", "Dummy gauge.", [], _failing_values))
+    assert registry.get_sample_value("dummy_jobs", {"state": "RUNNING"}) == 7
+
+    states = {"PENDING": 2}
+    exposition = generate_latest(registry).decode()
+
+    assert 'dummy_jobs{state="PENDING"} 2.0' in exposition
+    assert "RUNNING" not in exposition
+    # a failing collector doesn't prevent the others from being scraped
+    assert "# TYPE dummy_failing gauge" in exposition
+
+
+def test_time_kubernetes_call__labels_the_outcome():
+    before = _kubernetes_calls("404")
+
+    with pytest.raises(ApiException):
+        with time_kubernetes_call("dummy"):
+            raise ApiException(status=404)
+    with time_kubernetes_call("dummy"):
+        pass
+
+    assert _kubernetes_calls("404") == before + 1
+    assert _kubernetes_calls("success") >= 1
@@ -0,0 +1,73 @@
+from unittest import mock
+
+from pykubeslurm.planner import PollPlanner, poll_interval
+from pykubeslurm.schemas import JobState
+from pykubeslurm.settings import SETTINGS
+
+
+def test_poll_interval__fresh_submissions_are_polled_every_tick():
+    assert poll_interval(JobState.SUBMITTED, 0) == SETTINGS.RECONCILIATION_TICK
+    assert poll_interval(JobState.RUNNING, 0) == SETTINGS.RECONCILIATION_TIME
+
+
+def test_poll_interval__backs_off_with_time_in_state():
+    with mock.patch.object(SETTINGS, "RECONCILIATION_TIME", 60), mock.patch.object(
+        SETTINGS, "RECONCILIATION_MAX_INTERVAL", 900
+    ):
+        assert poll_interval(JobState.PENDING, 300) == 60
+        assert poll_interval(JobState.PENDING, 3600) == 360
+        assert poll_interval(JobState.PENDING, 86400) == 900
+
+
+def test_poll_interval__speeds_up_near_the_next_transition():
+    with mock.patch.object(SETTINGS, "RECONCILIATION_TICK", 5), mock.patch.object(
+        SETTINGS, "RECONCILIATION_MAX_INTERVAL", 900
+    ):
+        assert poll_interval(JobState.RUNNING, 86400, until_next_transition=120) == 60
+        assert poll_interval(JobState.RUNNING, 86400, until_next_transition=4) == 5
+        # an overdue transition doesn't speed polling up
+        assert poll_interval(JobState.RUNNING, 86400, until_next_transition=-10) == 900
+
+
+def test_poll_planner__pop_due_respects_order_and_limit():
+    planner = PollPlanner()
+    planner.schedule("late", 30)
+    planner.schedule("early", 10)
+    planner.schedule("middle", 20)
+    planner.schedule("future", 100)
+
+    assert planner.pop_due(2, now=50) == ["early", "middle"]
+    assert planner.pop_due(2, now=50) == ["late"]
+    assert planner.pop_due(2, now=50) == []
+    assert "future" in planner
+    assert "late" not in planner
+
+
+def test_poll_planner__skips_stale_entries():
+    planner = PollPlanner()
+    planner.schedule("rescheduled", 10)
+    planner.schedule("rescheduled", 60)
+    planner.schedule("forgotten", 10)
+    planner.forget("forgotten")
+
+    assert planner.pop_due(10, now=50) == []
+    assert planner.pop_due(10, now=60) == ["rescheduled"]
+
+
+def test_poll_planner__observe_tracks_time_in_state():
+    planner = PollPlanner()
+
+    with mock.patch.object(SETTINGS, "RECONCILIATION_TIME", 60), mock.patch.object(
+        SETTINGS, "RECONCILIATION_MAX_INTERVAL", 900
+    ):
+        planner.observe("job", JobState.PENDING, now=0)
+        assert planner.pop_due(1, now=59) == []
+        assert planner.pop_due(1, now=60) == ["job"]
+
+        planner.observe("job", JobState.PENDING, now=3600)
+        assert planner.pop_due(1, now=3600 + 359) == []
+        assert planner.pop_due(1, now=3600 + 360) == ["job"]
+
+        # a state change resets the backoff
+        planner.observe("job", JobState.RUNNING, now=4000)
+        assert planner.pop_due(1, now=4060) == ["job"]
@@ -0,0 +1,102 @@
+"""This module contains unit tests for the `resilience.py` module."""
+import asyncio
+from unittest import mock
+
+import httpx
+import pytest
+
+from pykubeslurm.resilience import CircuitBreaker, RetryPolicy
+from pykubeslurm.slurmrestd_interface import AsyncBackendClient
+
+FAST_RETRY_POLICY = RetryPolicy(attempts=3, base_delay=0.001, max_delay=0.001)
+
+
+def test_retry_policy__exponential_backoff_with_jitter():
+    policy = RetryPolicy(attempts=3, base_delay=1, max_delay=3)
+
+    with mock.patch("pykubeslurm.resilience.random.uniform", side_effect=lambda a, b: b):
+        assert [policy.backoff(attempt) for attempt in range(1, 5)] == [1, 2, 3, 3]
+    assert 0 <= policy.backoff(2) <= 2
+    assert policy.should_retry(3)
+    assert not policy.should_retry(4)
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker__holds_requests_back_until_a_probe_succeeds(
+    init_logging_in_testing,
+):
+    breaker = CircuitBreaker(threshold=2, reset_timeout=0.2)
+    breaker.record(success=False)
+    await asyncio.wait_for(breaker.wait(), timeout=1)
+    breaker.record(success=False)
+    assert breaker.is_open
+
+    # the first request after the reset timeout is the probe, the others keep waiting
+    waiters = [asyncio.create_task(breaker.wait()) for _ in range(3)]
+    done, pending = await asyncio.wait(waiters, timeout=1, return_when=asyncio.FIRST_COMPLETED)
+    assert len(done) == 1
+    await asyncio.sleep(0.01)
+    assert all(not waiter.done() for waiter in pending)
+
+    breaker.record(success=True)
+    await asyncio.wait_for(asyncio.gather(*pending), timeout=1)
+    assert not breaker.is_open
+    assert breaker.failures == 0
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker__failed_probe_opens_the_circuit_again(init_logging_in_testing):
+    breaker = CircuitBreaker(threshold=1, reset_timeout=0.05)
+    breaker.record(success=False)
+    await asyncio.wait_for(breaker.wait(), timeout=1)
+
+    breaker.record(success=False)
+
+    assert breaker.is_open
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(breaker.wait(), timeout=0.02)
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.slurmrestd_interface.retry_policy", FAST_RETRY_POLICY)
+@mock.patch("pykubeslurm.slurmrestd_interface.token_cache")
+async def test_async_backend_client__retries_idempotent_requests(
+    mocked_token_cache: mock.Mock, init_logging_in_testing
+):
+    mocked_token_cache.async_get = mock.AsyncMock(return_value="dummy-token")
+    responses = iter([httpx.Response(503), httpx.Response(503), httpx.Response(200, json={})])
+    sent = []
+
+    def _handler(request: httpx.Request) -> httpx.Response:
+        sent.append(request.method)
+        return next(responses)
+
+    slurmrestd_client = AsyncBackendClient()
+    slurmrestd_client._transport = httpx.MockTransport(_handler)
+
+    response = await slurmrestd_client.get("/slurm/v0.0.36/jobs")
+    await slurmrestd_client.aclose()
+
+    assert response.status_code == 200
+    assert sent == ["GET", "GET", "GET"]
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.slurmrestd_interface.retry_policy", FAST_RETRY_POLICY)
+@mock.patch("pykubeslurm.slurmrestd_interface.token_cache")
+async def test_async_backend_client__retries_other_requests_only_if_never_sent(
+    mocked_token_cache: mock.Mock, init_logging_in_testing
+):
+    mocked_token_cache.async_get = mock.AsyncMock(return_value="dummy-token")
+    errors = iter([httpx.ConnectError("refused"), httpx.ReadTimeout("timed out")])
+
+    def _handler(request: httpx.Request) -> httpx.Response:
+        raise next(errors)
+
+    slurmrestd_client = AsyncBackendClient()
+    slurmrestd_client._transport = httpx.MockTransport(_handler)
+
+    # refused first, so sent again; the timeout may have reached Slurm, so it is raised
+    with pytest.raises(httpx.ReadTimeout):
+        await slurmrestd_client.post("/slurm/v0.0.36/job/submit", json={})
+    await slurmrestd_client.aclose()
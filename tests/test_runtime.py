@@ -0,0 +1,54 @@
+"""This module contains unit tests for the `runtime.py` module."""
+import asyncio
+
+import pytest
+
+from pykubeslurm.runtime import Runtime
+
+
+def test_runtime__serves_on_the_calling_thread():
+    runtime = Runtime()
+    cleaned_up: list[str] = []
+
+    async def _clean_up() -> None:
+        asyncio.get_running_loop()
+        cleaned_up.append("client")
+
+    async def _failing_clean_up() -> None:
+        raise RuntimeError("dummy")
+
+    async def _main() -> tuple[asyncio.AbstractEventLoop, asyncio.AbstractEventLoop]:
+        runtime.add_cleanup(_clean_up)
+        runtime.add_cleanup(_failing_clean_up)
+        # other threads hand their work to the serving loop
+        shared_loop = await asyncio.to_thread(lambda: runtime.loop)
+        return asyncio.get_running_loop(), shared_loop
+
+    serving_loop, shared_loop = runtime.serve(_main())
+
+    assert serving_loop is shared_loop
+    assert serving_loop.is_closed()
+    assert cleaned_up == ["client"]
+
+
+def test_runtime__serves_again_once_stopped():
+    runtime = Runtime()
+
+    assert runtime.serve(asyncio.sleep(0, result="first")) == "first"
+    assert runtime.serve(asyncio.sleep(0, result="second")) == "second"
+    with pytest.raises(RuntimeError):
+        runtime.loop
+
+
+def test_runtime__serves_once_at_a_time():
+    runtime = Runtime()
+
+    async def _serve_again() -> None:
+        coro = asyncio.sleep(0)
+        try:
+            runtime.serve(coro)
+        finally:
+            coro.close()
+
+    with pytest.raises(RuntimeError):
+        runtime.serve(_serve_again())
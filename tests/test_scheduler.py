@@ -1,20 +1,442 @@
+import asyncio
+import time
 from unittest import mock
 
-from pykubeslurm.scheduler import init_scheduler, reconcile
+import httpx
+import pytest
+
+from pykubeslurm.cache import JobStore
+from pykubeslurm.helpers import run_coroutines
+from pykubeslurm.planner import PollPlanner
+from pykubeslurm.scheduler import (
+    UPDATE_TIME_MARGIN,
+    JobListing,
+    _lookup_error,
+    fetch_jobs_state,
+    plan_next_poll,
+    process_job_crd,
+    reconcile,
+    reconcile_jobs,
+    reconciler,
+)
+from pykubeslurm.schemas import JobState, JobStatus
 from pykubeslurm.settings import SETTINGS
 
+LISTING_EXTENSIONS = {"latency_target": None}
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.scheduler.reconcile")
+async def test_reconciler__runs_every_tick_until_shutdown(
+    mocked_reconcile: mock.AsyncMock, init_logging_in_testing
+):
+    shutdown = asyncio.Event()
+    mocked_reconcile.side_effect = [RuntimeError("dummy"), None, None]
+
+    with mock.patch.object(SETTINGS, "RECONCILIATION_TICK", 0.01):
+        task = asyncio.create_task(reconciler(shutdown))
+        while mocked_reconcile.await_count < 3:
+            await asyncio.sleep(0.01)
+        shutdown.set()
+        await asyncio.wait_for(task, 1)
+
+    # a failing run doesn't stop the next ones
+    assert mocked_reconcile.await_count == 3
+
+
+def _slurmrestd_response(payload: dict) -> mock.Mock:
+    response = mock.Mock()
+    response.json.return_value = payload
+    return response
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.scheduler.job_listing", new_callable=JobListing)
+async def test_fetch_jobs_state__single_listing_request(
+    mocked_job_listing: JobListing, init_logging_in_testing
+):
+    slurmrestd_client = mock.Mock()
+    slurmrestd_client.get = mock.AsyncMock(
+        return_value=_slurmrestd_response(
+            {
+                "errors": [],
+                "jobs": [
+                    {
+                        "job_id": 1,
+                        "job_state": "RUNNING",
+                        "state_reason": "None",
+                        "end_time": 1700003600,
+                    },
+                    {
+                        "job_id": 2,
+                        "job_state": "PENDING",
+                        "state_reason": "BeginTime",
+                        "start_time": 0,
+                        "eligible_time": 1700000000,
+                    },
+                    {"job_id": 3, "job_state": "RUNNING", "state_reason": "None"},
+                ],
+            }
+        )
+    )
+
+    jobs_state = await fetch_jobs_state(slurmrestd_client, {1, 2})
+
+    assert jobs_state == {
+        1: {"state": "RUNNING", "reason": "None", "errors": [], "next_transition_at": 1700003600},
+        2: {
+            "state": "PENDING",
+            "reason": "BeginTime",
+            "errors": [],
+            "next_transition_at": 1700000000,
+        },
+    }
+    slurmrestd_client.get.assert_awaited_once_with(
+        "/slurm/v0.0.36/jobs", params={}, extensions=LISTING_EXTENSIONS
+    )
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.scheduler.job_listing", new_callable=JobListing)
+async def test_fetch_jobs_state__purged_jobs_fallback_to_slurmdbd(
+    mocked_job_listing: JobListing, init_logging_in_testing
+):
+    slurmrestd_client = mock.Mock()
+    slurmrestd_client.get = mock.AsyncMock(
+        side_effect=[
+            _slurmrestd_response(
+                {
+                    "errors": [],
+                    "jobs": [{"job_id": 1, "job_state": "RUNNING", "state_reason": "None"}],
+                }
+            ),
+            _slurmrestd_response(
+                {"errors": [], "jobs": [{"state": {"current": "COMPLETED", "reason": "None"}}]}
+            ),
+        ]
+    )
+
+    jobs_state = await fetch_jobs_state(slurmrestd_client, {1, 2})
+
+    assert jobs_state == {
+        1: {"state": "RUNNING", "reason": "None", "errors": [], "next_transition_at": None},
+        2: {"state": "COMPLETED", "reason": "None", "errors": [], "next_transition_at": None},
+    }
+    slurmrestd_client.get.assert_has_awaits(
+        [
+            mock.call("/slurm/v0.0.36/jobs", params={}, extensions=LISTING_EXTENSIONS),
+            mock.call("/slurmdb/v0.0.36/job/2"),
+        ]
+    )
+
 
-@mock.patch("pykubeslurm.scheduler.BackgroundScheduler")
-def test_init_scheduler(mocked_background_scheduler: mock.MagicMock):
-    mocked_background_scheduler.return_value.add_job = mock.Mock()
-    mocked_background_scheduler.return_value.start = mock.Mock()
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.scheduler.job_listing", new_callable=JobListing)
+async def test_fetch_jobs_state__failed_lookups_only_concern_their_job(
+    mocked_job_listing: JobListing, init_logging_in_testing
+):
+    responses = {
+        "/slurm/v0.0.36/jobs": _slurmrestd_response({"errors": [], "jobs": []}),
+        "/slurmdb/v0.0.36/job/1": _slurmrestd_response(
+            {"errors": [], "jobs": [{"state": {"current": "COMPLETED", "reason": "None"}}]}
+        ),
+        "/slurmdb/v0.0.36/job/2": httpx.ReadTimeout("timed out"),
+        "/slurmdb/v0.0.36/job/3": _slurmrestd_response({"errors": [], "jobs": []}),
+    }
 
-    init_scheduler()
+    async def _get(url: str, **kwargs) -> mock.Mock:
+        if isinstance(responses[url], Exception):
+            raise responses[url]
+        return responses[url]
 
-    mocked_background_scheduler.return_value.add_job.assert_called_once_with(
-        func=reconcile,
-        trigger="interval",
-        seconds=SETTINGS.RECONCILIATION_TIME,
-        id="reconcile_jobs",
+    slurmrestd_client = mock.Mock()
+    slurmrestd_client.get = _get
+
+    jobs_state = await fetch_jobs_state(slurmrestd_client, {1, 2, 3})
+
+    assert jobs_state is not None
+    assert jobs_state[1]["state"] == "COMPLETED"
+    assert jobs_state[2]["state"] is None
+    assert "ReadTimeout" in jobs_state[2]["errors"][0]["error"]
+    assert jobs_state[3]["errors"][0]["error_number"] == 9003
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.scheduler.patch_object_status")
+async def test_process_job_crd__failed_lookups_make_the_job_unknown(
+    mocked_patch_object_status: mock.AsyncMock, init_logging_in_testing
+):
+    job_status = JobStatus(state=JobState.RUNNING, slurmJobId=2)
+    slurm_job = _lookup_error("Couldn't look up the job on slurmdbd: ReadTimeout('timed out')")
+
+    await process_job_crd(job_status, "unittests/dummy", slurm_job)
+
+    status = mocked_patch_object_status.await_args.args[1]["status"]
+    assert status["state"] == JobState.UNKNOWN.value
+    assert status["errors"] == ["Couldn't look up the job on slurmdbd: ReadTimeout('timed out')"]
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.scheduler.job_listing", new_callable=JobListing)
+async def test_fetch_jobs_state__listing_error(
+    mocked_job_listing: JobListing, init_logging_in_testing
+):
+    slurmrestd_client = mock.Mock()
+    slurmrestd_client.get = mock.AsyncMock(
+        return_value=_slurmrestd_response(
+            {
+                "errors": [{"error_number": 5005, "error": "Zero Bytes were transmitted"}],
+                "jobs": [],
+            }
+        )
+    )
+
+    assert await fetch_jobs_state(slurmrestd_client, {1}) is None
+    slurmrestd_client.get.assert_awaited_once_with(
+        "/slurm/v0.0.36/jobs", params={}, extensions=LISTING_EXTENSIONS
     )
-    mocked_background_scheduler.return_value.start.assert_called_once_with()
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.scheduler.job_listing", new_callable=JobListing)
+async def test_fetch_jobs_state__lists_again_only_what_changed(
+    mocked_job_listing: JobListing, init_logging_in_testing
+):
+    listing = {
+        "errors": [],
+        "jobs": [{"job_id": 1, "job_state": "RUNNING", "state_reason": "None"}],
+    }
+    slurmrestd_client = mock.Mock()
+    slurmrestd_client.get = mock.AsyncMock(
+        side_effect=[
+            _slurmrestd_response(listing),
+            # nothing changed since the first listing
+            _slurmrestd_response({"errors": [], "jobs": []}),
+        ]
+    )
+
+    with mock.patch("pykubeslurm.scheduler.time.time", return_value=1700000000.0):
+        first = await fetch_jobs_state(slurmrestd_client, {1})
+        second = await fetch_jobs_state(slurmrestd_client, {1})
+
+    assert first == second
+    assert slurmrestd_client.get.await_args_list[1] == mock.call(
+        "/slurm/v0.0.36/jobs",
+        params={"update_time": 1700000000 - UPDATE_TIME_MARGIN},
+        extensions=LISTING_EXTENSIONS,
+    )
+
+
+@pytest.mark.parametrize(
+    "slurm_state, state, planned",
+    [
+        ("TIMEOUT", "FAILED", False),
+        ("NODE_FAIL", "FAILED", False),
+        ("PREEMPTED", "FAILED", False),
+        ("COMPLETING", "RUNNING", True),
+        ("BOGUS", "UNKNOWN", True),
+    ],
+)
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.scheduler.mark_finished")
+@mock.patch("pykubeslurm.scheduler.patch_object_status")
+@mock.patch("pykubeslurm.scheduler.poll_planner", new_callable=PollPlanner)
+async def test_reconcile__maps_every_slurm_state(
+    mocked_poll_planner: PollPlanner,
+    mocked_patch_object_status: mock.AsyncMock,
+    mocked_mark_finished: mock.AsyncMock,
+    slurm_state: str,
+    state: str,
+    planned: bool,
+    init_logging_in_testing,
+):
+    slurm_job = {"state": slurm_state, "reason": "None", "errors": [], "next_transition_at": None}
+    mocked_poll_planner.schedule("jobs/dummy", 0)
+
+    plan_next_poll("jobs/dummy", slurm_job)  # type: ignore
+    await process_job_crd(JobStatus(slurmJobId=1, state="SUBMITTED"), "jobs/dummy", slurm_job)
+
+    # finished jobs are forgotten, the others polled again later, never right away
+    assert ("jobs/dummy" in mocked_poll_planner) == planned
+    assert mocked_poll_planner.pop_due(10) == []
+    status = mocked_patch_object_status.await_args.args[1]["status"]
+    assert status["state"] == state
+    # the Slurm state stays in sight
+    assert status["reason"] == slurm_state
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.scheduler.reconcile_jobs")
+@mock.patch("pykubeslurm.scheduler.poll_planner", new_callable=PollPlanner)
+@mock.patch("pykubeslurm.scheduler.job_store", new_callable=JobStore)
+async def test_reconcile__polls_due_jobs_within_budget(
+    mocked_job_store: JobStore,
+    mocked_poll_planner: PollPlanner,
+    mocked_reconcile_jobs: mock.AsyncMock,
+    init_logging_in_testing,
+):
+    for index in range(3):
+        mocked_job_store.upsert(
+            {
+                "metadata": {"name": f"job-{index}"},
+                "status": {"slurmJobId": index, "state": "RUNNING"},
+            }
+        )
+    mocked_job_store.upsert(
+        {"metadata": {"name": "done"}, "status": {"slurmJobId": 9, "state": "COMPLETED"}}
+    )
+
+    async def _reconcile_jobs(active_jobs: dict[str, JobStatus], **kwargs) -> None:
+        for name in active_jobs:
+            mocked_poll_planner.observe(name, JobState.RUNNING)
+
+    mocked_reconcile_jobs.side_effect = _reconcile_jobs
+
+    with mock.patch.object(SETTINGS, "RECONCILIATION_BUDGET", 2):
+        await reconcile()
+        await reconcile()
+
+    first_run, second_run = (call.args[0] for call in mocked_reconcile_jobs.call_args_list)
+    assert len(first_run) == 2
+    assert len(second_run) == 1
+    assert set(first_run) | set(second_run) == {"job-0", "job-1", "job-2"}
+
+    # nothing is due until the polled jobs are observed and rescheduled
+    await reconcile()
+    assert mocked_reconcile_jobs.call_count == 2
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.scheduler.job_store")
+@mock.patch("pykubeslurm.scheduler.async_backend_client")
+@mock.patch("pykubeslurm.scheduler.process_job_crd")
+@mock.patch("pykubeslurm.scheduler.fetch_jobs_state")
+@mock.patch("pykubeslurm.scheduler.poll_planner", new_callable=PollPlanner)
+async def test_reconcile_jobs__defers_what_overruns_the_slice(
+    mocked_poll_planner: PollPlanner,
+    mocked_fetch_jobs_state: mock.AsyncMock,
+    mocked_process_job_crd: mock.AsyncMock,
+    mocked_async_backend_client: mock.MagicMock,
+    mocked_job_store: mock.MagicMock,
+    init_logging_in_testing,
+):
+    mocked_job_store.get.side_effect = lambda key: {"metadata": {"name": key}}
+    mocked_fetch_jobs_state.return_value = {
+        1: {"state": "RUNNING", "reason": None, "errors": [], "next_transition_at": None},
+        2: {"state": "RUNNING", "reason": None, "errors": [], "next_transition_at": None},
+    }
+
+    async def _process_job_crd(job_status: JobStatus, key: str, slurm_job: dict) -> None:
+        if key == "slow":
+            await asyncio.sleep(10)
+
+    mocked_process_job_crd.side_effect = _process_job_crd
+
+    started_at = time.monotonic()
+    await reconcile_jobs(
+        {"fast": JobStatus(slurmJobId=1), "slow": JobStatus(slurmJobId=2)},
+        deadline=time.monotonic() + 0.1,
+    )
+
+    assert time.monotonic() - started_at < 1
+    # the slow job is first in line for the next run, the other one backs off as usual
+    assert mocked_poll_planner.pop_due(10) == ["slow"]
+    assert "fast" in mocked_poll_planner
+
+
+@pytest.mark.asyncio
+async def test_run_coroutines__concurrency_limit(init_logging_in_testing):
+    running = 0
+    max_running = 0
+
+    async def _job(index: int) -> int:
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return index
+
+    started_at = time.monotonic()
+    results = await run_coroutines(*(_job(index) for index in range(20)), concurrency=5)
+
+    assert results == list(range(20))
+    assert max_running == 5
+    # 20 jobs of 10ms each, 5 at a time, take about 4 rounds instead of 20
+    assert time.monotonic() - started_at < 0.15
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.scheduler.patch_object_status")
+async def test_process_job_crd__skips_unchanged_status(
+    mocked_patch_object_status: mock.AsyncMock, init_logging_in_testing
+):
+    job_status = JobStatus(
+        slurmJobId=1, state="RUNNING", reason="None", errors=None
+    )
+
+    await process_job_crd(job_status, "dummy", {"state": "RUNNING", "reason": "None", "errors": []})
+
+    mocked_patch_object_status.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.scheduler.patch_object_status")
+async def test_process_job_crd__patches_only_changed_fields(
+    mocked_patch_object_status: mock.AsyncMock, init_logging_in_testing
+):
+    job_status = JobStatus(
+        slurmJobId=1, state="PENDING", reason="Priority", errors=[]
+    )
+
+    with mock.patch("pykubeslurm.scheduler.datetime_in_string", return_value="now"):
+        await process_job_crd(
+            job_status, "jobs/dummy", {"state": "RUNNING", "reason": "Priority", "errors": []}
+        )
+
+    mocked_patch_object_status.assert_awaited_once_with(
+        "dummy", {"status": {"state": "RUNNING", "updatedAt": "now"}}, "jobs"
+    )
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.scheduler.mark_finished")
+@mock.patch("pykubeslurm.scheduler.patch_object_status")
+async def test_process_job_crd__labels_finished_jobs(
+    mocked_patch_object_status: mock.AsyncMock,
+    mocked_mark_finished: mock.AsyncMock,
+    init_logging_in_testing,
+):
+    job_status = JobStatus(slurmJobId=1, state="RUNNING", reason="None", errors=[])
+
+    await process_job_crd(job_status, "jobs/dummy", {"state": "RUNNING", "reason": "Priority"})
+    mocked_mark_finished.assert_not_awaited()
+
+    await process_job_crd(job_status, "jobs/dummy", {"state": "COMPLETED", "reason": "None"})
+    mocked_mark_finished.assert_awaited_once_with("dummy", "jobs")
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.scheduler.job_store")
+@mock.patch("pykubeslurm.scheduler.coordinator")
+@mock.patch("pykubeslurm.scheduler.async_backend_client")
+@mock.patch("pykubeslurm.scheduler.process_job_crd")
+@mock.patch("pykubeslurm.scheduler.fetch_jobs_state")
+async def test_reconcile_jobs__skips_jobs_no_longer_owned(
+    mocked_fetch_jobs_state: mock.AsyncMock,
+    mocked_process_job_crd: mock.AsyncMock,
+    mocked_async_backend_client: mock.MagicMock,
+    mocked_coordinator: mock.MagicMock,
+    mocked_job_store: mock.MagicMock,
+    init_logging_in_testing,
+):
+    mocked_fetch_jobs_state.return_value = {
+        1: {"state": "RUNNING", "reason": None, "errors": [], "next_transition_at": None},
+    }
+    mocked_job_store.get.return_value = {"metadata": {"name": "dummy"}}
+    # lost while the Slurm jobs were being fetched
+    mocked_coordinator.owns.return_value = False
+
+    await reconcile_jobs({"jobs/dummy": JobStatus(slurmJobId=1)})
+
+    mocked_process_job_crd.assert_not_awaited()
@@ -0,0 +1,182 @@
+"""This module contains unit tests for the `slurmrestd_interface.py` module."""
+import asyncio
+import threading
+import time
+from pathlib import Path
+from unittest import mock
+
+import httpx
+import pytest
+from jose import jwt
+from prometheus_client import REGISTRY
+
+from pykubeslurm.settings import SETTINGS
+from pykubeslurm.slurmrestd_interface import (
+    AsyncBackendClient,
+    SlurmrestdAuth,
+    TokenCache,
+    _token_path,
+)
+
+
+def _token_cache_requests(result: str) -> float:
+    name = "pykubeslurm_token_cache_requests_total"
+    return REGISTRY.get_sample_value(name, {"result": result}) or 0
+
+
+@pytest.fixture
+def jwt_key(tmp_path: Path):
+    key_path = tmp_path / "jwt.key"
+    key_path.write_text("dummy-secret")
+    with mock.patch.object(SETTINGS, "SLURMRESTD_JWT_KEY_PATH", key_path), mock.patch.object(
+        SETTINGS, "CACHE_DIR", tmp_path / "cache"
+    ):
+        yield "dummy-secret"
+
+
+@pytest.mark.asyncio
+async def test_token_cache__mints_once_and_serves_from_memory(
+    jwt_key: str, init_logging_in_testing
+):
+    token_cache = TokenCache()
+    hits = _token_cache_requests("hit")
+    misses = _token_cache_requests("miss")
+
+    with mock.patch(
+        "pykubeslurm.slurmrestd_interface._load_jwt_key_string", return_value=jwt_key
+    ) as mocked_load_jwt_key_string:
+        token = await token_cache.async_get("ubuntu")
+        assert await token_cache.async_get("ubuntu") == token
+
+    mocked_load_jwt_key_string.assert_called_once_with()
+    assert jwt.decode(token, jwt_key)["sun"] == "ubuntu"
+    assert _token_cache_requests("hit") == hits + 1
+    assert _token_cache_requests("miss") == misses + 1
+
+
+@pytest.mark.asyncio
+async def test_token_cache__warm_start_from_disk(jwt_key: str, init_logging_in_testing):
+    token = await TokenCache().async_get("ubuntu")
+
+    with mock.patch(
+        "pykubeslurm.slurmrestd_interface._generate_token",
+        return_value=("another-token", time.time() + 3600),
+    ) as mocked_generate_token:
+        assert await TokenCache().async_get("ubuntu") == token
+        # the token on disk was issued for another user
+        await TokenCache().async_get("another-user")
+
+    mocked_generate_token.assert_called_once_with("another-user")
+
+
+@pytest.mark.asyncio
+async def test_token_cache__refresh_before_expiration(jwt_key: str, init_logging_in_testing):
+    token_cache = TokenCache()
+    now = time.time()
+
+    with mock.patch(
+        "pykubeslurm.slurmrestd_interface._generate_token", return_value=("new-token", now + 3600)
+    ) as mocked_generate_token:
+        # still valid, but within the refresh margin: served while refreshed in the background
+        token_cache._tokens["ubuntu"] = ("old-token", now + 60)
+        assert await token_cache.async_get("ubuntu") == "old-token"
+        for _ in range(100):
+            if token_cache._tokens["ubuntu"][0] == "new-token":
+                break
+            await asyncio.sleep(0.01)
+        assert await token_cache.async_get("ubuntu") == "new-token"
+
+        # expired: refreshed right away
+        token_cache._tokens["ubuntu"] = ("expired-token", now)
+        assert await token_cache.async_get("ubuntu") == "new-token"
+
+    assert mocked_generate_token.call_count == 2
+    # refreshed in the executor of the loop, not in a thread of its own
+    assert not any(thread.name.startswith("TokenRefresh") for thread in threading.enumerate())
+
+
+@pytest.mark.asyncio
+async def test_token_cache__bounded_lru_per_user(jwt_key: str, init_logging_in_testing):
+    token_cache = TokenCache(max_size=2)
+
+    first_token = await token_cache.async_get("first")
+    await token_cache.async_get("second")
+    # touching "first" makes "second" the least recently used user
+    assert await token_cache.async_get("first") == first_token
+    await token_cache.async_get("third")
+
+    assert len(token_cache) == 2
+    assert set(token_cache._tokens) == {"first", "third"}
+    # every user has its own token file to warm start from
+    assert sorted(path.name for path in (SETTINGS.CACHE_DIR / "slurmrestd/tokens").iterdir()) == [
+        "first",
+        "second",
+        "third",
+    ]
+    second_token = await TokenCache().async_get("second")
+    assert jwt.get_unverified_claims(second_token)["sun"] == "second"
+
+
+@pytest.mark.asyncio
+async def test_token_cache__mints_off_the_loop_once_per_user(
+    jwt_key: str, init_logging_in_testing
+):
+    token_cache = TokenCache()
+    minting_threads: list[str] = []
+
+    def _generate_token(username: str) -> tuple[str, float]:
+        minting_threads.append(threading.current_thread().name)
+        time.sleep(0.05)
+        return f"{username}-token", time.time() + 3600
+
+    with mock.patch("pykubeslurm.slurmrestd_interface._generate_token", _generate_token):
+        tokens = await asyncio.gather(*(token_cache.async_get("ubuntu") for _ in range(5)))
+        assert await token_cache.async_get("ubuntu") == "ubuntu-token"
+
+    assert tokens == ["ubuntu-token"] * 5
+    assert len(minting_threads) == 1
+    assert minting_threads[0] != threading.current_thread().name
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.slurmrestd_interface.token_cache")
+async def test_slurmrestd_auth__injects_the_token_of_the_user(mocked_token_cache: mock.Mock):
+    mocked_token_cache.async_get = mock.AsyncMock(return_value="dummy-token")
+    seen_headers: list[httpx.Headers] = []
+
+    def _handler(request: httpx.Request) -> httpx.Response:
+        seen_headers.append(request.headers)
+        return httpx.Response(200)
+
+    async with httpx.AsyncClient(transport=httpx.MockTransport(_handler)) as client:
+        await client.get("http://slurmrestd:6820/slurm/v0.0.36/jobs", auth=SlurmrestdAuth("ubuntu"))
+
+    assert seen_headers[0]["x-slurm-user-name"] == "ubuntu"
+    assert seen_headers[0]["x-slurm-user-token"] == "dummy-token"
+    mocked_token_cache.async_get.assert_awaited_once_with("ubuntu")
+
+
+def test_token_path__rejects_unsafe_usernames(jwt_key: str):
+    assert _token_path("ubuntu") == SETTINGS.CACHE_DIR / "slurmrestd/tokens/ubuntu"
+    assert _token_path("../ubuntu") is None
+    assert _token_path("..") is None
+    assert _token_path("") is None
+
+
+def test_slurmrestd_auth__only_for_asynchronous_clients():
+    with httpx.Client(transport=httpx.MockTransport(lambda request: httpx.Response(200))) as client:
+        with pytest.raises(RuntimeError):
+            client.get("http://slurmrestd:6820/slurm/v0.0.36/jobs", auth=SlurmrestdAuth("ubuntu"))
+
+
+@pytest.mark.asyncio
+async def test_backend_client__observes_request_latency_per_endpoint(init_logging_in_testing):
+    labels = {"method": "GET", "endpoint": "/slurmdb/v0.0.36/job/{job_id}", "status": "200"}
+    name = "pykubeslurm_slurmrestd_request_duration_seconds_count"
+    before = REGISTRY.get_sample_value(name, labels) or 0
+    request = httpx.Request("GET", "http://slurmrestd:6820/slurmdb/v0.0.36/job/42")
+
+    await AsyncBackendClient._log_request(request)
+    await AsyncBackendClient._log_response(httpx.Response(200, request=request))
+
+    assert REGISTRY.get_sample_value(name, labels) == before + 1
@@ -0,0 +1,221 @@
+import asyncio
+import socket
+import threading
+import time
+from collections.abc import Iterator
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from pykubeslurm.cache import JobStore
+from pykubeslurm.planner import PollPlanner
+from pykubeslurm.schemas import JobStatus
+from pykubeslurm.state_sources import (
+    FileStateSource,
+    JobEventDispatcher,
+    SocketStateSource,
+    StateSource,
+    apply_job_event,
+    parse_job_event,
+    state_feed,
+)
+
+
+def _collect(
+    source: StateSource, count: int
+) -> tuple[list[str], threading.Event, threading.Thread]:
+    """Read lines of the source in a thread until `count` lines arrived."""
+    lines: list[str] = []
+    stop = threading.Event()
+
+    def _read() -> None:
+        for line in source.lines(stop):
+            lines.append(line)
+            if len(lines) == count:
+                stop.set()
+
+    thread = threading.Thread(target=_read, daemon=True)
+    thread.start()
+    return lines, stop, thread
+
+
+def test_parse_job_event__jobcomp_filetxt_line():
+    line = (
+        "JobId=42 UserId=ubuntu(1000) GroupId=ubuntu(1000) Name=dummy JobState=COMPLETED "
+        "Partition=debug TimeLimit=UNLIMITED NodeList=node1\n"
+    )
+
+    assert parse_job_event(line) == (
+        42,
+        {"state": "COMPLETED", "reason": None, "errors": [], "next_transition_at": None},
+    )
+
+
+def test_parse_job_event__keeps_the_slurm_state():
+    assert parse_job_event("JobId=42 JobState=TIMEOUT\n") == (
+        42,
+        {"state": "TIMEOUT", "reason": None, "errors": [], "next_transition_at": None},
+    )
+
+
+@pytest.mark.parametrize(
+    "line", ["", "garbage\n", "JobId=42 JobState=BOGUS\n", "JobId=abc JobState=RUNNING\n"]
+)
+def test_parse_job_event__ignores_unknown_lines(line: str):
+    assert parse_job_event(line) is None
+
+
+def test_file_state_source__follows_appended_and_rotated_lines(tmp_path: Path):
+    path = tmp_path / "jobcomp.log"
+    path.write_text("JobId=1 JobState=COMPLETED\n")
+
+    lines, stop, thread = _collect(FileStateSource(path), 3)
+    time.sleep(0.1)
+    with path.open("a") as stream:
+        stream.write("JobId=2 JobState=RUNNING\nJobId=3 Job")
+        stream.flush()
+        time.sleep(0.1)
+        stream.write("State=PENDING\n")
+    time.sleep(0.6)
+    path.rename(tmp_path / "jobcomp.log.1")
+    path.write_text("JobId=4 JobState=FAILED\n")
+
+    thread.join(timeout=5)
+    stop.set()
+
+    # the line written before the source started is left to the reconciliation
+    assert lines == [
+        "JobId=2 JobState=RUNNING\n",
+        "JobId=3 JobState=PENDING\n",
+        "JobId=4 JobState=FAILED\n",
+    ]
+
+
+def test_socket_state_source__reads_every_connection(tmp_path: Path):
+    path = tmp_path / "state.sock"
+    lines, stop, thread = _collect(SocketStateSource(path), 3)
+    while not path.exists():
+        time.sleep(0.01)
+
+    for payload in (
+        b"JobId=1 JobState=RUNNING\n",
+        b"JobId=2 JobState=RUNNING\nJobId=1 JobState=COMPLETED\n",
+    ):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(str(path))
+            client.sendall(payload)
+
+    thread.join(timeout=5)
+    stop.set()
+
+    assert lines == [
+        "JobId=1 JobState=RUNNING\n",
+        "JobId=2 JobState=RUNNING\n",
+        "JobId=1 JobState=COMPLETED\n",
+    ]
+    assert not path.exists()
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.state_sources.process_job_crd")
+@mock.patch("pykubeslurm.scheduler.poll_planner", new_callable=PollPlanner)
+@mock.patch("pykubeslurm.state_sources.job_store", new_callable=JobStore)
+async def test_apply_job_event__updates_the_backed_slurm_job(
+    mocked_job_store: JobStore,
+    mocked_poll_planner: PollPlanner,
+    mocked_process_job_crd: mock.AsyncMock,
+    init_logging_in_testing,
+):
+    mocked_job_store.upsert(
+        {"metadata": {"name": "dummy"}, "status": {"slurmJobId": 42, "state": "PENDING"}}
+    )
+    slurm_job = {"state": "RUNNING", "reason": None, "errors": [], "next_transition_at": None}
+
+    await apply_job_event(42, slurm_job)  # type: ignore
+    await apply_job_event(43, slurm_job)  # type: ignore
+
+    mocked_process_job_crd.assert_awaited_once_with(
+        JobStatus(slurmJobId=42, state="PENDING"), "dummy", slurm_job
+    )
+    assert "dummy" in mocked_poll_planner
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.state_sources.runtime")
+@mock.patch("pykubeslurm.state_sources.apply_job_event")
+async def test_state_feed__applies_the_pushed_job_events(
+    mocked_apply_job_event: mock.AsyncMock, mocked_runtime: mock.Mock, init_logging_in_testing
+):
+    class _Source(StateSource):
+        def lines(self, stop: threading.Event) -> Iterator[str]:
+            yield "JobId=1 JobState=RUNNING\n"
+            yield "not a job event\n"
+            yield "JobId=2 JobState=COMPLETED\n"
+            stop.set()
+
+    mocked_runtime.loop = asyncio.get_running_loop()
+    with mock.patch("pykubeslurm.state_sources.JobEventDispatcher") as mocked_dispatcher_class:
+        dispatcher = JobEventDispatcher(mocked_runtime.loop)
+        mocked_dispatcher_class.return_value = dispatcher
+        await asyncio.to_thread(state_feed, threading.Event(), _Source())
+        await dispatcher.drain()
+
+    assert [call.args[0] for call in mocked_apply_job_event.await_args_list] == [1, 2]
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.state_sources.apply_job_event")
+async def test_job_event_dispatcher__applies_the_events_of_a_job_in_order(
+    mocked_apply_job_event: mock.AsyncMock, init_logging_in_testing
+):
+    applied: list[tuple[int, str]] = []
+    first_event_applied = asyncio.Event()
+
+    async def _apply_job_event(slurm_job_id: int, slurm_job: dict) -> None:
+        if slurm_job["state"] == "RUNNING" and slurm_job_id == 1:
+            # the feed doesn't wait for the slow status patch of the first event
+            await first_event_applied.wait()
+        if slurm_job["state"] == "FAILED":
+            raise RuntimeError("dummy")
+        applied.append((slurm_job_id, slurm_job["state"]))
+
+    mocked_apply_job_event.side_effect = _apply_job_event
+    dispatcher = JobEventDispatcher(asyncio.get_running_loop())
+
+    def _feed() -> None:
+        for slurm_job_id, state in ((1, "RUNNING"), (2, "FAILED"), (2, "RUNNING"), (1, "DONE")):
+            dispatcher.dispatch(slurm_job_id, {"state": state})  # type: ignore
+
+    await asyncio.to_thread(_feed)
+    await asyncio.sleep(0.05)
+    assert applied == [(2, "RUNNING")]
+
+    first_event_applied.set()
+    await dispatcher.drain()
+
+    assert applied == [(2, "RUNNING"), (1, "RUNNING"), (1, "DONE")]
+
+
+def test_socket_state_source__closes_silent_connections(tmp_path: Path):
+    path = tmp_path / "state.sock"
+    with mock.patch("pykubeslurm.state_sources.CONNECTION_IDLE_TIMEOUT", 0.1):
+        lines, stop, thread = _collect(SocketStateSource(path), 1)
+        while not path.exists():
+            time.sleep(0.01)
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as silent_client:
+            silent_client.connect(str(path))
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                client.connect(str(path))
+                client.sendall(b"JobId=1 JobState=RUNNING")
+
+            thread.join(timeout=5)
+            stop.set()
+
+    assert lines == ["JobId=1 JobState=RUNNING"]
+
+
+def test_state_feed__without_source(init_logging_in_testing):
+    with mock.patch("pykubeslurm.state_sources.build_state_source", return_value=None):
+        state_feed(threading.Event())
@@ -0,0 +1,185 @@
+"""This module contains unit tests for the `submitter.py` module."""
+import asyncio
+import time
+from typing import Any
+from unittest import mock
+
+import httpx
+import pytest
+
+from pykubeslurm.resilience import RetryPolicy
+from pykubeslurm.schemas import Job
+from pykubeslurm.settings import SETTINGS
+from pykubeslurm.submitter import JobSubmitter
+
+
+def _jobs(job_object: dict[str, Any], count: int) -> list[Job]:
+    return [
+        Job(**{**job_object, "metadata": {**job_object["metadata"], "uid": f"uid-{index}"}})
+        for index in range(count)
+    ]
+
+
+@pytest.mark.asyncio
+@mock.patch.object(SETTINGS, "SUBMISSION_CONCURRENCY", 2)
+@mock.patch("pykubeslurm.submitter.async_backend_client", return_value="client")
+async def test_job_submitter__submits_with_bounded_concurrency(
+    mocked_async_backend_client: mock.MagicMock,
+    job_object: dict[str, Any],
+    init_logging_in_testing,
+):
+    running = 0
+    max_running = 0
+
+    async def _submit(client: str, job_schema: Job) -> None:
+        nonlocal running, max_running
+        assert client == "client"
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    submitter = JobSubmitter(_submit)
+    for job_schema in _jobs(job_object, 10):
+        submitter.add(job_schema)
+    submitter.start()
+    await submitter.stop()
+
+    assert max_running == 2
+    assert submitter.submitted == 10
+    assert submitter.throughput > 0
+
+
+@pytest.mark.asyncio
+@mock.patch.object(SETTINGS, "SUBMISSION_CONCURRENCY", 2)
+@mock.patch("pykubeslurm.submitter.async_backend_client", return_value="client")
+async def test_job_submitter__slow_submissions_dont_hold_the_others_back(
+    mocked_async_backend_client: mock.MagicMock,
+    job_object: dict[str, Any],
+    init_logging_in_testing,
+):
+    submitted: list[str] = []
+    slow_submission_released = asyncio.Event()
+
+    async def _submit(client: str, job_schema: Job) -> None:
+        if job_schema.metadata.uid == "uid-0":
+            await slow_submission_released.wait()
+        submitted.append(job_schema.metadata.uid)  # type: ignore
+
+    submitter = JobSubmitter(_submit)
+    submitter.start()
+    for job_schema in _jobs(job_object, 5):
+        submitter.add(job_schema)
+    while len(submitted) < 4:
+        await asyncio.sleep(0.01)
+
+    assert submitted == ["uid-1", "uid-2", "uid-3", "uid-4"]
+    slow_submission_released.set()
+    await submitter.stop(timeout=1)
+    assert submitted[-1] == "uid-0"
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.submitter.async_backend_client", return_value="client")
+async def test_job_submitter__counts_only_successful_submissions(
+    mocked_async_backend_client: mock.MagicMock,
+    job_object: dict[str, Any],
+    init_logging_in_testing,
+):
+    async def _submit(client: str, job_schema: Job) -> None:
+        if job_schema.metadata.uid == "uid-0":
+            raise RuntimeError("dummy")
+
+    submitter = JobSubmitter(_submit)
+    for job_schema in _jobs(job_object, 3):
+        submitter.add(job_schema)
+    submitter.start()
+    await submitter.stop(timeout=1)
+
+    assert submitter.submitted == 2
+    assert submitter._in_flight == set()
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.submitter.async_backend_client", return_value="client")
+async def test_job_submitter__stop_cancels_what_overruns_the_timeout(
+    mocked_async_backend_client: mock.MagicMock,
+    job_object: dict[str, Any],
+    init_logging_in_testing,
+):
+    async def _submit(client: str, job_schema: Job) -> None:
+        await asyncio.sleep(10)
+
+    submitter = JobSubmitter(_submit)
+    submitter.start()
+    for job_schema in _jobs(job_object, 2):
+        submitter.add(job_schema)
+
+    started_at = time.monotonic()
+    await submitter.stop(timeout=0.1)
+
+    assert time.monotonic() - started_at < 1
+    assert submitter.submitted == 0
+    # the cancelled jobs can be queued again
+    assert submitter._in_flight == set()
+
+
+@pytest.mark.asyncio
+@mock.patch(
+    "pykubeslurm.submitter.retry_policy",
+    RetryPolicy(attempts=3, base_delay=0.001, max_delay=0.001),
+)
+@mock.patch("pykubeslurm.submitter.async_backend_client", return_value="client")
+async def test_job_submitter__submits_again_what_never_reached_slurmrestd(
+    mocked_async_backend_client: mock.MagicMock,
+    job_object: dict[str, Any],
+    init_logging_in_testing,
+):
+    attempts: list[str] = []
+
+    async def _submit(client: str, job_schema: Job) -> None:
+        attempts.append(job_schema.metadata.name)
+        if len(attempts) < 3:
+            raise httpx.ConnectError("refused")
+
+    submitter = JobSubmitter(_submit)
+    submitter.start()
+    submitter.add(Job(**job_object))
+    await asyncio.sleep(0.1)
+    await submitter.stop(timeout=1)
+
+    assert attempts == ["dummy", "dummy", "dummy"]
+    assert submitter._in_flight == set()
+    assert submitter._attempts == {}
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.submitter.async_backend_client", return_value="client")
+async def test_job_submitter__doesnt_submit_again_what_may_have_reached_slurmrestd(
+    mocked_async_backend_client: mock.MagicMock,
+    job_object: dict[str, Any],
+    init_logging_in_testing,
+):
+    submit = mock.AsyncMock(side_effect=httpx.ReadTimeout("timed out"))
+    unconfirmed = mock.AsyncMock()
+    job_schema = Job(**job_object)
+
+    submitter = JobSubmitter(submit, unconfirmed=unconfirmed)
+    submitter.start()
+    submitter.add(job_schema)
+    await submitter.stop(timeout=1)
+
+    submit.assert_awaited_once()
+    unconfirmed.assert_awaited_once_with(job_schema, "ReadTimeout")
+    assert submitter.pending == 0
+    assert submitter.submitted == 0
+
+
+def test_job_submitter__skips_jobs_already_queued(job_object: dict[str, Any]):
+    submitter = JobSubmitter(mock.AsyncMock())
+    job_schema = Job(**job_object)
+
+    submitter.add(job_schema)
+    submitter.add(job_schema)
+
+    assert submitter.pending == 1
@@ -0,0 +1,85 @@
+"""This module contains unit tests for the `supervisor.py` module."""
+import asyncio
+import threading
+from unittest import mock
+
+import pytest
+
+from pykubeslurm.supervisor import run_operator
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.supervisor.leader_election")
+@mock.patch("pykubeslurm.supervisor.state_feed")
+@mock.patch("pykubeslurm.supervisor.reconciler")
+@mock.patch("pykubeslurm.supervisor.event_listener")
+@mock.patch("pykubeslurm.supervisor.start_health_check")
+async def test_run_operator__shuts_every_subsystem_down(
+    mocked_start_health_check: mock.AsyncMock,
+    mocked_event_listener: mock.AsyncMock,
+    mocked_reconciler: mock.AsyncMock,
+    mocked_state_feed: mock.MagicMock,
+    mocked_leader_election: mock.MagicMock,
+    init_logging_in_testing,
+):
+    mocked_start_health_check.return_value.cleanup = mock.AsyncMock()
+    drained: list[str] = []
+
+    async def _wait_and_drain(shutdown: asyncio.Event) -> None:
+        await shutdown.wait()
+        drained.append("event_listener")
+
+    async def _wait(shutdown: asyncio.Event) -> None:
+        await shutdown.wait()
+
+    def _hold(thread_event: threading.Event) -> None:
+        thread_event.wait()
+
+    mocked_event_listener.side_effect = _wait_and_drain
+    mocked_reconciler.side_effect = _wait
+    mocked_leader_election.side_effect = _hold
+    # disabled subsystems return right away without stopping the others
+    mocked_state_feed.return_value = None
+
+    shutdown = asyncio.Event()
+    task = asyncio.create_task(run_operator(shutdown))
+    await asyncio.sleep(0.05)
+    assert not task.done()
+
+    shutdown.set()
+    await asyncio.wait_for(task, 1)
+
+    assert drained == ["event_listener"]
+    mocked_state_feed.assert_called_once()
+    mocked_leader_election.assert_called_once()
+    mocked_start_health_check.return_value.cleanup.assert_awaited_once_with()
+
+
+@pytest.mark.asyncio
+@mock.patch("pykubeslurm.supervisor.leader_election")
+@mock.patch("pykubeslurm.supervisor.state_feed")
+@mock.patch("pykubeslurm.supervisor.reconciler")
+@mock.patch("pykubeslurm.supervisor.event_listener")
+@mock.patch("pykubeslurm.supervisor.start_health_check")
+async def test_run_operator__stops_when_a_subsystem_fails(
+    mocked_start_health_check: mock.AsyncMock,
+    mocked_event_listener: mock.AsyncMock,
+    mocked_reconciler: mock.AsyncMock,
+    mocked_state_feed: mock.MagicMock,
+    mocked_leader_election: mock.MagicMock,
+    init_logging_in_testing,
+):
+    mocked_start_health_check.return_value.cleanup = mock.AsyncMock()
+
+    async def _wait(shutdown: asyncio.Event) -> None:
+        await shutdown.wait()
+
+    mocked_event_listener.side_effect = _wait
+    mocked_reconciler.side_effect = RuntimeError("dummy")
+    mocked_state_feed.return_value = None
+    mocked_leader_election.return_value = None
+
+    with pytest.raises(RuntimeError, match="dummy"):
+        await asyncio.wait_for(run_operator(), 1)
+
+    mocked_start_health_check.return_value.cleanup.assert_awaited_once_with()
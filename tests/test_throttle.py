@@ -0,0 +1,204 @@
+"""This module contains unit tests for the `throttle.py` module."""
+import asyncio
+from unittest import mock
+
+import httpx
+import pytest
+from prometheus_client import REGISTRY
+
+from pykubeslurm.slurmrestd_interface import AsyncBackendClient, overload_reason
+from pykubeslurm.throttle import AdaptiveThrottle, RequestPriority, TokenBucket
+
+
+def test_token_bucket__refills_at_the_given_rate():
+    with mock.patch("pykubeslurm.throttle.time.monotonic", return_value=100.0) as mocked_now:
+        bucket = TokenBucket(rate=2, burst=2)
+        assert bucket.try_take()
+        assert bucket.try_take()
+        assert not bucket.try_take()
+        assert bucket.delay() == 0.5
+
+        mocked_now.return_value = 100.5
+        assert bucket.try_take()
+        assert not bucket.try_take()
+
+        # never holds more than the burst
+        mocked_now.return_value = 200.0
+        assert bucket.try_take()
+        assert bucket.try_take()
+        assert not bucket.try_take()
+
+
+def test_token_bucket__reserves_tokens_ahead():
+    with mock.patch("pykubeslurm.throttle.time.monotonic", return_value=100.0):
+        bucket = TokenBucket(rate=10, burst=1)
+        assert bucket.reserve() == 0
+        assert bucket.reserve() == pytest.approx(0.1)
+        assert bucket.reserve() == pytest.approx(0.2)
+        assert not bucket.try_take()
+
+
+@pytest.mark.asyncio
+async def test_adaptive_throttle__lets_higher_priorities_through_first():
+    throttle = AdaptiveThrottle(rate=1000, burst=1000, min_limit=1, max_limit=1, latency_target=60)
+    started_at = await throttle.acquire()
+    order = []
+
+    async def _request(priority: RequestPriority) -> None:
+        request_started_at = await throttle.acquire(priority)
+        order.append(priority)
+        throttle.release(request_started_at, overloaded=False)
+
+    requests = [
+        asyncio.create_task(_request(priority))
+        for priority in (RequestPriority.POLL, RequestPriority.UPDATE, RequestPriority.SUBMISSION)
+    ]
+    await asyncio.sleep(0)
+    throttle.release(started_at, overloaded=False)
+    await asyncio.gather(*requests)
+
+    assert order == [RequestPriority.SUBMISSION, RequestPriority.UPDATE, RequestPriority.POLL]
+
+
+@pytest.mark.asyncio
+async def test_adaptive_throttle__waits_for_tokens():
+    throttle = AdaptiveThrottle(rate=100, burst=1, min_limit=1, max_limit=10, latency_target=60)
+    loop = asyncio.get_running_loop()
+
+    started_at = loop.time()
+    await throttle.acquire()
+    await throttle.acquire()
+    await throttle.acquire()
+
+    assert loop.time() - started_at >= 0.015
+    assert throttle.in_flight == 3
+
+
+@pytest.mark.asyncio
+async def test_adaptive_throttle__additive_increase_multiplicative_decrease():
+    throttle = AdaptiveThrottle(rate=1000, burst=1000, min_limit=2, max_limit=16, latency_target=60)
+    started_at = [await throttle.acquire() for _ in range(3)]
+
+    # a burst of failures sent before the decrease only halves the limit once
+    throttle.release(started_at[0], overloaded=True)
+    throttle.release(started_at[1], overloaded=True)
+    assert throttle.limit == 8
+
+    throttle.release(started_at[2], overloaded=False)
+    assert throttle.limit == 8.125
+
+    for _ in range(3):
+        throttle.release(await throttle.acquire(), overloaded=True)
+    assert throttle.limit == 2
+
+    throttle.limit = 16
+    throttle.release(await throttle.acquire(), overloaded=False)
+    assert throttle.limit == 16
+
+
+@pytest.mark.asyncio
+async def test_adaptive_throttle__cancelled_waiters_give_their_turn_up():
+    throttle = AdaptiveThrottle(rate=1000, burst=1000, min_limit=1, max_limit=1, latency_target=60)
+    started_at = await throttle.acquire()
+    cancelled = asyncio.create_task(throttle.acquire(RequestPriority.SUBMISSION))
+    waiting = asyncio.create_task(throttle.acquire())
+    await asyncio.sleep(0)
+
+    cancelled.cancel()
+    await asyncio.sleep(0)
+    throttle.release(started_at, overloaded=False)
+    await asyncio.wait_for(waiting, timeout=1)
+
+    assert throttle.in_flight == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "status_code, body, reason",
+    [
+        (503, {}, "5xx"),
+        (502, {}, "5xx"),
+        (500, {}, "5xx"),
+        (500, {"errors": [{"error_number": 5005, "error": "Zero Bytes were transmitted"}]}, "5005"),
+        (500, {"errors": [{"error_number": 1804, "error": "Communications backoff"}]}, "1804"),
+    ],
+)
+async def test_async_backend_client__backs_off_on_overload(
+    status_code: int, body: dict, reason: str, init_logging_in_testing
+):
+    slurmrestd_client = AsyncBackendClient()
+    slurmrestd_client._transport = httpx.MockTransport(
+        lambda request: httpx.Response(status_code, json=body)
+    )
+    limit = slurmrestd_client.throttle.limit
+    name = "pykubeslurm_slurmrestd_overload_signals_total"
+    before = REGISTRY.get_sample_value(name, {"reason": reason}) or 0
+
+    with mock.patch("pykubeslurm.slurmrestd_interface.token_cache") as mocked_token_cache:
+        mocked_token_cache.async_get = mock.AsyncMock(return_value="dummy-token")
+        # submissions aren't idempotent, so they are sent once
+        await slurmrestd_client.post(
+            "/slurm/v0.0.36/job/submit", extensions={"priority": RequestPriority.SUBMISSION}
+        )
+    await slurmrestd_client.aclose()
+
+    assert slurmrestd_client.throttle.limit == limit / 2
+    assert slurmrestd_client.throttle.in_flight == 0
+    assert REGISTRY.get_sample_value(name, {"reason": reason}) == before + 1
+
+
+@pytest.mark.asyncio
+async def test_async_backend_client__slurm_errors_are_not_overload(init_logging_in_testing):
+    sent = []
+
+    def _handler(request: httpx.Request) -> httpx.Response:
+        sent.append(request.method)
+        return httpx.Response(
+            500, json={"errors": [{"error_number": 2049, "error": "Invalid job id specified"}]}
+        )
+
+    slurmrestd_client = AsyncBackendClient()
+    slurmrestd_client._transport = httpx.MockTransport(_handler)
+    limit = slurmrestd_client.throttle.limit
+    # one more failure would open the breaker
+    slurmrestd_client.breaker.failures = slurmrestd_client.breaker.threshold - 1
+
+    with mock.patch("pykubeslurm.slurmrestd_interface.token_cache") as mocked_token_cache:
+        mocked_token_cache.async_get = mock.AsyncMock(return_value="dummy-token")
+        response = await slurmrestd_client.get("/slurm/v0.0.36/job/1")
+    await slurmrestd_client.aclose()
+
+    # an ordinary Slurm error is answered, neither retried nor slowing the next requests
+    assert response.status_code == 500
+    assert sent == ["GET"]
+    assert slurmrestd_client.throttle.limit == limit
+    assert not slurmrestd_client.breaker.is_open
+
+
+def test_overload_reason__only_reads_the_body_of_errors():
+    response = mock.Mock(spec=httpx.Response, is_success=True)
+
+    assert overload_reason(response) is None
+    response.json.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_async_backend_client__latency_target_per_request(init_logging_in_testing):
+    slurmrestd_client = AsyncBackendClient()
+    slurmrestd_client._transport = httpx.MockTransport(
+        lambda request: httpx.Response(200, json={"jobs": []})
+    )
+    limit = slurmrestd_client.throttle.limit
+
+    with mock.patch("pykubeslurm.slurmrestd_interface.token_cache") as mocked_token_cache:
+        mocked_token_cache.async_get = mock.AsyncMock(return_value="dummy-token")
+        with mock.patch.object(slurmrestd_client.throttle, "latency_target", 0):
+            await slurmrestd_client.get(
+                "/slurm/v0.0.36/jobs", extensions={"latency_target": None}
+            )
+            assert slurmrestd_client.throttle.limit == limit
+            await slurmrestd_client.get("/slurm/v0.0.36/diag")
+    await slurmrestd_client.aclose()
+
+    # only the requests measured against the latency target can lower the limit
+    assert slurmrestd_client.throttle.limit == limit / 2
@@ -0,0 +1,198 @@
+"""This module contains unit tests for the `workqueue.py` module."""
+import asyncio
+import time
+
+import pytest
+
+from pykubeslurm.events import merge_events
+from pykubeslurm.resilience import RetryPolicy
+from pykubeslurm.schemas import KubernetesEvent, KubernetesEventType
+from pykubeslurm.workqueue import WorkerPool, WorkQueue
+
+
+class FixedRetryPolicy(RetryPolicy):
+    """Retry policy without jitter, so the tests know when the retries happen."""
+
+    def __init__(self) -> None:
+        super().__init__(attempts=5, base_delay=0.05, max_delay=0.05)
+
+    def backoff(self, attempt: int) -> float:
+        return self.base_delay
+
+
+@pytest.mark.asyncio
+async def test_work_queue__merges_pending_items():
+    queue: WorkQueue[int] = WorkQueue(merge=lambda pending, item: pending + item)
+    queue.add("first", 1)
+    queue.add("second", 10)
+    queue.add("first", 2)
+
+    assert len(queue) == 2
+    assert await queue.get() == ("first", 3)
+    assert await queue.get() == ("second", 10)
+
+
+@pytest.mark.asyncio
+async def test_work_queue__key_is_not_handed_out_while_processing():
+    queue: WorkQueue[int] = WorkQueue(merge=lambda pending, item: item)
+    queue.add("first", 1)
+    assert await queue.get() == ("first", 1)
+
+    queue.add("first", 2)
+    queue.add("second", 3)
+    assert await queue.get() == ("second", 3)
+    assert queue.get_nowait() is None
+
+    queue.done("first")
+    assert await queue.get() == ("first", 2)
+
+
+@pytest.mark.asyncio
+async def test_work_queue__shut_down_drains_the_queue():
+    queue: WorkQueue[int] = WorkQueue(merge=lambda pending, item: item)
+    queue.add("first", 1)
+    queue.shut_down()
+
+    assert await queue.get() == ("first", 1)
+    assert await queue.get() is None
+
+
+@pytest.mark.asyncio
+async def test_worker_pool__parallel_across_keys_ordered_within_a_key():
+    queue: WorkQueue[tuple[str, int]] = WorkQueue(merge=lambda pending, item: item)
+    processed: list[tuple[str, int]] = []
+
+    async def _handler(item: tuple[str, int]) -> None:
+        await asyncio.sleep(0.05)
+        processed.append(item)
+
+    pool = WorkerPool(queue, _handler, workers=4, name="TestWorker")
+    pool.start()
+    started_at = time.monotonic()
+    for index in range(4):
+        queue.add(f"key-{index}", (f"key-{index}", 0))
+    # the first item of the key is being processed, so this one waits for it
+    await asyncio.sleep(0.01)
+    queue.add("key-0", ("key-0", 1))
+    await pool.stop()
+
+    # four slow keys on four workers take roughly the time of two items in a row
+    assert time.monotonic() - started_at < 0.2
+    assert sorted(processed) == [("key-0", 0), ("key-0", 1)] + [
+        (f"key-{index}", 0) for index in range(1, 4)
+    ]
+    assert processed.index(("key-0", 0)) < processed.index(("key-0", 1))
+    assert sum(stats.processed for stats in pool.stats.values()) == 5
+    assert all(stats.average_seconds >= 0.05 for stats in pool.stats.values() if stats.processed)
+
+
+@pytest.mark.asyncio
+async def test_worker_pool__stop_cancels_what_overruns_the_timeout():
+    queue: WorkQueue[int] = WorkQueue(merge=lambda pending, item: item)
+    handled: list[int] = []
+
+    async def _handler(item: int) -> None:
+        await asyncio.sleep(item)
+        handled.append(item)
+
+    pool = WorkerPool(queue, _handler, workers=2, name="TestWorker")
+    pool.start()
+    queue.add("fast", 0)
+    queue.add("slow", 10)
+    started_at = time.monotonic()
+    await pool.stop(timeout=0.1)
+
+    assert time.monotonic() - started_at < 1
+    assert handled == [0]
+
+
+@pytest.mark.asyncio
+async def test_worker_pool__drain_waits_for_the_matching_items_only():
+    queue: WorkQueue[int] = WorkQueue(merge=lambda pending, item: item)
+    released = {0: asyncio.Event(), 1: asyncio.Event()}
+    handled: list[int] = []
+
+    async def _handler(item: int) -> None:
+        await released[item].wait()
+        handled.append(item)
+
+    pool = WorkerPool(queue, _handler, workers=2, name="TestWorker")
+    pool.start()
+    queue.add("even", 0)
+    queue.add("odd", 1)
+    await asyncio.sleep(0.01)
+
+    # nothing matching is being handled
+    await asyncio.wait_for(pool.drain(lambda item: item > 1), timeout=0.1)
+    draining = asyncio.create_task(pool.drain(lambda item: item == 1))
+    released[0].set()
+    await asyncio.sleep(0.01)
+    assert not draining.done()
+    released[1].set()
+    await asyncio.wait_for(draining, timeout=0.1)
+    await pool.stop()
+
+    assert handled == [0, 1]
+
+
+@pytest.mark.asyncio
+async def test_worker_pool__retries_failed_items_before_newer_ones(init_logging_in_testing):
+    # the pending item wins unless it is None, to tell which item was kept
+    queue: WorkQueue[None | int] = WorkQueue(
+        merge=lambda pending, item: pending if pending is not None else item
+    )
+    handled: list[None | int] = []
+    first_failure = asyncio.Event()
+    succeeded = asyncio.Event()
+
+    async def _handler(item: None | int) -> None:
+        handled.append(item)
+        if len(handled) < 3:
+            first_failure.set()
+            raise RuntimeError("failed")
+        succeeded.set()
+
+    pool = WorkerPool(queue, _handler, workers=1, name="TestWorker", retry=FixedRetryPolicy())
+    pool.start()
+    queue.add("key", 1)
+    await asyncio.wait_for(first_failure.wait(), timeout=1)
+    # arrives while the failed item waits to be retried
+    queue.add("key", None)
+    await asyncio.wait_for(succeeded.wait(), timeout=1)
+    await pool.stop()
+
+    assert handled == [1, 1, 1]
+    assert len(queue) == 0
+
+
+@pytest.mark.asyncio
+async def test_worker_pool__gives_up_after_the_last_attempt(init_logging_in_testing):
+    queue: WorkQueue[int] = WorkQueue(merge=lambda pending, item: item)
+    handled: list[int] = []
+
+    async def _handler(item: int) -> None:
+        handled.append(item)
+        raise RuntimeError("failed")
+
+    policy = RetryPolicy(attempts=2, base_delay=0.001, max_delay=0.001)
+    pool = WorkerPool(queue, _handler, workers=1, name="TestWorker", retry=policy)
+    pool.start()
+    queue.add("key", 1)
+    await asyncio.sleep(0.05)
+    await pool.stop()
+
+    assert handled == [1, 1, 1]
+
+
+def test_merge_events__added_then_modified_stays_added(job_object):
+    added = KubernetesEvent(raw_object={}, type=KubernetesEventType.ADDED, object=job_object)
+    modified = KubernetesEvent(
+        raw_object={}, type=KubernetesEventType.MODIFIED, object={**job_object, "status": {}}
+    )
+    deleted = KubernetesEvent(raw_object={}, type=KubernetesEventType.DELETED, object=job_object)
+
+    assert merge_events(added, modified) == KubernetesEvent(
+        raw_object={}, type=KubernetesEventType.ADDED, object={**job_object, "status": {}}
+    )
+    assert merge_events(added, deleted) == deleted
+    assert merge_events(modified, modified) == modified